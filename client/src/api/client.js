@@ -56,6 +56,61 @@ api.interceptors.response.use(
     }
 );
 
+// Server-Sent Events (served by the ASGI app). EventSource can't send headers, so the token goes in the query.
+// On an error (expired token, restarted server, or no /stream route under runserver) the stream is reopened
+// with a refreshed token, backing off up to STREAM_POLL_MS; `poll` refetches after every reconnect and on a
+// slow timer, so the page stays current even when streaming never comes back.
+const STREAM_RETRY_MS = 3000;
+const STREAM_POLL_MS = 2 * 60 * 1000;
+
+const refreshAccessToken = async () => {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (!refreshToken) return;
+    try {
+        const response = await axios.post(`${API_BASE_URL}/auth/token/refresh/`, { refresh: refreshToken });
+        localStorage.setItem('access_token', response.data.access);
+    } catch (err) {
+        // Dead refresh token; the next API request sends the user to login
+    }
+};
+
+const subscribe = (path, listeners, poll) => {
+    let source = null;
+    let retryTimer = null;
+    let retryMs = STREAM_RETRY_MS;
+    let closed = false;
+
+    const open = (reconnect) => {
+        source = new EventSource(`${API_BASE_URL}${path}?token=${localStorage.getItem('access_token')}`);
+        Object.entries(listeners).forEach(([type, listener]) => source.addEventListener(type, listener));
+        source.onopen = () => {
+            retryMs = STREAM_RETRY_MS;
+            // Catch up on whatever changed while disconnected
+            if (reconnect) poll();
+        };
+        source.onerror = () => {
+            source.close();
+            if (closed) return;
+            retryTimer = setTimeout(async () => {
+                await refreshAccessToken();
+                if (!closed) open(true);
+            }, retryMs);
+            retryMs = Math.min(retryMs * 2, STREAM_POLL_MS);
+        };
+    };
+
+    open(false);
+    const pollTimer = setInterval(poll, STREAM_POLL_MS);
+    return {
+        close: () => {
+            closed = true;
+            clearTimeout(retryTimer);
+            clearInterval(pollTimer);
+            source.close();
+        },
+    };
+};
+
 // Auth APIs
 export const authAPI = {
     login: (email, password) => api.post('/auth/login/', { email, password }),
@@ -84,6 +139,9 @@ export const appointmentAPI = {
     cancel: (id) => api.post(`/appointments/${id}/cancel/`),
     getQueue: (doctorId) => api.get(`/appointments/queue/doctor/${doctorId}/`),
     getWaitTime: (id) => api.get(`/appointments/${id}/wait-time/`),
+    // Live updates; `listeners` maps event types to handlers, `poll` refetches the page's data
+    streamQueue: (listeners, poll) => subscribe('/appointments/stream/queue/', listeners, poll),
+    streamWaitTime: (id, listeners, poll) => subscribe(`/appointments/stream/${id}/`, listeners, poll),
 };
 
 // Journey APIs
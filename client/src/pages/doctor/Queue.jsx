@@ -32,9 +32,12 @@ export default function DoctorQueue() {
 
     useEffect(() => {
         fetchQueue();
-        // Refresh every 30 seconds
-        const interval = setInterval(fetchQueue, 30000);
-        return () => clearInterval(interval);
+        // Refetch when the server pushes a queue change (and on the stream's slow fallback poll)
+        const listeners = Object.fromEntries(
+            ['booked', 'rescheduled', 'priority', 'started', 'completed', 'cancelled', 'resync'].map(type => [type, fetchQueue])
+        );
+        const stream = appointmentAPI.streamQueue(listeners, fetchQueue);
+        return () => stream.close();
     }, []);
 
     const handleStart = async (id) => {
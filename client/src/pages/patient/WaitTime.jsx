@@ -33,9 +33,20 @@ export default function WaitTime() {
 
     useEffect(() => {
         fetchWaitTime();
-        // Auto-refresh every 30 seconds
-        const interval = setInterval(fetchWaitTime, 30000);
-        return () => clearInterval(interval);
+        // Server pushes a fresh prediction when our status or place in the queue changes, or the delay moves 10+ min
+        const stream = appointmentAPI.streamWaitTime(appointmentId, {
+            wait_time: (event) => {
+                const data = JSON.parse(event.data);
+                if (data.current_status === 'completed' || data.current_status === 'cancelled') {
+                    stream.close();
+                    fetchWaitTime();
+                    return;
+                }
+                setWaitData(data);
+            },
+            resync: fetchWaitTime,
+        }, fetchWaitTime);
+        return () => stream.close();
     }, [appointmentId]);
 
     if (loading && !waitData) {
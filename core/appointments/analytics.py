@@ -0,0 +1,397 @@
+"""
+Doctor utilization analytics for providers.
+
+One query pulls the appointment columns for every doctor and week that is
+not cached yet (doctor, scheduled/actual times, estimated duration,
+status). They become NumPy arrays and are aggregated with bincount over a
+(doctor, week, weekday, hour) index, with no loop over rows in Python.
+
+Each doctor-week is reduced to one fixed-length vector (see LAYOUT):
+consulting minutes and bookings per weekday-hour, counts, sums and
+histograms of overrun and start delay. Vectors are cached per doctor and
+ISO week, and any range of weeks is the sum of its vectors, so percentiles
+over a year come from the merged histograms rather than the raw rows.
+
+Vectors of weeks that are over are also stored in DoctorWeekStats, so with
+a cold cache only the current week is aggregated from appointments. Only
+the snapshot_analytics command writes them (nightly for recent closed
+weeks, to pick up late status changes, or with --weeks to backfill);
+reads never do.
+"""
+import zlib
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, FloatField, Func, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Appointment, DoctorWeekStats, APPOINTMENT_STATUS_CHOICES
+
+HOURS = 7 * 24
+# Statuses come out of the query as small integers
+STATUS_CODES = {name: code for code, (name, _) in enumerate(APPOINTMENT_STATUS_CHOICES)}
+# Overrun and start delay histograms: HIST_BIN_MINUTES wide bins from
+# HIST_LOW_MINUTES, values outside clipped into the end bins
+HIST_LOW_MINUTES = -60
+HIST_BIN_MINUTES = 2
+HIST_BINS = 120
+# Consultations longer than this are treated as data entry mistakes
+MAX_CONSULTATION_MINUTES = 240
+
+PAST_WEEK_CACHE_SECONDS = 7 * 24 * 60 * 60
+CURRENT_WEEK_CACHE_SECONDS = 5 * 60
+
+
+def _layout(**sizes):
+    offsets, start = {}, 0
+    for name, size in sizes.items():
+        offsets[name] = slice(start, start + size)
+        start += size
+    return offsets, start
+
+
+# Offsets of each field in a doctor-week vector
+LAYOUT, VECTOR_SIZE = _layout(
+    busy=HOURS,          # consulting minutes by weekday-hour
+    booked=HOURS,        # live appointments by scheduled weekday-hour
+    counts=4,            # appointments, completed, cancelled, no-shows
+    past=1,              # live appointments on days already over
+    overrun=2,           # sum of minutes over the estimate, completed count
+    delay=2,             # sum of minutes started late, started count
+    overrun_hist=HIST_BINS,
+    delay_hist=HIST_BINS,
+)
+
+
+def week_start(day):
+    """Monday of the week `day` falls in"""
+    return day - timedelta(days=day.weekday())
+
+
+def weeks_between(first, last):
+    """Mondays of every week from the one containing `first` to the one containing `last`"""
+    monday = week_start(first)
+    weeks = []
+    while monday <= last:
+        weeks.append(monday)
+        monday += timedelta(days=7)
+    return weeks
+
+
+def _cache_key(doctor_id, monday):
+    year, week, _ = monday.isocalendar()
+    return f"analytics:{doctor_id}:{year}-W{week:02d}"
+
+
+def _pack(vector):
+    # Mostly zeros (night hours, empty histogram bins), so it compresses well
+    return zlib.compress(np.asarray(vector, dtype=np.float32).tobytes())
+
+
+def _unpack(blob):
+    return np.frombuffer(zlib.decompress(blob), dtype=np.float32)
+
+
+def _stored_vectors(pairs):
+    """{(doctor_id, monday): vector} of the stored closed weeks among `pairs`"""
+    pairs = set(pairs)
+    rows = DoctorWeekStats.objects.filter(
+        doctor_id__in={doctor_id for doctor_id, _ in pairs},
+        week_start__in={monday for _, monday in pairs},
+    ).values_list('doctor_id', 'week_start', 'vector')
+    return {
+        (doctor_id, monday): _unpack(blob)
+        for doctor_id, monday, blob in rows.iterator(chunk_size=2000)
+        if (doctor_id, monday) in pairs
+    }
+
+
+def store_vectors(vectors):
+    """Save {(doctor_id, monday): vector} of closed weeks to DoctorWeekStats, replacing existing rows"""
+    DoctorWeekStats.objects.bulk_create(
+        [
+            DoctorWeekStats(doctor_id=doctor_id, week_start=monday, vector=_pack(vector))
+            for (doctor_id, monday), vector in vectors.items()
+        ],
+        batch_size=500, update_conflicts=True,
+        unique_fields=['doctor', 'week_start'], update_fields=['vector', 'computed_at'],
+    )
+
+
+class _Epoch(Func):
+    """Seconds since 1970-01-01 UTC of a datetime column, as a float"""
+    output_field = FloatField()
+    template = "EXTRACT(EPOCH FROM %(expressions)s)"
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="((julianday(%(expressions)s) - 2440587.5) * 86400.0)", **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="UNIX_TIMESTAMP(%(expressions)s)", **extra_context)
+
+
+class _Seconds(Func):
+    """Length of a duration column in seconds, as a float"""
+    output_field = FloatField()
+    template = "EXTRACT(EPOCH FROM %(expressions)s)"
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Stored as integer microseconds
+        return self.as_sql(compiler, connection, template="(%(expressions)s / 1000000.0)", **extra_context)
+
+    as_mysql = as_sqlite
+
+
+def _datetimes(seconds):
+    """Epoch seconds (NaN for NULL) as naive UTC datetime64"""
+    values = np.full(len(seconds), np.datetime64("NaT"), dtype="datetime64[us]")
+    valid = ~np.isnan(seconds)
+    # Whole seconds: SQLite's julianday() arithmetic is off by a few microseconds
+    values[valid] = np.round(seconds[valid]).astype(np.int64).astype("datetime64[s]")
+    return values
+
+
+def _durations(seconds):
+    """Seconds as timedelta64"""
+    return np.round(seconds).astype(np.int64).astype("timedelta64[s]").astype("timedelta64[us]")
+
+
+def _to_local(values):
+    """
+    UTC datetime64 values in local wall time. The UTC offset is looked up
+    once per distinct date, so a DST change is applied from the day it
+    happens rather than the hour.
+    """
+    tz = timezone.get_current_timezone()
+    local = values.copy()
+    valid = ~np.isnat(values)
+    days, inverse = np.unique(values[valid].astype("datetime64[D]"), return_inverse=True)
+    offsets = np.array(
+        [tz.utcoffset(datetime.combine(day.item(), time(12))) for day in days],
+        dtype="timedelta64[us]",
+    )
+    local[valid] = values[valid] + offsets[inverse]
+    return local
+
+
+def _weekday_hour(local):
+    """(date, weekday Monday=0, hour, minute of the hour) arrays for local datetime64 values"""
+    days = local.astype("datetime64[D]")
+    weekday = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    since_midnight = (local - days).astype("timedelta64[s]").astype(np.int64)
+    return days, weekday, since_midnight // 3600, (since_midnight % 3600) / 60
+
+
+def _histogram(group, minutes, groups):
+    bins = np.clip((minutes - HIST_LOW_MINUTES) // HIST_BIN_MINUTES, 0, HIST_BINS - 1).astype(np.int64)
+    return np.bincount(group * HIST_BINS + bins, minlength=groups * HIST_BINS).reshape(groups, HIST_BINS)
+
+
+def _load(doctor_ids, first_week, last_week):
+    """Columns for the doctors' appointments in the weeks, in one query"""
+    start = timezone.make_aware(datetime.combine(first_week, time.min))
+    end = timezone.make_aware(datetime.combine(last_week + timedelta(days=7), time.min))
+    queryset = Appointment.objects.filter(
+        doctor_id__in=doctor_ids, scheduled_time__gte=start, scheduled_time__lt=end
+    ).order_by().values_list(
+        'doctor_id',
+        _Epoch('scheduled_time'),
+        _Epoch('actual_start_time'),
+        _Epoch('actual_end_time'),
+        _Seconds('estimated_duration'),
+        Case(*(When(status=name, then=Value(code)) for name, code in STATUS_CODES.items()), output_field=IntegerField()),
+    )
+    # Plain numbers straight off the cursor (no datetime or str per value),
+    # turned into one float array in a single pass
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+    doctor, scheduled, started, ended, estimated, status = np.array(rows, dtype=np.float64).T
+    return (
+        doctor.astype(np.int64),
+        _datetimes(scheduled),
+        _datetimes(started),
+        _datetimes(ended),
+        _durations(estimated),
+        status.astype(np.int8),
+    )
+
+
+def compute_vectors(doctor_ids, weeks, today=None):
+    """
+    Doctor-week vectors for every doctor in `doctor_ids` and Monday in
+    `weeks`, straight from the DB. Returns a (doctors, weeks, VECTOR_SIZE)
+    array in the order given.
+    """
+    today = today or timezone.localdate()
+    doctors = np.array(sorted(doctor_ids), dtype=np.int64)
+    mondays = np.array(sorted(weeks), dtype="datetime64[D]")
+    groups = len(doctors) * len(mondays)
+    vectors = np.zeros((groups, VECTOR_SIZE))
+
+    columns = _load(doctors.tolist(), min(weeks), max(weeks)) if groups else None
+    if columns is not None:
+        doctor, scheduled, started, ended, estimated, status = columns
+
+        days, weekday, hour, _ = _weekday_hour(_to_local(scheduled))
+        monday = days - weekday.astype("timedelta64[D]")
+        week = np.searchsorted(mondays, monday)
+        # The query spans first..last week; drop rows in weeks not asked for
+        keep = week < len(mondays)
+        keep[keep] = mondays[week[keep]] == monday[keep]
+        group = np.searchsorted(doctors, doctor) * len(mondays) + week
+        scheduled, started, ended, estimated, status = (
+            scheduled[keep], started[keep], ended[keep], estimated[keep], status[keep]
+        )
+        days, weekday, hour, group = days[keep], weekday[keep], hour[keep], group[keep]
+
+        cancelled = status == STATUS_CODES["CANCELLED"]
+        live = ~cancelled
+        completed = status == STATUS_CODES["COMPLETED"]
+        no_show = (status == STATUS_CODES["SCHEDULED"]) & (days < np.datetime64(today))
+
+        vectors[:, LAYOUT["booked"]] = np.bincount(
+            (group * HOURS + weekday * 24 + hour)[live], minlength=groups * HOURS
+        ).reshape(groups, HOURS)
+        vectors[:, LAYOUT["counts"]] = np.stack([
+            np.bincount(group, weights=flag, minlength=groups)
+            for flag in (live, completed, cancelled, no_show)
+        ], axis=1)
+        vectors[:, LAYOUT["past"]] = np.bincount(
+            group, weights=live & (days < np.datetime64(today)), minlength=groups
+        )[:, None]
+
+        # Consultation minutes, split between the hour it started in and the next
+        timed = completed & ~np.isnat(started) & ~np.isnat(ended)
+        minutes = (ended[timed] - started[timed]) / np.timedelta64(1, "m")
+        sane = (minutes >= 0) & (minutes <= MAX_CONSULTATION_MINUTES)
+        _, start_weekday, start_hour, start_minute = _weekday_hour(_to_local(started[timed]))
+        cell = (start_weekday * 24 + start_hour)[sane]
+        timed_group = group[timed][sane]
+        minutes = minutes[sane]
+        first = np.minimum(minutes, 60 - start_minute[sane])
+        rest = np.clip(minutes - first, 0, 60)
+        busy = np.bincount(timed_group * HOURS + cell, weights=first, minlength=groups * HOURS)
+        busy += np.bincount(timed_group * HOURS + (cell + 1) % HOURS, weights=rest, minlength=groups * HOURS)
+        vectors[:, LAYOUT["busy"]] = busy.reshape(groups, HOURS)
+
+        overrun = minutes - (estimated[timed][sane] / np.timedelta64(1, "m"))
+        vectors[:, LAYOUT["overrun"]] = np.stack([
+            np.bincount(timed_group, weights=overrun, minlength=groups),
+            np.bincount(timed_group, minlength=groups),
+        ], axis=1)
+        vectors[:, LAYOUT["overrun_hist"]] = _histogram(timed_group, overrun, groups)
+
+        seen = ~np.isnat(started)
+        delay = (started[seen] - scheduled[seen]) / np.timedelta64(1, "m")
+        vectors[:, LAYOUT["delay"]] = np.stack([
+            np.bincount(group[seen], weights=delay, minlength=groups),
+            np.bincount(group[seen], minlength=groups),
+        ], axis=1)
+        vectors[:, LAYOUT["delay_hist"]] = _histogram(group[seen], delay, groups)
+
+    return vectors.reshape(len(doctors), len(mondays), VECTOR_SIZE)
+
+
+def doctor_week_vectors(doctor_ids, weeks, today=None):
+    """
+    {doctor_id: (weeks, VECTOR_SIZE) array} for the Mondays in `weeks`,
+    from the per doctor-week cache where possible, then from the stored
+    closed weeks. Everything still missing is computed with a single query
+    and cached, but not stored: that is left to refresh_closed_weeks.
+    """
+    today = today or timezone.localdate()
+    current = week_start(today)
+    keys = {(doctor_id, monday): _cache_key(doctor_id, monday) for doctor_id in doctor_ids for monday in weeks}
+    cached = cache.get_many(list(keys.values()))
+    missing = [pair for pair, key in keys.items() if key not in cached]
+
+    closed = [pair for pair in missing if pair[1] < current]
+    if closed:
+        stored = {keys[pair]: vector for pair, vector in _stored_vectors(closed).items()}
+        cached.update(stored)
+        cache.set_many(stored, PAST_WEEK_CACHE_SECONDS)
+        missing = [pair for pair in missing if keys[pair] not in cached]
+
+    if missing:
+        missing_doctors = sorted({doctor_id for doctor_id, _ in missing})
+        missing_weeks = sorted({monday for _, monday in missing})
+        fresh = compute_vectors(missing_doctors, missing_weeks, today)
+        past, recent = {}, {}
+        for i, doctor_id in enumerate(missing_doctors):
+            for j, monday in enumerate(missing_weeks):
+                key = keys[(doctor_id, monday)]
+                vector = fresh[i, j].astype(np.float32)
+                cached[key] = vector
+                (past if monday < current else recent)[key] = vector
+        cache.set_many(past, PAST_WEEK_CACHE_SECONDS)
+        cache.set_many(recent, CURRENT_WEEK_CACHE_SECONDS)
+
+    return {
+        doctor_id: np.array([cached[keys[(doctor_id, monday)]] for monday in weeks], dtype=np.float64).reshape(len(weeks), VECTOR_SIZE)
+        for doctor_id in doctor_ids
+    }
+
+
+def refresh_closed_weeks(doctor_ids, weeks, today=None):
+    """
+    Recompute and store the closed weeks among `weeks` for the doctors,
+    replacing stored and cached vectors. Returns the number of doctor-weeks.
+    """
+    today = today or timezone.localdate()
+    weeks = sorted(monday for monday in weeks if monday < week_start(today))
+    doctor_ids = sorted(doctor_ids)
+    if not weeks or not doctor_ids:
+        return 0
+    fresh = compute_vectors(doctor_ids, weeks, today)
+    vectors = {
+        (doctor_id, monday): fresh[i, j].astype(np.float32)
+        for i, doctor_id in enumerate(doctor_ids)
+        for j, monday in enumerate(weeks)
+    }
+    store_vectors(vectors)
+    cache.set_many({_cache_key(*pair): vector for pair, vector in vectors.items()}, PAST_WEEK_CACHE_SECONDS)
+    return len(vectors)
+
+
+def _percentiles(histogram, total, mean_total):
+    if not total:
+        return {"mean": None, "p50": None, "p90": None}
+    cumulative = np.cumsum(histogram)
+    result = {"mean": round(float(mean_total) / total, 1)}
+    for band in (50, 90):
+        index = int(np.searchsorted(cumulative, total * band / 100))
+        result[f"p{band}"] = HIST_LOW_MINUTES + (index + 0.5) * HIST_BIN_MINUTES
+    return result
+
+
+def summarize(vectors):
+    """
+    Report for one or more doctors from their doctor-week vectors (any
+    array whose last axis is VECTOR_SIZE), summed.
+    """
+    vectors = np.asarray(vectors)
+    total = vectors.reshape(-1, VECTOR_SIZE).sum(axis=0)
+    appointments, completed, cancelled, no_shows = (int(n) for n in total[LAYOUT["counts"]])
+    past = int(total[LAYOUT["past"]][0])
+    overrun_sum, overrun_n = total[LAYOUT["overrun"]]
+    delay_sum, delay_n = total[LAYOUT["delay"]]
+    # Share of each weekday-hour spent consulting, per doctor and week
+    doctor_weeks = max(vectors.size // VECTOR_SIZE, 1)
+    utilization = total[LAYOUT["busy"]] / (60 * doctor_weeks)
+    return {
+        "appointments": appointments,
+        "completed": completed,
+        "cancelled": cancelled,
+        "no_shows": no_shows,
+        "no_show_rate": round(no_shows / past, 3) if past else None,
+        "utilization": np.round(utilization, 3).reshape(7, 24).tolist(),
+        "bookings": total[LAYOUT["booked"]].astype(int).reshape(7, 24).tolist(),
+        "overrun_minutes": _percentiles(total[LAYOUT["overrun_hist"]], int(overrun_n), overrun_sum),
+        "start_delay_minutes": _percentiles(total[LAYOUT["delay_hist"]], int(delay_n), delay_sum),
+    }
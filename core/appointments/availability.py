@@ -0,0 +1,105 @@
+"""
+Doctor availability: materialized slots and free-slot search.
+
+Each doctor's AvailabilityTemplate (weekly working windows, local time)
+is expanded ahead of time into free DoctorSlot rows for the next few
+weeks by the materialize_slots command, run nightly. A time is bookable
+only if its slot row exists, so checking a booking is a point lookup on
+the (doctor, slot_start) index and nothing can be booked outside working
+hours. Doctors with no template get OPD hours every day.
+
+Free-slot search is one query on the partial index of free slots,
+ordered by (slot_start, doctor), that stops after `limit` rows.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AvailabilityTemplate, DoctorSlot, SLOT_LENGTH, slot_start_for
+
+# Working hours (local time) for doctors with no template
+OPD_START = time(9, 0)
+OPD_END = time(17, 0)
+DEFAULT_TEMPLATE = [(weekday, OPD_START, OPD_END) for weekday in range(7)]
+
+# How far ahead slots are materialized (and so how far ahead patients can book)
+MATERIALIZE_WEEKS = 8
+
+
+def next_slot_start(moment):
+    """First slot boundary at or after `moment`"""
+    start = slot_start_for(moment)
+    return start if start == moment else start + SLOT_LENGTH
+
+
+def template_slots(windows, first_day, days):
+    """
+    Slot starts covered by `windows` [(weekday, start_time, end_time)] on
+    `days` consecutive days from `first_day`, in time order.
+    """
+    tz = timezone.get_current_timezone()
+    by_weekday = defaultdict(list)
+    for weekday, start_time, end_time in windows:
+        by_weekday[weekday].append((start_time, end_time))
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        for start_time, end_time in sorted(by_weekday[day.weekday()]):
+            slot = next_slot_start(timezone.make_aware(datetime.combine(day, start_time), tz))
+            closes = timezone.make_aware(datetime.combine(day, end_time), tz)
+            while slot + SLOT_LENGTH <= closes:
+                yield slot
+                slot += SLOT_LENGTH
+
+
+def materialize(doctor_ids, weeks=MATERIALIZE_WEEKS):
+    """
+    Bring each doctor's free slots for the next `weeks` weeks in line
+    with their template: bulk-insert the missing rows and delete free
+    future rows the template no longer covers. Booked slots are never
+    touched. Returns (created, removed).
+    """
+    now = timezone.now()
+    today = timezone.localdate()
+    days = weeks * 7
+    horizon_end = timezone.make_aware(datetime.combine(today + timedelta(days=days), time.min))
+
+    windows = defaultdict(list)
+    for doctor_id, weekday, start_time, end_time in AvailabilityTemplate.objects.filter(
+        doctor_id__in=doctor_ids
+    ).values_list('doctor_id', 'weekday', 'start_time', 'end_time'):
+        windows[doctor_id].append((weekday, start_time, end_time))
+
+    created = removed = 0
+    for doctor_id in doctor_ids:
+        wanted = {
+            slot for slot in template_slots(windows.get(doctor_id, DEFAULT_TEMPLATE), today, days)
+            if slot > now
+        }
+        with transaction.atomic():
+            existing = dict(DoctorSlot.objects.filter(
+                doctor_id=doctor_id, slot_start__gt=now, slot_start__lt=horizon_end
+            ).values_list('slot_start', 'id'))
+            stale = [
+                slot_id for slot_start, slot_id in existing.items() if slot_start not in wanted
+            ]
+            if stale:
+                removed += DoctorSlot.objects.filter(id__in=stale, appointment__isnull=True).delete()[0]
+            missing = [DoctorSlot(doctor_id=doctor_id, slot_start=slot) for slot in sorted(wanted - existing.keys())]
+            DoctorSlot.objects.bulk_create(missing, batch_size=1000, ignore_conflicts=True)
+            created += len(missing)
+    return created, removed
+
+
+def find_free_slots(doctors, start, end, limit):
+    """
+    The earliest `limit` free (slot_start, doctor_id) pairs across the
+    `doctors` queryset in [start, end).
+    """
+    return list(DoctorSlot.objects.filter(
+        doctor__in=doctors.values('id'),
+        appointment__isnull=True,
+        slot_start__gte=max(start, timezone.now()),
+        slot_start__lt=end,
+    ).order_by('slot_start', 'doctor_id').values_list('slot_start', 'doctor_id')[:limit])
@@ -0,0 +1,151 @@
+"""
+Capacity planning: how many doctors to roster for a specialization.
+
+A session is simulated as a multi-doctor queue. Patients arrive as a
+Poisson process with a rate for each hour, are seen first come first
+served by whichever rostered doctor is free first, and take a
+consultation length drawn from the specialization's recent actual
+consultations.
+
+Every run of every roster option is simulated together. Runs are rows of
+(options * runs, patients) arrays. Options with fewer doctors get their
+extra columns pinned at infinity. The only Python loop is over patient
+slots, one vectorized step per slot. All options replay the same arrivals
+and durations, so differences between them are not sampling noise.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import DurationField, ExpressionWrapper, F
+from django.utils import timezone
+
+from users.models import DoctorProfile
+from .analytics import MAX_CONSULTATION_MINUTES
+from .models import Appointment
+from .queue_state import DEFAULT_DURATION
+
+# Fall back to a wider pool of doctors, then to DEFAULT_DURATION, below this
+MIN_SAMPLES = 30
+MAX_SAMPLES = 5000
+WAIT_PERCENTILES = (50, 75, 90, 95, 99)
+# Report the share of patients who waited longer than these
+WAIT_THRESHOLDS_MINUTES = (15, 30, 60)
+
+
+def duration_samples(doctors, days=90):
+    """
+    Seconds of the most recent completed consultations (at most
+    MAX_SAMPLES) of `doctors` over the last `days` days.
+    """
+    lengths = Appointment.objects.filter(
+        doctor__in=doctors,
+        status="COMPLETED",
+        actual_start_time__isnull=False,
+        actual_end_time__gte=timezone.now() - timedelta(days=days),
+    ).order_by('-actual_end_time').values_list(
+        ExpressionWrapper(F('actual_end_time') - F('actual_start_time'), output_field=DurationField()),
+        flat=True,
+    )[:MAX_SAMPLES]
+    seconds = np.array([length.total_seconds() for length in lengths])
+    return seconds[(seconds > 0) & (seconds <= MAX_CONSULTATION_MINUTES * 60)]
+
+
+def _arrivals(rates, runs, rng):
+    """
+    (runs, slots) arrival offsets in seconds from the start of the
+    session, ascending, padded with inf. rates: patients per hour, one per
+    hour of the session.
+    """
+    counts = rng.poisson(rates, size=(runs, len(rates)))
+    slots = max(int(counts.sum(axis=1).max()), 1)
+    ends = counts.cumsum(axis=1)
+    # Hour of the session each patient slot falls in (len(rates) = unused slot)
+    hour = (np.arange(slots)[None, :, None] >= ends[:, None, :]).sum(axis=2)
+    arrivals = (hour + rng.random((runs, slots))) * 3600.0
+    arrivals[hour == len(rates)] = np.inf
+    return np.sort(arrivals, axis=1)
+
+
+def _bands(values, bands):
+    """Percentiles of `values`, all None if there are none (no patient arrived in any run)"""
+    if not len(values):
+        return {f"p{band}": None for band in bands}
+    return {f"p{band}": round(float(value), 1) for band, value in zip(bands, np.percentile(values, bands))}
+
+
+def _mean(values):
+    return round(float(values.mean()), 1) if len(values) else None
+
+
+def simulate(rates, rosters, durations, runs=2000, seed=None):
+    """
+    Wait distributions for each roster size in `rosters`.
+
+    rates: expected arrivals per hour for each hour of the session
+    durations: consultation lengths in seconds to resample from
+    Returns one dict per roster option, in the order given.
+    """
+    rng = np.random.default_rng(seed)
+    arrivals = _arrivals(rates, runs, rng)
+    present = np.isfinite(arrivals)
+    lengths = np.where(present, rng.choice(np.asarray(durations, dtype=float), size=arrivals.shape), 0.0)
+
+    options = len(rosters)
+    arrivals_all = np.tile(arrivals, (options, 1))
+    lengths_all = np.tile(lengths, (options, 1))
+    present_all = np.tile(present, (options, 1))
+    free_at = np.zeros((options * runs, max(rosters)))
+    free_at[np.arange(max(rosters))[None, :] >= np.repeat(rosters, runs)[:, None]] = np.inf
+
+    rows = np.arange(options * runs)
+    waits = np.zeros(arrivals_all.shape)
+    for slot in range(arrivals_all.shape[1]):
+        doctor = free_at.argmin(axis=1)
+        free = free_at[rows, doctor]
+        start = np.where(present_all[:, slot], np.maximum(free, arrivals_all[:, slot]), free)
+        waits[:, slot] = np.where(present_all[:, slot], start - arrivals_all[:, slot], 0.0)
+        free_at[rows, doctor] = start + lengths_all[:, slot]
+
+    session_end = len(rates) * 3600.0
+    busy = lengths.sum(axis=1)
+    patients = present.sum(axis=1)
+    waits = waits.reshape(options, runs, -1) / 60
+    finished = np.where(np.isfinite(free_at), free_at, 0.0).max(axis=1).reshape(options, runs)
+
+    results = []
+    for option, doctors in enumerate(rosters):
+        patient_waits = waits[option][present]
+        day_means = waits[option].sum(axis=1) / np.maximum(patients, 1)
+        overtime = np.maximum(finished[option] - session_end, 0) / 60
+        worked = doctors * np.maximum(finished[option], session_end)
+        results.append({
+            "doctors": doctors,
+            "wait_minutes": {"mean": _mean(patient_waits), **_bands(patient_waits, WAIT_PERCENTILES)},
+            "waited_longer_than": {
+                f"{minutes}m": round(float((patient_waits > minutes).mean()), 3) if len(patient_waits) else 0.0
+                for minutes in WAIT_THRESHOLDS_MINUTES
+            },
+            # Spread of a whole day's average wait across simulated days
+            "daily_mean_wait_minutes": _bands(day_means, (10, 50, 90)),
+            "utilization": round(float(busy.sum() / worked.sum()), 3),
+            "overtime_minutes": _bands(overtime, (50, 90)),
+        })
+    return results
+
+
+def plan(specialization, organization, rates, rosters, runs=2000, seed=None):
+    """
+    Simulate `rosters` for a specialization at an organization with
+    consultation lengths from its own doctors, widening to every doctor of
+    the specialization (then to DEFAULT_DURATION) when history is thin.
+    Returns (duration source, sample count, results).
+    """
+    doctors = DoctorProfile.objects.filter(specialization__iexact=specialization)
+    source = "organization"
+    samples = duration_samples(doctors.filter(organization=organization))
+    if len(samples) < MIN_SAMPLES:
+        source = "specialization"
+        samples = duration_samples(doctors)
+    if len(samples) < MIN_SAMPLES:
+        return "default", 0, simulate(rates, rosters, [DEFAULT_DURATION.total_seconds()], runs, seed)
+    return source, len(samples), simulate(rates, rosters, samples, runs, seed)
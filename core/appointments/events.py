@@ -0,0 +1,76 @@
+"""
+In-process fan-out of queue deltas to streaming clients.
+
+Views call publish() (via queue_state) from whatever thread they run on;
+subscribers are asyncio queues owned by the ASGI stream handlers in
+streams.py. Delivery is best effort: a subscriber that falls too far
+behind drops events and is told to resync.
+
+Subscriptions are keyed by topic: a doctor_id for the doctor's whole
+queue, or appointment_topic(id) for the events of one appointment, so a
+patient's stream only wakes up for its own appointment.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+# Events buffered per idle connection before it is marked as lagging
+SUBSCRIBER_BUFFER = 64
+
+
+def appointment_topic(appointment_id):
+    return ("appointment", appointment_id)
+
+
+class Subscription:
+    def __init__(self, topic, loop):
+        self.topic = topic
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        self.lagging = False
+
+    def _deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagging = True
+
+
+class QueueBroadcaster:
+    """Maps topic -> set of live subscriptions"""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        subscription = Subscription(topic, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.topic]
+
+    def publish(self, topic, event):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(topic, ()))
+        for subscription in subscribers:
+            # Safe from sync views running in a worker thread
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+            except RuntimeError:
+                # Event loop already closed; the handler is going away
+                pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscriptions.values())
+
+
+broadcaster = QueueBroadcaster()
@@ -0,0 +1,117 @@
+"""
+ICS calendar feeds for doctors.
+
+Calendar apps poll a subscribed feed every few minutes, usually with
+If-None-Match. Each doctor's feed is rendered once into a snapshot
+(ETag + body) that stays in the cache until that doctor's appointments
+change: queue_state invalidates it on every booking, status change,
+reschedule or priority change, and AppointmentDetailView on edits. A poll
+is then a token lookup and a cache read, and an unchanged calendar
+answers 304 without touching the Appointment table.
+
+SNAPSHOT_CACHE_SECONDS bounds how stale a snapshot can get in a worker
+whose local cache did not see the change.
+"""
+import hashlib
+from datetime import timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Appointment
+
+# Appointments from this far back up to FEED_DAYS_AHEAD are in the feed
+FEED_DAYS_BEHIND = 30
+FEED_DAYS_AHEAD = 90
+SNAPSHOT_CACHE_SECONDS = 15 * 60
+PRODID = "-//PIEDS//Doctor schedule//EN"
+
+
+def _cache_key(doctor_id):
+    return f"ics_snapshot:{doctor_id}"
+
+
+def _escape(text):
+    """TEXT value escaping from RFC 5545 section 3.3.11"""
+    return (
+        str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+    )
+
+
+def _fold(line):
+    """Split a content line into 75-octet pieces, continuation lines starting with a space"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    pieces, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # Don't split a multi-byte character
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        pieces.append(encoded[start:end].decode("utf-8"))
+        start, limit = end, 74
+    return "\r\n ".join(pieces)
+
+
+def _timestamp(moment):
+    return moment.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def render(doctor_id, now=None):
+    """The doctor's feed as ICS text, from one query"""
+    now = now or timezone.now()
+    rows = Appointment.objects.filter(
+        doctor_id=doctor_id,
+        scheduled_time__gte=now - timedelta(days=FEED_DAYS_BEHIND),
+        scheduled_time__lt=now + timedelta(days=FEED_DAYS_AHEAD),
+    ).exclude(status='CANCELLED').order_by('scheduled_time', 'id').values_list(
+        'id', 'scheduled_time', 'estimated_duration', 'status', 'priority', 'token_number',
+        'actual_start_time', 'actual_end_time', 'patient__user__first_name', 'patient__user__last_name',
+    )
+
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        "X-WR-CALNAME:Appointments",
+    ]
+    stamp = _timestamp(now)
+    for (appointment_id, scheduled_time, duration, status, priority, token_number,
+         started, ended, first_name, last_name) in rows:
+        start = started or scheduled_time
+        end = ended or start + duration
+        patient = f"{first_name} {last_name}".strip() or "Patient"
+        summary = f"Walk-in #{token_number}: {patient}" if token_number is not None else f"Consultation: {patient}"
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:appointment-{appointment_id}@pieds",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{_timestamp(start)}",
+            f"DTEND:{_timestamp(end)}",
+            f"SUMMARY:{_escape(summary)}",
+            f"DESCRIPTION:{_escape(f'Status: {status}. Priority: {priority}.')}",
+            "STATUS:CONFIRMED",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+
+def snapshot(doctor_id):
+    """(etag, body) of the doctor's feed, rendered only if not cached"""
+    cached = cache.get(_cache_key(doctor_id))
+    if cached is None:
+        body = render(doctor_id)
+        # DTSTAMP changes on every render, so leave it out of the ETag
+        stable = "\r\n".join(line for line in body.split("\r\n") if not line.startswith("DTSTAMP:"))
+        etag = '"%s"' % hashlib.sha256(stable.encode("utf-8")).hexdigest()[:32]
+        cached = (etag, body)
+        cache.set(_cache_key(doctor_id), cached, SNAPSHOT_CACHE_SECONDS)
+    return cached
+
+
+def invalidate(doctor_id):
+    cache.delete(_cache_key(doctor_id))
@@ -0,0 +1,119 @@
+"""
+Utilization analytics benchmark.
+
+Seeds a year of appointments for a hospital of throwaway doctors inside a
+transaction and times the analytics for all of them three ways: from the
+appointment rows alone (one query plus NumPy aggregation), with an empty
+cache but the closed weeks stored as snapshot_analytics would (the normal
+cold read), and from the per doctor-week cache. Checks the totals against
+what was seeded, then rolls everything back.
+
+    python manage.py bench_analytics --doctors 200 --per-day 16
+"""
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from appointments import analytics
+from appointments.models import Appointment
+from users.models import User, DoctorProfile, PatientProfile
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time utilization analytics over a year of synthetic appointments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctors", type=int, default=200)
+        parser.add_argument("--per-day", type=int, default=16, help="Appointments per doctor per weekday")
+        parser.add_argument("--weeks", type=int, default=52)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def run(self, options):
+        rng = np.random.default_rng(options["seed"])
+        tag = uuid.uuid4().hex[:8]
+        doctors = []
+        for i in range(options["doctors"]):
+            user = User.objects.create_user(f"bench-doctor-{tag}-{i}@example.com", None, type="DOCTOR")
+            doctors.append(DoctorProfile.objects.create(user=user, specialization="Bench", hpr_id=f"bench-{tag}-{i}"))
+        patient_user = User.objects.create_user(f"bench-patient-{tag}@example.com", None, type="PATIENT")
+        patient = PatientProfile.objects.create(user=patient_user)
+
+        today = timezone.localdate()
+        weeks = analytics.weeks_between(today - timedelta(weeks=options["weeks"] - 1), today)
+        days = [monday + timedelta(days=d) for monday in weeks for d in range(5) if monday + timedelta(days=d) < today]
+        per_day = options["per_day"]
+        statuses = rng.choice(["COMPLETED", "CANCELLED", "SCHEDULED"], size=(len(days), per_day), p=[0.85, 0.1, 0.05])
+
+        started = time.perf_counter()
+        created = 0
+        for doctor in doctors:
+            rows = []
+            delays = rng.exponential(10, (len(days), per_day))
+            lengths = rng.lognormal(np.log(14), 0.5, (len(days), per_day))
+            for d, day in enumerate(days):
+                opening = timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=9))
+                for slot in range(per_day):
+                    scheduled = opening + timedelta(minutes=15 * slot)
+                    appointment = Appointment(
+                        patient=patient, doctor=doctor, scheduled_time=scheduled, status=statuses[d, slot]
+                    )
+                    if appointment.status == "COMPLETED":
+                        appointment.actual_start_time = scheduled + timedelta(minutes=float(delays[d, slot]))
+                        appointment.actual_end_time = appointment.actual_start_time + timedelta(minutes=float(lengths[d, slot]))
+                    rows.append(appointment)
+            Appointment.objects.bulk_create(rows, batch_size=2000)
+            created += len(rows)
+        self.stdout.write(f"backend:      {connection.vendor}")
+        self.stdout.write(f"seeded:       {created} appointments, {len(doctors)} doctors, {len(weeks)} weeks "
+                          f"({time.perf_counter() - started:.1f}s)")
+
+        doctor_ids = [doctor.id for doctor in doctors]
+        cache_keys = [analytics._cache_key(doctor_id, monday) for doctor_id in doctor_ids for monday in weeks]
+        cache.delete_many(cache_keys)
+
+        started = time.perf_counter()
+        vectors = analytics.doctor_week_vectors(doctor_ids, weeks, today)
+        analytics.summarize(list(vectors.values()))
+        rows = time.perf_counter() - started
+
+        started = time.perf_counter()
+        analytics.refresh_closed_weeks(doctor_ids, weeks, today)
+        snapshot = time.perf_counter() - started
+
+        cache.delete_many(cache_keys)
+        started = time.perf_counter()
+        vectors = analytics.doctor_week_vectors(doctor_ids, weeks, today)
+        overall = analytics.summarize(list(vectors.values()))
+        cold = time.perf_counter() - started
+
+        started = time.perf_counter()
+        vectors = analytics.doctor_week_vectors(doctor_ids, weeks, today)
+        analytics.summarize(list(vectors.values()))
+        warm = time.perf_counter() - started
+
+        self.stdout.write(f"from rows:    {rows * 1000:.0f} ms")
+        self.stdout.write(f"snapshot:     {snapshot * 1000:.0f} ms")
+        self.stdout.write(f"cold:         {cold * 1000:.0f} ms")
+        self.stdout.write(f"cached:       {warm * 1000:.0f} ms")
+        self.stdout.write(f"overall:      {overall['completed']} completed, no-show rate {overall['no_show_rate']}, "
+                          f"overrun p50/p90 {overall['overrun_minutes']['p50']}/{overall['overrun_minutes']['p90']} min")
+        ok = overall["appointments"] + overall["cancelled"] == created
+        self.stdout.write(self.style.SUCCESS("PASS") if ok else self.style.ERROR("FAIL: counts do not match the seeded rows"))
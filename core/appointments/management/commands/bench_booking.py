@@ -0,0 +1,107 @@
+"""
+Concurrent booking benchmark.
+
+Spawns worker threads that all try to book the same small set of slots for
+one throwaway doctor, using the same slot claim as a single booking
+(services.book_appointments claims one slot with DoctorSlot.claim), then
+checks that no slot ended up with more than one live appointment.
+Everything it creates is deleted afterwards.
+
+    python manage.py bench_booking --threads 16 --slots 50 --attempts 200
+"""
+import random
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction, OperationalError
+from django.db.models import Count
+from django.utils import timezone
+
+from appointments.models import Appointment, DoctorSlot, SLOT_LENGTH, slot_start_for
+from users.models import User, DoctorProfile, PatientProfile
+
+
+class _SlotTaken(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measure booking throughput under contention and verify there are no double bookings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--slots", type=int, default=40, help="Distinct slots all threads compete for")
+        parser.add_argument("--attempts", type=int, default=100, help="Booking attempts per thread")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        doctor_user = User.objects.create_user(f"bench-doctor-{tag}@example.com", None, type="DOCTOR")
+        doctor = DoctorProfile.objects.create(user=doctor_user, specialization="Bench", hpr_id=f"bench-{tag}")
+        patient_user = User.objects.create_user(f"bench-patient-{tag}@example.com", None, type="PATIENT")
+        patient = PatientProfile.objects.create(user=patient_user)
+
+        first_slot = slot_start_for(timezone.now() + timedelta(days=1))
+        slot_times = [first_slot + i * SLOT_LENGTH for i in range(options["slots"])]
+        # Open the slots as materialize_slots would
+        DoctorSlot.objects.bulk_create([DoctorSlot(doctor=doctor, slot_start=t) for t in slot_times], ignore_conflicts=True)
+
+        counters = {"booked": 0, "rejected": 0, "errors": 0}
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            local = {"booked": 0, "rejected": 0, "errors": 0}
+            try:
+                for _ in range(options["attempts"]):
+                    scheduled_time = rng.choice(slot_times)
+                    try:
+                        with transaction.atomic():
+                            appointment = Appointment.objects.create(
+                                patient=patient, doctor=doctor, scheduled_time=scheduled_time
+                            )
+                            if not DoctorSlot.claim(appointment):
+                                raise _SlotTaken
+                        local["booked"] += 1
+                    except _SlotTaken:
+                        local["rejected"] += 1
+                    except OperationalError:
+                        local["errors"] += 1
+            finally:
+                connection.close()
+                with lock:
+                    for key, value in local.items():
+                        counters[key] += value
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options["threads"])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            total = options["threads"] * options["attempts"]
+            double_booked = (
+                Appointment.objects.filter(doctor=doctor)
+                .exclude(status="CANCELLED")
+                .values("scheduled_time")
+                .annotate(n=Count("id"))
+                .filter(n__gt=1)
+                .count()
+            )
+            self.stdout.write(f"backend:          {connection.vendor}")
+            self.stdout.write(f"threads x tries:  {options['threads']} x {options['attempts']} over {options['slots']} slots")
+            self.stdout.write(f"elapsed:          {elapsed:.2f}s ({total / elapsed:.0f} attempts/s)")
+            self.stdout.write(f"booked:           {counters['booked']}")
+            self.stdout.write(f"rejected (taken): {counters['rejected']}")
+            self.stdout.write(f"db errors:        {counters['errors']}")
+            self.stdout.write(f"double bookings:  {double_booked}")
+            ok = double_booked == 0 and counters["booked"] <= options["slots"]
+            self.stdout.write(self.style.SUCCESS("PASS") if ok else self.style.ERROR("FAIL"))
+        finally:
+            doctor_user.delete()
+            patient_user.delete()
@@ -0,0 +1,37 @@
+"""
+Materialize bookable slots from doctors' availability templates.
+
+Creates the free DoctorSlot rows for the next N weeks and drops free
+future rows that templates no longer cover. Only slots with a row can be
+booked, so run this nightly (cron) to keep the booking horizon rolling,
+and once after deploying availability templates.
+
+    python manage.py materialize_slots [--weeks 8] [--doctor 12]
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from appointments.availability import MATERIALIZE_WEEKS, materialize
+from users.models import DoctorProfile
+
+
+class Command(BaseCommand):
+    help = "Create the next weeks of free slots from each doctor's weekly availability template"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--weeks", type=int, default=MATERIALIZE_WEEKS)
+        parser.add_argument("--doctor", type=int, help="Only materialize this doctor profile id")
+
+    def handle(self, *args, **options):
+        doctors = DoctorProfile.objects.order_by('id')
+        if options["doctor"]:
+            doctors = doctors.filter(id=options["doctor"])
+        doctor_ids = list(doctors.values_list('id', flat=True))
+
+        started = time.perf_counter()
+        created, removed = materialize(doctor_ids, options["weeks"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Materialized {options['weeks']} weeks for {len(doctor_ids)} doctors: "
+            f"{created} slots created, {removed} removed ({time.perf_counter() - started:.1f}s)"
+        ))
@@ -0,0 +1,46 @@
+"""
+Rebuild DoctorDurationStats from completed appointments.
+
+The stats are normally maintained incrementally by CompleteAppointmentView;
+run this once after deploying them, or to recover from bad data.
+
+    python manage.py rebuild_duration_stats [--doctor 12]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from appointments.models import Appointment, DoctorDurationStats
+
+
+class Command(BaseCommand):
+    help = "Replay completed consultations into per-doctor, per-hour duration statistics"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctor", type=int, help="Only rebuild this doctor profile id")
+
+    def handle(self, *args, **options):
+        completed = Appointment.objects.filter(
+            status='COMPLETED',
+            actual_start_time__isnull=False,
+            actual_end_time__isnull=False
+        )
+        existing = DoctorDurationStats.objects.all()
+        if options["doctor"]:
+            completed = completed.filter(doctor_id=options["doctor"])
+            existing = existing.filter(doctor_id=options["doctor"])
+
+        stats = {}
+        rows = completed.order_by('actual_end_time').values_list('doctor_id', 'actual_start_time', 'actual_end_time')
+        for doctor_id, started_at, ended_at in rows.iterator():
+            hour = timezone.localtime(started_at).hour
+            key = (doctor_id, hour)
+            if key not in stats:
+                stats[key] = DoctorDurationStats(doctor_id=doctor_id, hour=hour)
+            stats[key].record((ended_at - started_at).total_seconds())
+
+        with transaction.atomic():
+            existing.delete()
+            DoctorDurationStats.objects.bulk_create(stats.values(), batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(stats)} duration stats rows"))
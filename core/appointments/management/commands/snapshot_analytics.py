@@ -0,0 +1,49 @@
+"""
+Store utilization analytics for weeks that are over.
+
+Recomputes the last N closed weeks of every doctor into DoctorWeekStats
+(default 2, to pick up late status changes such as completions entered
+the next day), so a cold analytics read only aggregates the current week
+from appointments. Run nightly (cron); run once with a larger --weeks to
+backfill history.
+
+    python manage.py snapshot_analytics [--weeks 2] [--doctor 12]
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from appointments import analytics
+from users.models import DoctorProfile
+
+# Doctors aggregated per query
+BATCH_DOCTORS = 200
+
+
+class Command(BaseCommand):
+    help = "Recompute and store the analytics vectors of the last closed weeks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--weeks", type=int, default=2)
+        parser.add_argument("--doctor", type=int, help="Only snapshot this doctor profile id")
+
+    def handle(self, *args, **options):
+        doctors = DoctorProfile.objects.order_by('id')
+        if options["doctor"]:
+            doctors = doctors.filter(id=options["doctor"])
+        doctor_ids = list(doctors.values_list('id', flat=True))
+
+        today = timezone.localdate()
+        current = analytics.week_start(today)
+        weeks = [current - timedelta(weeks=n) for n in range(options["weeks"], 0, -1)]
+
+        started = time.perf_counter()
+        stored = 0
+        for i in range(0, len(doctor_ids), BATCH_DOCTORS):
+            stored += analytics.refresh_closed_weeks(doctor_ids[i:i + BATCH_DOCTORS], weeks, today)
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {stored} doctor-weeks ({len(doctor_ids)} doctors, {len(weeks)} weeks) "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,137 @@
+"""
+Load test for the queue event streams.
+
+Opens many concurrent SSE connections against a running ASGI server
+(e.g. `uvicorn core.asgi:application`), holds them idle, optionally fires a
+queue mutation and reports how quickly the delta reached every client.
+
+    python manage.py sse_loadtest --token <access> --connections 5000 \
+        --trigger /api/appointments/42/start/ --trigger-token <doctor access>
+"""
+import asyncio
+import resource
+import statistics
+import time
+import urllib.request
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Hold many idle SSE connections on one worker and measure delta fan-out latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8000)
+        parser.add_argument("--path", default="/api/appointments/stream/queue/")
+        parser.add_argument("--token", required=True, help="JWT access token for the stream")
+        parser.add_argument("--connections", type=int, default=2000)
+        parser.add_argument("--hold", type=float, default=30.0, help="Seconds to keep connections idle")
+        parser.add_argument("--trigger", help="Path to POST once all streams are open (e.g. an appointment start)")
+        parser.add_argument("--trigger-token", help="Token for the trigger request (defaults to --token)")
+
+    def handle(self, *args, **options):
+        # Each connection needs a file descriptor
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = min(hard, options["connections"] + 256)
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+        results = asyncio.run(self._run(options))
+
+        self.stdout.write(f"connections requested: {options['connections']}")
+        self.stdout.write(f"established (200):     {results['established']}")
+        self.stdout.write(f"failed:                {results['failed']}")
+        self.stdout.write(f"connect time:          {results['connect_seconds']:.2f}s")
+        self.stdout.write(f"still open after hold: {results['alive']}")
+        latencies = results["latencies"]
+        if options["trigger"]:
+            self.stdout.write(f"delta received by:     {len(latencies)}")
+            if latencies:
+                latencies.sort()
+                p99 = latencies[int(len(latencies) * 0.99) - 1] if len(latencies) >= 100 else latencies[-1]
+                self.stdout.write(
+                    f"delta latency ms:      p50={statistics.median(latencies):.1f} "
+                    f"p99={p99:.1f} max={latencies[-1]:.1f}"
+                )
+        ok = results["failed"] == 0 and results["alive"] == results["established"]
+        if options["trigger"]:
+            ok = ok and len(latencies) == results["established"]
+        self.stdout.write(self.style.SUCCESS("PASS") if ok else self.style.ERROR("FAIL"))
+
+    async def _run(self, options):
+        state = {"trigger_at": None, "latencies": [], "closed": 0}
+        request = (
+            f"GET {options['path']}?token={options['token']} HTTP/1.1\r\n"
+            f"Host: {options['host']}:{options['port']}\r\n"
+            "Accept: text/event-stream\r\n\r\n"
+        ).encode()
+
+        async def client(index):
+            try:
+                reader, writer = await asyncio.open_connection(options["host"], options["port"])
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+                if b" 200 " not in status_line:
+                    writer.close()
+                    return None
+            except OSError:
+                return None
+
+            async def consume():
+                seen = False
+                try:
+                    while True:
+                        line = await reader.readline()
+                        if not line:
+                            state["closed"] += 1
+                            return
+                        if (line.startswith(b"event:") and not line.startswith(b"event: ready")
+                                and state["trigger_at"] and not seen):
+                            seen = True
+                            state["latencies"].append((time.perf_counter() - state["trigger_at"]) * 1000)
+                except (OSError, asyncio.CancelledError):
+                    return
+
+            return writer, asyncio.ensure_future(consume())
+
+        started = time.perf_counter()
+        # Open in batches so the listen backlog isn't overwhelmed
+        streams = []
+        batch = 500
+        for offset in range(0, options["connections"], batch):
+            count = min(batch, options["connections"] - offset)
+            streams += await asyncio.gather(*(client(offset + i) for i in range(count)))
+        connect_seconds = time.perf_counter() - started
+        opened = [s for s in streams if s is not None]
+
+        if options["trigger"]:
+            await asyncio.sleep(0.5)
+            state["trigger_at"] = time.perf_counter()
+            await asyncio.get_running_loop().run_in_executor(None, self._trigger, options)
+
+        await asyncio.sleep(options["hold"])
+        alive = len(opened) - state["closed"]
+
+        for writer, task in opened:
+            task.cancel()
+            writer.close()
+
+        return {
+            "established": len(opened),
+            "failed": len(streams) - len(opened),
+            "connect_seconds": connect_seconds,
+            "alive": alive,
+            "latencies": state["latencies"],
+        }
+
+    def _trigger(self, options):
+        token = options["trigger_token"] or options["token"]
+        request = urllib.request.Request(
+            f"http://{options['host']}:{options['port']}{options['trigger']}",
+            method="POST",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        with urllib.request.urlopen(request) as response:
+            response.read()
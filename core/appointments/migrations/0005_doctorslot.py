@@ -0,0 +1,53 @@
+# Generated by Django 6.0 on 2026-10-16 20:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_slots(apps, schema_editor):
+    """
+    Create a booked slot for every live appointment. Legacy appointments
+    that share a slot keep the first one booked.
+    """
+    Appointment = apps.get_model('appointments', 'Appointment')
+    DoctorSlot = apps.get_model('appointments', 'DoctorSlot')
+
+    slots = []
+    seen = set()
+    live = Appointment.objects.filter(
+        status__in=['SCHEDULED', 'IN_PROGRESS', 'COMPLETED']
+    ).order_by('scheduled_time', 'id').values_list('id', 'doctor_id', 'scheduled_time')
+    for appointment_id, doctor_id, scheduled_time in live.iterator():
+        slot_start = scheduled_time.replace(
+            minute=scheduled_time.minute - scheduled_time.minute % 30, second=0, microsecond=0
+        )
+        if (doctor_id, slot_start) in seen:
+            continue
+        seen.add((doctor_id, slot_start))
+        slots.append(DoctorSlot(doctor_id=doctor_id, slot_start=slot_start, appointment_id=appointment_id))
+    DoctorSlot.objects.bulk_create(slots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_appointment_is_paid'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot_start', models.DateTimeField()),
+                ('appointment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='slot', to='appointments.appointment')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='users.doctorprofile')),
+            ],
+            options={
+                'ordering': ['slot_start'],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'slot_start'), name='unique_doctor_slot')],
+            },
+        ),
+        migrations.RunPython(backfill_slots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-16 20:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_doctorslot'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorDurationStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.PositiveSmallIntegerField(help_text='Hour of day (0-23) the consultations started')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('ewma_seconds', models.FloatField(default=0)),
+                ('ewm_variance', models.FloatField(default=0)),
+                ('sketch', models.JSONField(default=list, help_text='Decayed counts per DURATION_BUCKETS bucket (+ overflow)')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duration_stats', to='users.doctorprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'hour'), name='unique_doctor_duration_hour')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-16 22:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_doctordurationstats'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='token_number',
+            field=models.PositiveIntegerField(blank=True, help_text='Walk-in token for the day (null for booked appointments)', null=True),
+        ),
+        migrations.CreateModel(
+            name='WalkInCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('last_token', models.PositiveIntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='walk_in_counters', to='users.doctorprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'day'), name='unique_doctor_walk_in_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-16 22:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_walk_in_tokens'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PoolTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('specialization', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('WAITING', 'Waiting'), ('ASSIGNED', 'Assigned'), ('CANCELLED', 'Cancelled')], default='WAITING', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('appointment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pool_ticket', to='appointments.appointment')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pool_tickets', to='users.providerprofile')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pool_tickets', to='users.patientprofile')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['organization', 'specialization', 'status', 'created_at'], name='pool_ticket_waiting_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 22:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_pool_ticket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='priority',
+            field=models.CharField(choices=[('EMERGENCY', 'Emergency'), ('ELDERLY', 'Elderly'), ('SCHEDULED', 'Scheduled')], default='SCHEDULED', max_length=20),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-16 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0010_appointment_event'),
+        ('journeys', '0003_journeystep_assigned_lab'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'scheduled_time'], name='appointment_doctor_time_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-16 22:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0011_appointment_doctor_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DelayNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delay_minutes', models.FloatField()),
+                ('predicted_start_time', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delay_notifications', to='appointments.appointment')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-16 22:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0012_delay_notification'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('window_start', models.TimeField()),
+                ('window_end', models.TimeField()),
+                ('status', models.CharField(choices=[('WAITING', 'Waiting'), ('BOOKED', 'Booked'), ('CANCELLED', 'Cancelled')], default='WAITING', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('appointment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_entry', to='appointments.appointment')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='users.doctorprofile')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='users.patientprofile')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['doctor', 'date', 'status', 'window_start'], name='waitlist_match_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-16 22:45
+
+import appointments.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0013_waitlist_entry'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarFeedToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(default=appointments.models._new_calendar_token, max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_feed', to='users.doctorprofile')),
+            ],
+        ),
+    ]
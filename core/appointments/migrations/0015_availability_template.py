@@ -0,0 +1,44 @@
+# Generated by Django 6.0 on 2026-10-17 08:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0014_calendar_feed_token'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+            ],
+            options={
+                'ordering': ['weekday', 'start_time'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='doctorslot',
+            index=models.Index(condition=models.Q(('appointment__isnull', True)), fields=['slot_start', 'doctor'], name='doctor_slot_free_idx'),
+        ),
+        migrations.AddField(
+            model_name='availabilitytemplate',
+            name='doctor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_templates', to='users.doctorprofile'),
+        ),
+        migrations.AddConstraint(
+            model_name='availabilitytemplate',
+            constraint=models.UniqueConstraint(fields=('doctor', 'weekday', 'start_time'), name='unique_doctor_availability'),
+        ),
+        migrations.AddConstraint(
+            model_name='availabilitytemplate',
+            constraint=models.CheckConstraint(condition=models.Q(('start_time__lt', models.F('end_time'))), name='availability_start_before_end'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-16 23:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0015_availability_template'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorWeekStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week_start', models.DateField(help_text='Monday of the week')),
+                ('vector', models.BinaryField(help_text='zlib-compressed float32 array')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='week_stats', to='users.doctorprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'week_start'), name='unique_doctor_week_stats')],
+            },
+        ),
+    ]
@@ -1,9 +1,15 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from datetime import timedelta
-from users.models import PatientProfile, DoctorProfile
+from users.models import PatientProfile, DoctorProfile, ProviderProfile
 from journeys.models import JourneyStep
 
+# Bookable slots are a fixed 30-minute grid; one appointment per slot
+SLOT_LENGTH = timedelta(minutes=30)
+
 APPOINTMENT_STATUS_CHOICES = (
     ("SCHEDULED", "Scheduled"),
     ("IN_PROGRESS", "In Progress"),
@@ -11,16 +17,27 @@ APPOINTMENT_STATUS_CHOICES = (
     ("CANCELLED", "Cancelled"),
 )
 
+# Queue priority; a lower rank is seen first among patients who have arrived
+PRIORITY_CHOICES = (
+    ("EMERGENCY", "Emergency"),
+    ("ELDERLY", "Elderly"),
+    ("SCHEDULED", "Scheduled"),
+)
+PRIORITY_RANK = {"EMERGENCY": 0, "ELDERLY": 1, "SCHEDULED": 2}
+DEFAULT_PRIORITY = "SCHEDULED"
+
 class Appointment(models.Model):
 
     patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name="appointments")
     doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="appointments")
     scheduled_time = models.DateTimeField()
     status = models.CharField(max_length=20, choices=APPOINTMENT_STATUS_CHOICES, default="SCHEDULED")
+    priority = models.CharField(max_length=20, choices=PRIORITY_CHOICES, default=DEFAULT_PRIORITY)
     journey_step = models.OneToOneField(JourneyStep, on_delete=models.SET_NULL, null=True, blank=True, related_name="appointment_link")
     estimated_duration = models.DurationField(default=timedelta(minutes=15))
     created_at = models.DateTimeField(auto_now_add=True)
     is_paid = models.BooleanField(default=False, help_text="Whether the consultation fee has been paid")
+    token_number = models.PositiveIntegerField(null=True, blank=True, help_text="Walk-in token for the day (null for booked appointments)")
     
     # Actual timing for wait time prediction
     actual_start_time = models.DateTimeField(null=True, blank=True, help_text="When doctor started consultation")
@@ -28,6 +45,9 @@ class Appointment(models.Model):
 
     class Meta:
         ordering = ['scheduled_time']
+        indexes = [
+            models.Index(fields=['doctor', 'scheduled_time'], name='appointment_doctor_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient} with {self.doctor} at {self.scheduled_time}"
@@ -38,3 +58,525 @@ class Appointment(models.Model):
         if self.actual_start_time and self.actual_end_time:
             return self.actual_end_time - self.actual_start_time
         return None
+
+    @property
+    def is_walk_in(self):
+        return self.token_number is not None
+
+    def transition(self, to_status, from_statuses, actor=None, **fields):
+        """
+        Move the appointment to `to_status` with a conditional
+        UPDATE ... WHERE status=<expected> and log an AppointmentEvent in
+        the same transaction. Returns False, changing nothing, if the row is
+        no longer in one of `from_statuses` (another request got there
+        first). On success the new values are set on self as well.
+        """
+        # The status we loaded is almost always still the one in the DB
+        candidates = sorted(from_statuses, key=lambda status: status != self.status)
+        with transaction.atomic():
+            for from_status in candidates:
+                if Appointment.objects.filter(pk=self.pk, status=from_status).update(status=to_status, **fields):
+                    break
+            else:
+                return False
+            AppointmentEvent.objects.create(
+                appointment_id=self.pk,
+                doctor_id=self.doctor_id,
+                from_status=from_status,
+                to_status=to_status,
+                actor=actor
+            )
+        self.status = to_status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return True
+
+
+class AppointmentEvent(models.Model):
+    """
+    Append-only log of appointment status transitions, written by
+    Appointment.transition. Analytics can scan this by doctor and time
+    instead of the mutable Appointment table.
+    """
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name="events")
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="appointment_events")
+    from_status = models.CharField(max_length=20, choices=APPOINTMENT_STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=APPOINTMENT_STATUS_CHOICES)
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="appointment_events"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['doctor', 'created_at'], name='appointment_event_doctor_idx'),
+        ]
+
+    def __str__(self):
+        return f"Appointment {self.appointment_id}: {self.from_status} -> {self.to_status}"
+
+
+def slot_start_for(scheduled_time):
+    """Start of the 30-minute slot containing scheduled_time"""
+    slot_minutes = int(SLOT_LENGTH.total_seconds() // 60)
+    return scheduled_time.replace(
+        minute=scheduled_time.minute - scheduled_time.minute % slot_minutes,
+        second=0,
+        microsecond=0
+    )
+
+
+WEEKDAY_CHOICES = (
+    (0, "Monday"),
+    (1, "Tuesday"),
+    (2, "Wednesday"),
+    (3, "Thursday"),
+    (4, "Friday"),
+    (5, "Saturday"),
+    (6, "Sunday"),
+)
+
+
+class AvailabilityTemplate(models.Model):
+    """
+    A doctor's recurring working hours: one window (local time) on one
+    weekday. A doctor can have several windows per day. The
+    materialize_slots command turns these into free DoctorSlot rows;
+    doctors with no template get OPD hours every day.
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="availability_templates")
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    class Meta:
+        ordering = ['weekday', 'start_time']
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'weekday', 'start_time'], name='unique_doctor_availability'),
+            models.CheckConstraint(condition=models.Q(start_time__lt=F('end_time')), name='availability_start_before_end'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} on {self.get_weekday_display()} {self.start_time}-{self.end_time}"
+
+
+class DoctorSlot(models.Model):
+    """
+    Slot inventory for a doctor's calendar.
+    Free rows (no appointment) are materialized ahead of time from the
+    doctor's AvailabilityTemplate, so a time is bookable only if its row
+    exists. The unique (doctor, slot_start) constraint is what prevents
+    double booking, and claiming a slot is a single conditional UPDATE
+    instead of a range scan over appointments.
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="slots")
+    slot_start = models.DateTimeField()
+    appointment = models.OneToOneField(
+        Appointment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="slot"
+    )
+
+    class Meta:
+        ordering = ['slot_start']
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'slot_start'], name='unique_doctor_slot'),
+        ]
+        indexes = [
+            # Free-slot search across doctors in time order
+            models.Index(
+                fields=['slot_start', 'doctor'],
+                name='doctor_slot_free_idx',
+                condition=models.Q(appointment__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} at {self.slot_start} ({'booked' if self.appointment_id else 'free'})"
+
+    @classmethod
+    def states(cls, doctor, slot_starts):
+        """
+        {slot_start: booked?} for the doctor's slots among slot_starts, in
+        one query. Starts with no row are outside the doctor's hours (or
+        not materialized yet) and are missing from the result.
+        """
+        return {
+            slot_start: appointment_id is not None
+            for slot_start, appointment_id in cls.objects.filter(
+                doctor=doctor, slot_start__in=list(slot_starts)
+            ).values_list('slot_start', 'appointment_id')
+        }
+
+    @classmethod
+    def claim(cls, appointment):
+        """
+        Attach the appointment to its slot. Returns False if the slot is
+        already taken or does not exist. Must run inside the booking
+        transaction.
+        """
+        return bool(cls.objects.filter(
+            doctor_id=appointment.doctor_id,
+            slot_start=slot_start_for(appointment.scheduled_time),
+            appointment__isnull=True
+        ).update(appointment=appointment))
+
+    @classmethod
+    def claim_many(cls, appointments):
+        """
+        All-or-nothing claim for several appointments of one doctor.
+        Returns False (claiming nothing) if any slot is taken or missing.
+        A single appointment takes the one conditional UPDATE of claim().
+        """
+        if len(appointments) == 1:
+            return cls.claim(appointments[0])
+        by_start = {slot_start_for(a.scheduled_time): a for a in appointments}
+        if len(by_start) != len(appointments):
+            return False
+        doctor_id = appointments[0].doctor_id
+        free = []
+        for slot in cls.objects.select_for_update().filter(doctor_id=doctor_id, slot_start__in=list(by_start)):
+            if slot.appointment_id:
+                return False
+            slot.appointment = by_start.pop(slot.slot_start)
+            free.append(slot)
+        if by_start:
+            return False
+        cls.objects.bulk_update(free, ['appointment'])
+        return True
+
+    @classmethod
+    def release(cls, appointment):
+        """Free the appointment's slot (on cancellation)"""
+        cls.objects.filter(appointment=appointment).update(appointment=None)
+
+
+class WalkInCounter(models.Model):
+    """
+    Last walk-in token issued for a doctor on a day.
+    Issuing a token is one UPDATE of this row, so a burst of tokens at
+    opening time never scans the day's appointments.
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="walk_in_counters")
+    day = models.DateField()
+    last_token = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'day'], name='unique_doctor_walk_in_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} on {self.day}: token {self.last_token}"
+
+    @classmethod
+    def next_token(cls, doctor_id, day):
+        """
+        Increment and return the doctor's token number for the day.
+        Must run inside the issuing transaction; the UPDATE holds the row
+        until it commits, so concurrent desks get consecutive numbers.
+        """
+        counters = cls.objects.filter(doctor_id=doctor_id, day=day)
+        if not counters.update(last_token=F('last_token') + 1):
+            try:
+                with transaction.atomic():
+                    cls.objects.create(doctor_id=doctor_id, day=day, last_token=1)
+                return 1
+            except IntegrityError:
+                # Another desk issued the day's first token
+                counters.update(last_token=F('last_token') + 1)
+        return counters.values_list('last_token', flat=True).get()
+
+
+POOL_TICKET_STATUS_CHOICES = (
+    ("WAITING", "Waiting"),
+    ("ASSIGNED", "Assigned"),
+    ("CANCELLED", "Cancelled"),
+)
+
+
+class PoolTicket(models.Model):
+    """
+    A patient waiting for whichever doctor of a specialization at an
+    organization is free first. The ticket gets an appointment when a
+    pooled doctor takes it (see take_next).
+    """
+    organization = models.ForeignKey(ProviderProfile, on_delete=models.CASCADE, related_name="pool_tickets")
+    specialization = models.CharField(max_length=100)
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name="pool_tickets")
+    status = models.CharField(max_length=20, choices=POOL_TICKET_STATUS_CHOICES, default="WAITING")
+    created_at = models.DateTimeField(auto_now_add=True)
+    appointment = models.OneToOneField(
+        Appointment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="pool_ticket"
+    )
+
+    # Re-route this many times when another doctor takes the routed ticket first
+    TAKE_ATTEMPTS = 5
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['organization', 'specialization', 'status', 'created_at'], name='pool_ticket_waiting_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient} waiting for {self.specialization} at {self.organization} ({self.status})"
+
+    @classmethod
+    def waiting(cls, organization_id, specialization, day):
+        """The pool's waiting tickets for a day, in arrival order"""
+        from .queue_state import day_bounds
+        return cls.objects.filter(
+            organization_id=organization_id,
+            specialization=specialization,
+            status='WAITING',
+            created_at__range=day_bounds(day)
+        ).order_by('created_at', 'id')
+
+    @classmethod
+    def take_next(cls, doctor, now=None):
+        """
+        Assign the doctor the first of today's waiting tickets in their pool
+        that pooled routing gives them (see pooling.next_for), as an
+        appointment starting now. Returns the appointment, or None if
+        nobody is waiting or every waiting patient goes to a doctor who is
+        free sooner. Must run inside a transaction.
+        """
+        from .pooling import next_for
+
+        if not doctor.organization_id:
+            return None
+        now = now or timezone.now()
+        doctor_ids = list(DoctorProfile.objects.filter(
+            organization_id=doctor.organization_id, specialization__iexact=doctor.specialization
+        ).values_list('id', flat=True))
+        for _ in range(cls.TAKE_ATTEMPTS):
+            tickets = list(cls.waiting(
+                doctor.organization_id, doctor.specialization, timezone.localdate(now)
+            ).values_list('id', 'patient_id'))
+            index = next_for(doctor.id, doctor_ids, len(tickets), now) if tickets else None
+            if index is None:
+                return None
+            ticket_id, patient_id = tickets[index]
+            appointment = Appointment.objects.create(
+                patient_id=patient_id,
+                doctor=doctor,
+                scheduled_time=now
+            )
+            # Conditional update: another doctor may have taken it first
+            if cls.objects.filter(pk=ticket_id, status='WAITING').update(status='ASSIGNED', appointment=appointment):
+                return appointment
+            appointment.delete()
+        return None
+
+
+WAITLIST_STATUS_CHOICES = (
+    ("WAITING", "Waiting"),
+    ("BOOKED", "Booked"),
+    ("CANCELLED", "Cancelled"),
+)
+
+
+class WaitlistEntry(models.Model):
+    """
+    A patient waiting for a slot with a doctor on a date, within a
+    preferred window of the day (local time). When a slot in the window is
+    freed by a cancellation, the longest-waiting matching entry is booked
+    into it (see services.fill_from_waitlist).
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="waitlist")
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name="waitlist_entries")
+    date = models.DateField()
+    window_start = models.TimeField()
+    window_end = models.TimeField()
+    status = models.CharField(max_length=20, choices=WAITLIST_STATUS_CHOICES, default="WAITING")
+    appointment = models.OneToOneField(
+        Appointment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="waitlist_entry"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['doctor', 'date', 'status', 'window_start'], name='waitlist_match_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient} waiting for {self.doctor} on {self.date} {self.window_start}-{self.window_end} ({self.status})"
+
+    @classmethod
+    def best_match(cls, doctor_id, slot_start):
+        """
+        Longest-waiting entry whose window contains the slot, locked for
+        booking. One range lookup on the (doctor, date, status,
+        window_start) index.
+        """
+        local = timezone.localtime(slot_start)
+        return cls.objects.select_for_update().filter(
+            doctor_id=doctor_id,
+            date=local.date(),
+            status='WAITING',
+            window_start__lte=local.time(),
+            window_end__gt=local.time()
+        ).order_by('created_at', 'id').first()
+
+
+class DelayNotification(models.Model):
+    """
+    A waiting patient was told their predicted delay changed.
+    Written by queue_state only for patients whose delay moved by at least
+    DELAY_NOTIFY_MINUTES since they were last told.
+    """
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name="delay_notifications")
+    delay_minutes = models.FloatField()
+    predicted_start_time = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Appointment {self.appointment_id}: {self.delay_minutes:.0f} min late"
+
+
+def _new_calendar_token():
+    import secrets
+    return secrets.token_urlsafe(24)
+
+
+class CalendarFeedToken(models.Model):
+    """
+    Secret in a doctor's ICS feed URL. Calendar apps cannot send a JWT, so
+    the token alone authorizes reading the feed; rotating it revokes
+    every subscribed copy of the URL.
+    """
+    doctor = models.OneToOneField(DoctorProfile, on_delete=models.CASCADE, related_name="calendar_feed")
+    token = models.CharField(max_length=64, unique=True, default=_new_calendar_token)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Calendar feed for {self.doctor}"
+
+    def rotate(self):
+        self.token = _new_calendar_token()
+        self.save(update_fields=['token'])
+
+
+# Upper edges (minutes) of the duration histogram used as a quantile sketch
+DURATION_BUCKETS = [5, 10, 15, 20, 25, 30, 40, 50, 60, 90, 120, 180]
+
+
+class DoctorDurationStats(models.Model):
+    """
+    Running consultation-duration statistics for a doctor, one row per
+    hour of day (local time the consultation started).
+    Updated incrementally when a consultation completes, so wait-time
+    prediction reads one row instead of re-averaging recent appointments.
+    """
+    # Weight of the newest consultation in the moving average/variance
+    ALPHA = 0.2
+    # Per-update decay of the histogram so it follows recent behaviour
+    SKETCH_DECAY = 0.98
+
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="duration_stats")
+    hour = models.PositiveSmallIntegerField(help_text="Hour of day (0-23) the consultations started")
+    count = models.PositiveIntegerField(default=0)
+    ewma_seconds = models.FloatField(default=0)
+    ewm_variance = models.FloatField(default=0)
+    sketch = models.JSONField(default=list, help_text="Decayed counts per DURATION_BUCKETS bucket (+ overflow)")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'hour'], name='unique_doctor_duration_hour'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} @ {self.hour:02d}h: {self.ewma_seconds / 60:.1f} min (n={self.count})"
+
+    def record(self, seconds):
+        """Fold one consultation duration into the statistics"""
+        if self.count == 0:
+            self.ewma_seconds = seconds
+            self.ewm_variance = 0.0
+        else:
+            diff = seconds - self.ewma_seconds
+            increment = self.ALPHA * diff
+            self.ewma_seconds += increment
+            self.ewm_variance = (1 - self.ALPHA) * (self.ewm_variance + diff * increment)
+        self.count += 1
+
+        sketch = [c * self.SKETCH_DECAY for c in self.sketch] or [0.0] * (len(DURATION_BUCKETS) + 1)
+        minutes = seconds / 60
+        index = next((i for i, edge in enumerate(DURATION_BUCKETS) if minutes <= edge), len(DURATION_BUCKETS))
+        sketch[index] += 1
+        self.sketch = sketch
+
+    def quantile(self, q):
+        """Approximate duration quantile in seconds, interpolated within a bucket"""
+        total = sum(self.sketch)
+        if not total:
+            return self.ewma_seconds
+        target = q * total
+        cumulative = 0.0
+        for index, weight in enumerate(self.sketch):
+            if weight and cumulative + weight >= target:
+                lower = DURATION_BUCKETS[index - 1] if index > 0 else 0
+                # Overflow bucket: extend by the width of the last bucket
+                upper = (
+                    DURATION_BUCKETS[index] if index < len(DURATION_BUCKETS)
+                    else lower + DURATION_BUCKETS[-1] - DURATION_BUCKETS[-2]
+                )
+                fraction = (target - cumulative) / weight
+                return (lower + fraction * (upper - lower)) * 60
+            cumulative += weight
+        return DURATION_BUCKETS[-1] * 60
+
+    @classmethod
+    def record_consultation(cls, appointment):
+        """Update the doctor's stats for the hour a completed consultation started"""
+        duration = appointment.actual_duration
+        if duration is None:
+            return None
+        hour = timezone.localtime(appointment.actual_start_time).hour
+        with transaction.atomic():
+            stats, _ = cls.objects.select_for_update().get_or_create(doctor_id=appointment.doctor_id, hour=hour)
+            stats.record(duration.total_seconds())
+            stats.save()
+        return stats
+
+
+class DoctorWeekStats(models.Model):
+    """
+    Utilization analytics vector (see analytics.LAYOUT) of one doctor's
+    ISO week that is already over, stored so a cold analytics read skips
+    that week's appointment rows. Written on the first read of the week
+    and refreshed by the snapshot_analytics command.
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="week_stats")
+    week_start = models.DateField(help_text="Monday of the week")
+    vector = models.BinaryField(help_text="zlib-compressed float32 array")
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'week_start'], name='unique_doctor_week_stats'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} week of {self.week_start}"
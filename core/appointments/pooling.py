@@ -0,0 +1,95 @@
+"""
+Pooled queues: patients waiting for whichever doctor of a specialization
+at an organization is free first.
+
+Waiting patients are routed in arrival order with a min-heap of
+(free_at, doctor_id): the patient at the head of the pool goes to the
+doctor who frees up earliest, and that doctor is pushed back with the
+consultation added. A doctor's free_at covers the consultation in progress
+and their own patients already due (bookings, walk-ins). The same routing
+drives the pool's predictions, the bench_pool simulation and the actual
+assignment: a pooled doctor asking for their next patient
+(PoolTicket.take_next) gets the first ticket the heap routes to them.
+"""
+import heapq
+from datetime import timedelta
+
+from django.utils import timezone
+
+from . import queue_state
+
+
+def route(doctor_free_at, arrivals, durations, prefer=None):
+    """
+    Assign patients to doctors, first come first served.
+
+    doctor_free_at: {doctor_id: seconds from now the doctor is free}
+    arrivals: seconds from now each patient arrives (ascending)
+    durations: consultation seconds for each patient
+    prefer: doctor_id that wins ties on free_at (the one asking)
+    Returns [(doctor_id, start_seconds)], one per patient.
+    """
+    heap = [(free_at, doctor_id != prefer, doctor_id) for doctor_id, free_at in doctor_free_at.items()]
+    heapq.heapify(heap)
+    plan = []
+    for arrival, duration in zip(arrivals, durations):
+        free_at, rank, doctor_id = heapq.heappop(heap)
+        start = max(free_at, arrival)
+        plan.append((doctor_id, start))
+        heapq.heappush(heap, (start + duration, rank, doctor_id))
+    return plan
+
+
+def doctor_free_at(doctor_id, now):
+    """
+    Seconds until the doctor is expected to be free for a pooled patient:
+    after the consultation in progress and their own patients already due
+    (0 if idle), from the doctor's in-memory queue.
+    """
+    return queue_state.get_queue(doctor_id, timezone.localdate(now)).busy_seconds(now)
+
+
+def _routing(doctor_ids, count, now, prefer=None):
+    """Route `count` waiting tickets, each taking the pool's average expected length for the current hour"""
+    free_at = {doctor_id: doctor_free_at(doctor_id, now) for doctor_id in doctor_ids}
+    estimates = [
+        queue_state.get_queue(doctor_id, timezone.localdate(now)).estimate(now).mean.total_seconds()
+        for doctor_id in doctor_ids
+    ]
+    duration = sum(estimates) / len(estimates)
+    return route(free_at, [0.0] * count, [duration] * count, prefer)
+
+
+def next_for(doctor_id, doctor_ids, count, now=None):
+    """
+    Index of the first of `count` waiting tickets (arrival order) that
+    routing gives `doctor_id`, or None if every one of them goes to a
+    doctor who is free sooner.
+    """
+    now = now or timezone.now()
+    plan = _routing(doctor_ids, count, now, prefer=doctor_id)
+    return next((index for index, (routed_to, _) in enumerate(plan) if routed_to == doctor_id), None)
+
+
+def predict(doctor_ids, tickets, now=None):
+    """
+    Expected doctor and start time for each waiting ticket, in the order
+    given.
+    """
+    now = now or timezone.now()
+    if not doctor_ids:
+        return []
+
+    plan = _routing(doctor_ids, len(tickets), now)
+    results = []
+    for position, (ticket, (doctor_id, start)) in enumerate(zip(tickets, plan)):
+        results.append({
+            "ticket_id": ticket.id,
+            "patient_id": ticket.patient_id,
+            "joined_at": ticket.created_at,
+            "queue_position": position + 1,
+            "expected_doctor_id": doctor_id,
+            "predicted_start_time": now + timedelta(seconds=start),
+            "estimated_wait_minutes": round(start / 60, 1),
+        })
+    return results
@@ -0,0 +1,551 @@
+"""
+In-memory queue state for a doctor's day.
+
+WaitTimeView used to rebuild the queue from the Appointment table on every
+poll (recent completions, people ahead, in-progress, earliest scheduled...).
+A DoctorQueue holds that state for one doctor and one day. It is loaded from
+the DB once and then kept current by the views that change an appointment
+(book, start, complete, cancel), so answering a wait-time poll is a bisect
+over a sorted list instead of a handful of COUNT queries. Predicted start
+times come from a simulation of the remaining day (simulation.py), rerun
+on the first read after each mutation.
+
+Priority patients (emergency, elderly) are seen ahead of scheduled ones
+once they have arrived. The serving order is worked out in memory from
+the waiting list when the queue changes, so inserting an emergency
+re-predicts everyone behind it without touching the DB.
+
+Starting or completing a consultation (and changing a priority, or any
+change to a queue that is already loaded) also recomputes the remaining
+queue once and notifies only the patients whose predicted delay moved by
+DELAY_NOTIFY_MINUTES or more, or whose place in the queue changed, since
+they were last told. Notification cost follows the patients affected, not
+the number of clients polling.
+
+State lives in the worker process. Each queue is reloaded after
+QUEUE_TTL_SECONDS so workers that did not see a mutation converge quickly.
+"""
+import threading
+import time as monotonic_time
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import ics
+from .events import appointment_topic, broadcaster
+from .models import Appointment, DelayNotification, DoctorDurationStats, DEFAULT_PRIORITY, PRIORITY_RANK
+from .simulation import dispatch_order, lognormal_params, simulate_starts
+
+# Default to 15 minutes per consultation when no historical data is available
+DEFAULT_DURATION = timedelta(minutes=15)
+MIN_DURATION = timedelta(minutes=15)
+
+# Consultation length estimate for one hour of the day
+DurationEstimate = namedtuple("DurationEstimate", ["mean", "p50", "p90"])
+DEFAULT_ESTIMATE = DurationEstimate(DEFAULT_DURATION, DEFAULT_DURATION, DEFAULT_DURATION)
+
+# Waiting list in serving order, with its simulated start times
+QueuePlan = namedtuple("QueuePlan", ["appointment_ids", "index", "scheduled_times", "simulation"])
+
+QUEUE_TTL_SECONDS = 60
+# Rerun the day simulation at least this often even if nothing changed,
+# since the consultation in progress keeps running
+SIMULATION_MAX_AGE = timedelta(seconds=30)
+# Tell a waiting patient when their predicted delay has moved this much
+# since they were last told (or from on time, if never)
+DELAY_NOTIFY_MINUTES = 10
+
+
+def day_bounds(day):
+    """Aware (start, end) datetimes covering a calendar day"""
+    start_of_day = timezone.make_aware(datetime.combine(day, time.min))
+    end_of_day = timezone.make_aware(datetime.combine(day, time.max))
+    return start_of_day, end_of_day
+
+
+def queue_day(scheduled_time):
+    """The queue (calendar day) an appointment belongs to"""
+    return timezone.localdate(scheduled_time)
+
+
+def estimate_from_stats(stats):
+    """DurationEstimate from a DoctorDurationStats row (minimum 15 minutes)"""
+    def floor(seconds):
+        return max(timedelta(seconds=seconds), MIN_DURATION)
+    return DurationEstimate(
+        floor(stats.ewma_seconds), floor(stats.quantile(0.5)), floor(stats.quantile(0.9))
+    )
+
+
+class DoctorQueue:
+    """
+    Waiting list for one doctor on one day.
+
+    Waiting appointments are kept as a sorted list of (scheduled_time, id)
+    keys. The serving order is that list, rearranged by dispatch_order
+    when any waiting patient has a priority.
+    """
+
+    def __init__(self, doctor_id, day, estimates=None):
+        self.doctor_id = doctor_id
+        self.day = day
+        self.loaded_at = monotonic_time.monotonic()
+        self._keys = []            # sorted (scheduled_time, appointment_id)
+        self._waiting = {}         # appointment_id -> key in self._keys
+        self._priority = {}        # appointment_id -> priority, if not DEFAULT_PRIORITY
+        self._in_progress = {}     # appointment_id -> actual_start_time
+        self._estimates = dict(estimates or {})  # hour of day -> DurationEstimate
+        self._version = 0          # bumped on every mutation
+        self._plan = None          # (version, now, QueuePlan)
+        self._notified_delay = {}  # appointment_id -> delay (minutes) last sent to the patient
+        self._notified_position = {}  # appointment_id -> queue_position last sent to the patient
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_db(cls, doctor_id, day):
+        """Build the queue with one query for the day and one for duration stats"""
+        estimates = {
+            stats.hour: estimate_from_stats(stats)
+            for stats in DoctorDurationStats.objects.filter(doctor_id=doctor_id)
+        }
+        queue = cls(doctor_id, day, estimates=estimates)
+
+        rows = Appointment.objects.filter(
+            doctor_id=doctor_id,
+            scheduled_time__range=day_bounds(day),
+            status__in=['SCHEDULED', 'IN_PROGRESS']
+        ).values_list('id', 'scheduled_time', 'status', 'actual_start_time', 'priority')
+
+        for appointment_id, scheduled_time, status, actual_start_time, priority in rows:
+            if status == 'IN_PROGRESS':
+                queue._in_progress[appointment_id] = actual_start_time
+            else:
+                queue._add(appointment_id, scheduled_time, priority)
+        return queue
+
+    @property
+    def expired(self):
+        return monotonic_time.monotonic() - self.loaded_at > QUEUE_TTL_SECONDS
+
+    def estimate(self, at):
+        """Consultation length estimate for the hour of day `at` falls in"""
+        return self._estimates.get(timezone.localtime(at).hour, DEFAULT_ESTIMATE)
+
+    @property
+    def waiting_count(self):
+        return len(self._keys)
+
+    # ---- mutations ----
+
+    def _add(self, appointment_id, scheduled_time, priority=DEFAULT_PRIORITY):
+        key = (scheduled_time, appointment_id)
+        self._waiting[appointment_id] = key
+        insort(self._keys, key)
+        if priority != DEFAULT_PRIORITY:
+            self._priority[appointment_id] = priority
+
+    def _discard(self, appointment_id):
+        key = self._waiting.pop(appointment_id, None)
+        if key is not None:
+            index = bisect_left(self._keys, key)
+            del self._keys[index]
+        self._priority.pop(appointment_id, None)
+
+    def add(self, appointment_id, scheduled_time, priority=DEFAULT_PRIORITY):
+        with self._lock:
+            self._version += 1
+            self._discard(appointment_id)
+            self._add(appointment_id, scheduled_time, priority)
+
+    def set_priority(self, appointment_id, priority):
+        with self._lock:
+            if appointment_id not in self._waiting:
+                return
+            self._version += 1
+            if priority == DEFAULT_PRIORITY:
+                self._priority.pop(appointment_id, None)
+            else:
+                self._priority[appointment_id] = priority
+
+    def remove(self, appointment_id):
+        with self._lock:
+            self._version += 1
+            self._discard(appointment_id)
+            self._in_progress.pop(appointment_id, None)
+            self._notified_delay.pop(appointment_id, None)
+            self._notified_position.pop(appointment_id, None)
+
+    def start(self, appointment_id, started_at):
+        with self._lock:
+            self._version += 1
+            self._discard(appointment_id)
+            self._in_progress[appointment_id] = started_at
+            self._notified_delay.pop(appointment_id, None)
+            self._notified_position.pop(appointment_id, None)
+
+    def complete(self, appointment_id, hour=None, estimate=None):
+        with self._lock:
+            self._version += 1
+            self._discard(appointment_id)
+            self._in_progress.pop(appointment_id, None)
+            self._notified_delay.pop(appointment_id, None)
+            self._notified_position.pop(appointment_id, None)
+            if estimate is not None:
+                self._estimates[hour] = estimate
+
+    # ---- queries ----
+
+    def is_waiting(self, appointment_id):
+        return appointment_id in self._waiting
+
+    def priority(self, appointment_id):
+        return self._priority.get(appointment_id, DEFAULT_PRIORITY)
+
+    def position(self, appointment_id, now=None):
+        """Number of waiting appointments ahead of this one, or None if not waiting"""
+        with self._lock:
+            if appointment_id not in self._waiting:
+                return None
+            return self._current_plan(now or timezone.now()).index[appointment_id]
+
+    def order(self, now=None):
+        """Waiting appointment ids in the order the doctor will see them"""
+        with self._lock:
+            return list(self._current_plan(now or timezone.now()).appointment_ids)
+
+    def current_start(self):
+        """actual_start_time of the consultation in progress, if any"""
+        if not self._in_progress:
+            return None
+        starts = [s for s in self._in_progress.values() if s]
+        return min(starts) if starts else None
+
+    def busy_seconds(self, now):
+        """
+        Seconds from `now` until the doctor is expected to have finished the
+        consultation in progress and every waiting patient due by then
+        (mean estimates, in scheduled order); 0 if idle with nobody due.
+        """
+        with self._lock:
+            clock = 0.0
+            started_at = self.current_start()
+            if started_at is not None:
+                clock = max((started_at + self.estimate(started_at).mean - now).total_seconds(), 0.0)
+            elif self._in_progress:
+                clock = self.estimate(now).mean.total_seconds()
+            for scheduled_time, _ in self._keys:
+                due = (scheduled_time - now).total_seconds()
+                if due > clock:
+                    break
+                clock = max(clock, due) + self.estimate(scheduled_time).mean.total_seconds()
+            return clock
+
+    def _current_plan(self, now):
+        """
+        Serving order and simulated start times of the waiting list, reused
+        until the queue changes or the result is SIMULATION_MAX_AGE old.
+        """
+        cached = self._plan
+        if cached is not None and cached[0] == self._version and now - cached[1] < SIMULATION_MAX_AGE:
+            return cached[2]
+
+        scheduled = [(scheduled_time - now).total_seconds() for scheduled_time, _ in self._keys]
+        estimates = [self.estimate(scheduled_time) for scheduled_time, _ in self._keys]
+        busy = None
+        in_progress_start = self.current_start()
+        if in_progress_start:
+            busy = ((now - in_progress_start).total_seconds(), self.estimate(in_progress_start))
+        elif self._in_progress:
+            # Started without a recorded start time; assume it just began
+            busy = (0, self.estimate(now))
+
+        order = range(len(self._keys))
+        if self._priority:
+            free_at = max(busy[1].p50.total_seconds() - busy[0], 0) if busy else 0
+            ranks = [PRIORITY_RANK[self.priority(appointment_id)] for _, appointment_id in self._keys]
+            order = dispatch_order(scheduled, ranks, [e.p50.total_seconds() for e in estimates], free_at)
+
+        if busy:
+            busy = (busy[0],) + lognormal_params(busy[1])
+        result = simulate_starts(
+            [scheduled[i] for i in order], [lognormal_params(estimates[i]) for i in order], busy, seed=self.doctor_id
+        )
+        appointment_ids = [self._keys[i][1] for i in order]
+        plan = QueuePlan(
+            appointment_ids,
+            {appointment_id: index for index, appointment_id in enumerate(appointment_ids)},
+            [self._keys[i][0] for i in order],
+            result
+        )
+        self._plan = (self._version, now, plan)
+        return plan
+
+    def _prediction(self, ahead, index, simulation, now, scheduled_time):
+        """Response for the waiting appointment at `index` of the simulation"""
+        estimate = self.estimate(scheduled_time)
+
+        def start(band):
+            # Never earlier than the scheduled time
+            return max(now + timedelta(seconds=float(band[index])), scheduled_time)
+
+        predicted_start_p10 = start(simulation.p10)
+        predicted_start = start(simulation.p50)
+        predicted_start_p90 = start(simulation.p90)
+
+        # Calculate wait time as delay beyond scheduled time
+        # (running on time or early - no wait)
+        delay_minutes = (predicted_start - scheduled_time).total_seconds() / 60
+        delay_minutes_p90 = (predicted_start_p90 - scheduled_time).total_seconds() / 60
+
+        return {
+            "queue_position": ahead + 1,
+            "people_ahead": ahead,
+            "avg_consultation_minutes": round(estimate.mean.total_seconds() / 60, 1),
+            "consultation_p50_minutes": round(estimate.p50.total_seconds() / 60, 1),
+            "consultation_p90_minutes": round(estimate.p90.total_seconds() / 60, 1),
+            "estimated_wait_minutes": round(delay_minutes, 1),
+            "predicted_start_time": predicted_start,
+            "predicted_start_time_p10": predicted_start_p10,
+            "predicted_start_time_p90": predicted_start_p90,
+            "delay_minutes": round(delay_minutes, 1),
+            "delay_minutes_p90": round(delay_minutes_p90, 1),
+            "current_status": "waiting"
+        }
+
+    def wait_time(self, appointment_id, scheduled_time, now=None, priority=DEFAULT_PRIORITY):
+        """
+        Predicted wait for a SCHEDULED appointment, in the WaitTimeView
+        response format.
+        """
+        now = now or timezone.now()
+        with self._lock:
+            if appointment_id not in self._waiting:
+                # Booked through another worker since this queue was loaded
+                self.add(appointment_id, scheduled_time, priority)
+
+            plan = self._current_plan(now)
+            waiting_ahead = plan.index[appointment_id]
+            ahead = waiting_ahead + len(self._in_progress)
+            self._notified_position[appointment_id] = ahead + 1
+
+        return self._prediction(ahead, waiting_ahead, plan.simulation, now, scheduled_time)
+
+    def wait_times(self, now=None):
+        """
+        Predictions for every waiting appointment from one simulation of the
+        queue, in the order the doctor will see them.
+        """
+        now = now or timezone.now()
+        with self._lock:
+            if not self._keys:
+                return []
+            plan = self._current_plan(now)
+            priorities = dict(self._priority)
+            in_progress = len(self._in_progress)
+
+        results = []
+        for waiting_ahead, (appointment_id, scheduled_time) in enumerate(zip(plan.appointment_ids, plan.scheduled_times)):
+            prediction = self._prediction(
+                waiting_ahead + in_progress, waiting_ahead, plan.simulation, now, scheduled_time
+            )
+            results.append(dict(
+                appointment_id=appointment_id,
+                scheduled_time=scheduled_time,
+                priority=priorities.get(appointment_id, DEFAULT_PRIORITY),
+                **prediction
+            ))
+        return results
+
+    def changes(self, now=None):
+        """
+        Predictions (wait_times format) of the waiting patients to tell
+        about, as (delayed, moved): delayed have a delay that moved by
+        DELAY_NOTIFY_MINUTES or more, moved only a new queue_position.
+        Records what they are told.
+        """
+        delayed, moved = [], []
+        predictions = self.wait_times(now)
+        with self._lock:
+            for prediction in predictions:
+                appointment_id = prediction["appointment_id"]
+                told = self._notified_delay.get(appointment_id, 0.0)
+                position = self._notified_position.get(appointment_id)
+                self._notified_position[appointment_id] = prediction["queue_position"]
+                if abs(prediction["delay_minutes"] - told) >= DELAY_NOTIFY_MINUTES:
+                    self._notified_delay[appointment_id] = prediction["delay_minutes"]
+                    delayed.append(prediction)
+                elif position is not None and position != prediction["queue_position"]:
+                    moved.append(prediction)
+        return delayed, moved
+
+
+# ============ Registry ============
+
+_queues = {}
+_registry_lock = threading.Lock()
+
+
+def get_queue(doctor_id, day):
+    """Return the queue for (doctor, day), loading it from the DB if needed"""
+    key = (doctor_id, day)
+    queue = _queues.get(key)
+    if queue is not None and not queue.expired:
+        return queue
+
+    previous = queue
+    queue = DoctorQueue.from_db(doctor_id, day)
+    if previous is not None:
+        # Keep what patients were already told across reloads
+        queue._notified_delay.update(previous._notified_delay)
+        queue._notified_position.update(previous._notified_position)
+    with _registry_lock:
+        # Drop queues for days that are already over
+        today = timezone.localdate()
+        for stale in [k for k in _queues if k[1] < today]:
+            del _queues[stale]
+        _queues[key] = queue
+    return queue
+
+
+def clear_queues():
+    with _registry_lock:
+        _queues.clear()
+
+
+def _apply(doctor_id, day, mutate, event, propagate=False):
+    """
+    Apply a mutation to a loaded queue once the surrounding transaction
+    commits, and push the delta to anyone streaming this doctor's queue
+    or the appointment. Queues that are not loaded are left alone; they
+    will be built from the DB when first needed.
+    Patients whose prediction moved are then notified (see
+    propagate_delays) if the queue is loaded, or with propagate, after
+    loading it.
+    The doctor's calendar feed snapshot is dropped either way.
+    """
+    def callback():
+        ics.invalidate(doctor_id)
+        queue = _queues.get((doctor_id, day))
+        if queue is not None:
+            mutate(queue)
+        if event is not None:
+            event_data = dict(event, doctor_id=doctor_id, date=day.isoformat())
+            broadcaster.publish(doctor_id, event_data)
+            if "appointment_id" in event:
+                broadcaster.publish(appointment_topic(event["appointment_id"]), event_data)
+        if propagate or queue is not None:
+            propagate_delays(queue or get_queue(doctor_id, day))
+    transaction.on_commit(callback)
+
+
+def propagate_delays(queue, now=None):
+    """
+    Recompute the queue's predictions once, then record a DelayNotification
+    and send a `delay` event for each patient whose predicted delay moved
+    by DELAY_NOTIFY_MINUTES or more, and a `position` event for each one
+    who only moved in the queue. Returns the delayed predictions.
+    """
+    changed, moved = queue.changes(now)
+    for prediction in moved:
+        broadcaster.publish(appointment_topic(prediction["appointment_id"]), {
+            "type": "position",
+            "appointment_id": prediction["appointment_id"],
+            "doctor_id": queue.doctor_id,
+            "date": queue.day.isoformat(),
+            "queue_position": prediction["queue_position"],
+        })
+    if not changed:
+        return changed
+    DelayNotification.objects.bulk_create([
+        DelayNotification(
+            appointment_id=prediction["appointment_id"],
+            delay_minutes=prediction["delay_minutes"],
+            predicted_start_time=prediction["predicted_start_time"]
+        )
+        for prediction in changed
+    ])
+    for prediction in changed:
+        broadcaster.publish(appointment_topic(prediction["appointment_id"]), {
+            "type": "delay",
+            "appointment_id": prediction["appointment_id"],
+            "doctor_id": queue.doctor_id,
+            "date": queue.day.isoformat(),
+            "delay_minutes": prediction["delay_minutes"],
+            "predicted_start_time": prediction["predicted_start_time"].isoformat(),
+        })
+    return changed
+
+
+def _record_load(appointment, scheduled_time, delta, claims_slot=None):
+    """Update the doctor recommendation tables once the transaction commits"""
+    from . import recommend
+
+    doctor_id = appointment.doctor_id
+    if claims_slot is None:
+        claims_slot = not appointment.is_walk_in
+    transaction.on_commit(lambda: recommend.record(doctor_id, scheduled_time, delta, claims_slot))
+
+
+def appointment_booked(appointment):
+    appointment_id, scheduled_time, priority = appointment.id, appointment.scheduled_time, appointment.priority
+    _record_load(appointment, scheduled_time, 1)
+    _apply(appointment.doctor_id, queue_day(scheduled_time),
+           lambda q: q.add(appointment_id, scheduled_time, priority),
+           {"type": "booked", "appointment_id": appointment_id, "scheduled_time": scheduled_time.isoformat(),
+            "priority": priority})
+
+
+def appointment_reprioritized(appointment):
+    appointment_id, priority = appointment.id, appointment.priority
+    _apply(appointment.doctor_id, queue_day(appointment.scheduled_time),
+           lambda q: q.set_priority(appointment_id, priority),
+           {"type": "priority", "appointment_id": appointment_id, "priority": priority},
+           propagate=True)
+
+
+def appointment_rescheduled(appointment, previous_scheduled_time):
+    """Move the appointment between (or within) day queues"""
+    appointment_id, scheduled_time, priority = appointment.id, appointment.scheduled_time, appointment.priority
+    event = {"type": "rescheduled", "appointment_id": appointment_id, "scheduled_time": scheduled_time.isoformat(),
+             "previous_scheduled_time": previous_scheduled_time.isoformat()}
+    _record_load(appointment, previous_scheduled_time, -1)
+    _record_load(appointment, scheduled_time, 1)
+    previous_day, day = queue_day(previous_scheduled_time), queue_day(scheduled_time)
+    if previous_day != day:
+        _apply(appointment.doctor_id, previous_day, lambda q: q.remove(appointment_id), None)
+    _apply(appointment.doctor_id, day, lambda q: q.add(appointment_id, scheduled_time, priority), event)
+
+
+def appointment_started(appointment):
+    appointment_id, started_at = appointment.id, appointment.actual_start_time
+    _apply(appointment.doctor_id, queue_day(appointment.scheduled_time),
+           lambda q: q.start(appointment_id, started_at),
+           {"type": "started", "appointment_id": appointment_id},
+           propagate=True)
+
+
+def appointment_completed(appointment, stats=None):
+    """`stats` is the DoctorDurationStats row updated for this consultation"""
+    from . import recommend
+
+    appointment_id, doctor_id = appointment.id, appointment.doctor_id
+    hour = stats.hour if stats else None
+    estimate = estimate_from_stats(stats) if stats else None
+    _record_load(appointment, appointment.scheduled_time, -1, claims_slot=False)
+    if estimate is not None:
+        transaction.on_commit(lambda: recommend.set_estimate(doctor_id, hour, estimate.mean.total_seconds()))
+    _apply(appointment.doctor_id, queue_day(appointment.scheduled_time),
+           lambda q: q.complete(appointment_id, hour, estimate),
+           {"type": "completed", "appointment_id": appointment_id},
+           propagate=True)
+
+
+def appointment_cancelled(appointment):
+    appointment_id = appointment.id
+    _record_load(appointment, appointment.scheduled_time, -1)
+    _apply(appointment.doctor_id, queue_day(appointment.scheduled_time),
+           lambda q: q.remove(appointment_id),
+           {"type": "cancelled", "appointment_id": appointment_id})
@@ -0,0 +1,242 @@
+"""
+Load-aware doctor recommendation.
+
+Ranks the doctors of a specialization by the wait a new patient can
+expect in a time window, so bookings spread across doctors instead of
+piling onto the first one listed.
+
+A LoadTable per specialization holds, for every doctor, which of the
+30-minute slots over the next HORIZON_DAYS are within their working hours
+(materialized), the open (scheduled or in progress) appointments in each
+and the mean consultation length for each hour of the day. It is built
+with four queries covering all the doctors. The same queue_state hooks
+that keep the day queues current then update it (booked, cancelled,
+rescheduled, completed), so ranking is array arithmetic with no
+per-doctor queries. Like the day queues, tables live in the worker
+process and are rebuilt after TABLE_TTL_SECONDS.
+
+The expected wait at a slot is the backlog carried into it. Each slot
+adds its open appointments times the doctor's mean for that hour and
+serves up to one slot length of work. Slots that have already passed
+serve nothing, so late patients still waiting count as backlog. The
+backlog starts from zero each morning.
+"""
+import threading
+import time as monotonic_time
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from users.models import DoctorProfile
+from .models import Appointment, DoctorDurationStats, DoctorSlot, SLOT_LENGTH
+from .queue_state import DEFAULT_DURATION, estimate_from_stats
+
+HORIZON_DAYS = 14
+TABLE_TTL_SECONDS = 60
+SLOTS_PER_DAY = int(timedelta(days=1) / SLOT_LENGTH)
+SLOT_SECONDS = SLOT_LENGTH.total_seconds()
+
+
+class LoadTable:
+    """Open appointments and consultation lengths for the doctors of one specialization"""
+
+    def __init__(self, specialization, doctors, day, estimates=None):
+        self.specialization = specialization
+        self.day = day
+        self.loaded_at = monotonic_time.monotonic()
+        self.doctors = doctors     # [{'doctor_id', 'doctor_name', ...}] in table order
+        self.index = {doctor['doctor_id']: i for i, doctor in enumerate(doctors)}
+
+        tz = timezone.get_current_timezone()
+        self.slot_starts = [
+            timezone.make_aware(datetime.combine(day + timedelta(days=d), time.min), tz) + k * SLOT_LENGTH
+            for d in range(HORIZON_DAYS) for k in range(SLOTS_PER_DAY)
+        ]
+        self._slot_epochs = np.array([start.timestamp() for start in self.slot_starts])
+        self._slot_hours = np.array([timezone.localtime(start).hour for start in self.slot_starts])
+
+        shape = (len(doctors), len(self.slot_starts))
+        self.open = np.zeros(shape)                 # open appointments per slot
+        self.booked = np.zeros(shape, dtype=int)    # claimed slots (walk-ins have none)
+        self.available = np.zeros(shape, dtype=bool)  # materialized slots (within working hours)
+        self.mean_seconds = np.full((len(doctors), 24), DEFAULT_DURATION.total_seconds())
+        for (doctor_id, hour), seconds in (estimates or {}).items():
+            self.mean_seconds[self.index[doctor_id], hour] = seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_db(cls, specialization, day):
+        """One query each for the doctors, their duration stats, their slots and their open appointments"""
+        doctors = [
+            {
+                'doctor_id': doc.id,
+                'doctor_name': f"Dr. {doc.user.first_name} {doc.user.last_name}".strip(),
+                'specialization': doc.specialization,
+                'organization_id': doc.organization_id,
+                'consultation_fee': str(doc.consultation_fee),
+            }
+            for doc in DoctorProfile.objects.filter(specialization__iexact=specialization).select_related('user').order_by('id')
+        ]
+        doctor_ids = [doctor['doctor_id'] for doctor in doctors]
+        estimates = {
+            (stats.doctor_id, stats.hour): estimate_from_stats(stats).mean.total_seconds()
+            for stats in DoctorDurationStats.objects.filter(doctor_id__in=doctor_ids, count__gt=0)
+        }
+        table = cls(specialization, doctors, day, estimates)
+
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        slots = DoctorSlot.objects.filter(
+            doctor_id__in=doctor_ids,
+            slot_start__gte=start,
+            slot_start__lt=start + timedelta(days=HORIZON_DAYS),
+        ).values_list('doctor_id', 'slot_start')
+        for doctor_id, slot_start in slots:
+            slot = table._slot(slot_start)
+            if slot is not None:
+                table.available[table.index[doctor_id], slot] = True
+
+        rows = Appointment.objects.filter(
+            doctor_id__in=doctor_ids,
+            scheduled_time__gte=start,
+            scheduled_time__lt=start + timedelta(days=HORIZON_DAYS),
+            status__in=['SCHEDULED', 'IN_PROGRESS']
+        ).values_list('doctor_id', 'scheduled_time', 'token_number')
+        for doctor_id, scheduled_time, token_number in rows:
+            table._record(doctor_id, scheduled_time, 1, claims_slot=token_number is None)
+        return table
+
+    @property
+    def expired(self):
+        return (
+            monotonic_time.monotonic() - self.loaded_at > TABLE_TTL_SECONDS
+            or self.day != timezone.localdate()
+        )
+
+    def _slot(self, moment):
+        """Slot index for `moment`, or None past the horizon"""
+        day = (timezone.localdate(moment) - self.day).days
+        if not 0 <= day < HORIZON_DAYS:
+            return None
+        opens = self._slot_epochs[day * SLOTS_PER_DAY]
+        k = int((moment.timestamp() - opens) // SLOT_SECONDS)
+        return day * SLOTS_PER_DAY + min(max(k, 0), SLOTS_PER_DAY - 1)
+
+    def _record(self, doctor_id, scheduled_time, delta, claims_slot=True):
+        i = self.index.get(doctor_id)
+        slot = self._slot(scheduled_time)
+        if i is None or slot is None:
+            return
+        self.open[i, slot] = max(self.open[i, slot] + delta, 0)
+        if claims_slot:
+            self.booked[i, slot] = max(self.booked[i, slot] + delta, 0)
+
+    def record(self, doctor_id, scheduled_time, delta, claims_slot=True):
+        with self._lock:
+            self._record(doctor_id, scheduled_time, delta, claims_slot)
+
+    def set_estimate(self, doctor_id, hour, seconds):
+        i = self.index.get(doctor_id)
+        if i is not None:
+            with self._lock:
+                self.mean_seconds[i, hour] = seconds
+
+    def backlog(self, now):
+        """(doctors, slots) seconds of work carried into the start of each slot"""
+        with self._lock:
+            work = self.open * self.mean_seconds[:, self._slot_hours]
+        served = np.clip(self._slot_epochs + SLOT_SECONDS - now.timestamp(), 0, SLOT_SECONDS)
+        excess = (work - served).reshape(len(self.doctors), HORIZON_DAYS, SLOTS_PER_DAY)
+        # Lindley recursion b[s] = max(0, b[s-1] + excess[s]) as a cumsum
+        # minus its running minimum, restarted every day
+        total = np.cumsum(excess, axis=2)
+        after = total - np.minimum(np.minimum.accumulate(total, axis=2), 0)
+        carried = np.concatenate([np.zeros(after.shape[:2] + (1,)), after[:, :, :-1]], axis=2)
+        return carried.reshape(len(self.doctors), -1)
+
+    def rank(self, window_start, window_end, now=None):
+        """
+        Doctors ordered by the expected wait at their best free slot in
+        [window_start, window_end), then by how many patients they already
+        have in the window. Doctors with no free slot come last.
+        """
+        now = now or timezone.now()
+        carried = self.backlog(now)
+        in_window = (
+            (self._slot_epochs >= max(window_start, now).timestamp())
+            & (self._slot_epochs + SLOT_SECONDS <= window_end.timestamp())
+        )
+        with self._lock:
+            free = in_window & self.available & (self.booked == 0)
+            open_in_window = self.open[:, in_window].sum(axis=1)
+        wait = np.where(free, carried, np.inf)
+        best = wait.argmin(axis=1)
+
+        results = []
+        for i, doctor in enumerate(self.doctors):
+            has_slot = bool(free[i, best[i]])
+            results.append(dict(
+                doctor,
+                recommended_slot=self.slot_starts[best[i]] if has_slot else None,
+                predicted_wait_minutes=round(float(wait[i, best[i]]) / 60, 1) if has_slot else None,
+                free_slots=int(free[i].sum()),
+                booked_in_window=int(open_in_window[i]),
+            ))
+        results.sort(key=lambda r: (
+            r['recommended_slot'] is None,
+            r['predicted_wait_minutes'] or 0,
+            r['booked_in_window'],
+            r['recommended_slot'] or now,
+        ))
+        return results
+
+
+# ============ Registry ============
+
+_tables = {}
+_registry_lock = threading.Lock()
+
+
+def get_table(specialization):
+    """
+    Return the load table for a specialization, building it if needed, or
+    None if no doctor has it. Only specializations with doctors are
+    registered, and expired tables are dropped whenever one is added, so
+    arbitrary request input can't grow the registry.
+    """
+    key = specialization.lower()
+    table = _tables.get(key)
+    if table is not None and not table.expired:
+        return table
+    if not DoctorProfile.objects.filter(specialization__iexact=specialization).exists():
+        return None
+    table = LoadTable.from_db(specialization, timezone.localdate())
+    with _registry_lock:
+        for stale in [k for k, t in _tables.items() if t.expired]:
+            del _tables[stale]
+        _tables[key] = table
+    return table
+
+
+def _tables_for(doctor_id):
+    return [table for table in list(_tables.values()) if doctor_id in table.index]
+
+
+def record(doctor_id, scheduled_time, delta, claims_slot=True):
+    """
+    An open appointment was added (+1) or closed (-1) in the tables that
+    hold this doctor. claims_slot is False for walk-ins, which have no
+    slot, and for completions, which keep theirs.
+    """
+    for table in _tables_for(doctor_id):
+        table.record(doctor_id, scheduled_time, delta, claims_slot)
+
+
+def set_estimate(doctor_id, hour, seconds):
+    for table in _tables_for(doctor_id):
+        table.set_estimate(doctor_id, hour, seconds)
+
+
+def clear_tables():
+    with _registry_lock:
+        _tables.clear()
@@ -1,7 +1,27 @@
 from rest_framework import serializers
 from django.utils import timezone
-from .models import Appointment, APPOINTMENT_STATUS_CHOICES
-from users.models import PatientProfile, DoctorProfile
+from datetime import timedelta
+
+from .models import (
+    Appointment, AvailabilityTemplate, DelayNotification, DoctorSlot, WaitlistEntry,
+    APPOINTMENT_STATUS_CHOICES, PRIORITY_CHOICES, slot_start_for
+)
+from users.models import PatientProfile, DoctorProfile, ProviderProfile
+
+
+def slot_problem(doctor, scheduled_time):
+    """
+    Early check against the slot inventory (a single indexed lookup).
+    Returns why the slot can't be booked, or None. The authoritative check
+    is the slot claim when booking.
+    """
+    slot_start = slot_start_for(scheduled_time)
+    booked = DoctorSlot.states(doctor, [slot_start]).get(slot_start)
+    if booked is None:
+        return "The doctor is not available at this time. Please choose a time within their working hours."
+    if booked:
+        return "This time slot is already booked. Please choose a different time."
+    return None
 
 
 class AppointmentSerializer(serializers.ModelSerializer):
@@ -19,11 +39,16 @@ class AppointmentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'patient', 'patient_name', 'patient_abha',
             'doctor', 'doctor_name', 'doctor_specialization',
-            'scheduled_time', 'status', 'estimated_duration',
+            'scheduled_time', 'status', 'priority', 'estimated_duration',
             'actual_start_time', 'actual_end_time', 'actual_duration_minutes',
-            'journey_step', 'journey_id', 'created_at', 'is_paid', 'consultation_fee'
+            'journey_step', 'journey_id', 'token_number', 'created_at', 'is_paid', 'consultation_fee'
+        ]
+        # Status only changes through the action endpoints (Appointment.transition),
+        # and doctor and time only through reschedule, which moves the slot claim
+        read_only_fields = [
+            'patient', 'doctor', 'scheduled_time', 'status', 'priority', 'journey_step',
+            'actual_start_time', 'actual_end_time', 'token_number', 'created_at', 'is_paid'
         ]
-        read_only_fields = ['actual_start_time', 'actual_end_time', 'created_at', 'is_paid']
     
     def get_patient_name(self, obj):
         return f"{obj.patient.user.first_name} {obj.patient.user.last_name}".strip() or obj.patient.user.email
@@ -77,9 +102,6 @@ class AppointmentCreateSerializer(serializers.ModelSerializer):
         return value
     
     def validate(self, data):
-        from django.db import transaction
-        from datetime import timedelta
-        
         journey_id = data.get('journey_id')
         reason = data.get('reason')
         doctor = data.get('doctor')
@@ -89,34 +111,225 @@ class AppointmentCreateSerializer(serializers.ModelSerializer):
         if not journey_id and not reason:
             data['reason'] = f"Consultation - {scheduled_time.strftime('%b %d, %Y')}"
         
-        # Check for slot conflicts - prevent double booking
-        # Define a 30-minute slot window (appointments within 30 min of each other conflict)
-        slot_window = timedelta(minutes=30)
-        slot_start = scheduled_time - slot_window
-        slot_end = scheduled_time + slot_window
+        problem = slot_problem(doctor, scheduled_time)
+        if problem:
+            raise serializers.ValidationError({"scheduled_time": problem})
         
-        # Check if there's an existing non-cancelled appointment in this time window
-        conflicting = Appointment.objects.filter(
-            doctor=doctor,
-            scheduled_time__gte=slot_start,
-            scheduled_time__lt=slot_end,
-            status__in=['SCHEDULED', 'IN_PROGRESS', 'COMPLETED']
-        ).exists()
+        return data
+
+
+class RescheduleSerializer(serializers.Serializer):
+    """
+    New time for an appointment. Whether the slot is free is left to the
+    slot claim in services.reschedule, which is atomic.
+    """
+    scheduled_time = serializers.DateTimeField()
+    
+    def validate_scheduled_time(self, value):
+        if value < timezone.now():
+            raise serializers.ValidationError("Cannot schedule appointment in the past")
+        return value
+
+
+class RecurrenceSerializer(serializers.Serializer):
+    """`count` appointments starting at `start`, every `interval_days` days"""
+    start = serializers.DateTimeField()
+    interval_days = serializers.IntegerField(min_value=1, default=7)
+    count = serializers.IntegerField(min_value=1, max_value=52)
+    
+    def expand(self, data):
+        return [data['start'] + timedelta(days=data['interval_days'] * i) for i in range(data['count'])]
+
+
+class BulkAppointmentCreateSerializer(serializers.Serializer):
+    """
+    Several appointments with one doctor in one journey, given either an
+    explicit list of `times` or a `recurrence` rule. Booked all-or-nothing.
+    """
+    MAX_APPOINTMENTS = 52
+    
+    doctor = serializers.PrimaryKeyRelatedField(queryset=DoctorProfile.objects.all())
+    times = serializers.ListField(
+        child=serializers.DateTimeField(), required=False, min_length=1, max_length=MAX_APPOINTMENTS
+    )
+    recurrence = RecurrenceSerializer(required=False)
+    estimated_duration = serializers.DurationField(required=False)
+    journey_id = serializers.IntegerField(required=False, allow_null=True)
+    reason = serializers.CharField(required=False, max_length=255, allow_blank=True)
+    grant_consent = serializers.BooleanField(required=False, default=False)
+    
+    def validate(self, data):
+        times = data.pop('times', None)
+        recurrence = data.pop('recurrence', None)
+        if (times is None) == (recurrence is None):
+            raise serializers.ValidationError("Provide either times or recurrence")
+        if recurrence is not None:
+            times = self.fields['recurrence'].expand(recurrence)
+        times = sorted(times)
+        
+        if times[0] < timezone.now():
+            raise serializers.ValidationError({"times": "Cannot schedule appointment in the past"})
+        
+        slot_starts = [slot_start_for(t) for t in times]
+        if len(set(slot_starts)) != len(slot_starts):
+            raise serializers.ValidationError({"times": "Two appointments fall in the same slot"})
+        
+        # All slots checked in one query against the slot inventory.
+        # The authoritative check is the slot claim when booking.
+        states = DoctorSlot.states(data['doctor'], slot_starts)
+        problems = [
+            f"{slot_start.isoformat()} is outside the doctor's working hours" if slot_start not in states
+            else f"{slot_start.isoformat()} is already booked"
+            for slot_start in slot_starts if states.get(slot_start, True)
+        ]
+        if problems:
+            raise serializers.ValidationError({"times": problems})
+        
+        data['scheduled_times'] = times
+        return data
+
+
+class WalkInTokenSerializer(serializers.Serializer):
+    """Walk-in token request from a reception desk (or the doctor)"""
+    doctor = serializers.PrimaryKeyRelatedField(queryset=DoctorProfile.objects.select_related('user', 'organization'))
+    patient_abha_id = serializers.CharField(max_length=50)
+    priority = serializers.ChoiceField(choices=PRIORITY_CHOICES, required=False)
+    estimated_duration = serializers.DurationField(required=False)
+    
+    def validate_patient_abha_id(self, value):
+        try:
+            return PatientProfile.objects.get(abha_id=value)
+        except PatientProfile.DoesNotExist:
+            raise serializers.ValidationError("No patient found with this ABHA ID")
+
+
+class PoolTicketCreateSerializer(serializers.Serializer):
+    """
+    Join an organization's pooled queue for a specialization.
+    Providers must give patient_abha_id; patients join themselves.
+    """
+    organization = serializers.PrimaryKeyRelatedField(queryset=ProviderProfile.objects.all())
+    specialization = serializers.CharField(max_length=100)
+    patient_abha_id = serializers.CharField(max_length=50, required=False)
+    
+    def validate(self, data):
+        # Store the specialization as the organization's doctors spell it
+        doctor = DoctorProfile.objects.filter(
+            organization=data['organization'], specialization__iexact=data['specialization']
+        ).first()
+        if doctor is None:
+            raise serializers.ValidationError({"specialization": "No doctors with this specialization at the organization"})
+        data['specialization'] = doctor.specialization
         
-        if conflicting:
-            raise serializers.ValidationError({
-                "scheduled_time": "This time slot is already booked. Please choose a different time."
-            })
+        abha_id = data.pop('patient_abha_id', None)
+        if abha_id:
+            try:
+                data['patient'] = PatientProfile.objects.get(abha_id=abha_id)
+            except PatientProfile.DoesNotExist:
+                raise serializers.ValidationError({"patient_abha_id": "No patient found with this ABHA ID"})
+        return data
+
+
+class CapacityPlanSerializer(serializers.Serializer):
+    """
+    Roster options to compare for a specialization. arrivals_per_hour has
+    one expected arrival rate per hour of the session.
+    """
+    MAX_PATIENTS_PER_DAY = 400
+    
+    specialization = serializers.CharField(max_length=100)
+    arrivals_per_hour = serializers.ListField(
+        child=serializers.FloatField(min_value=0), min_length=1, max_length=24
+    )
+    rosters = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=30), min_length=1, max_length=6
+    )
+    runs = serializers.IntegerField(min_value=100, max_value=5000, default=2000)
+    
+    def validate_arrivals_per_hour(self, value):
+        if not 0 < sum(value) <= self.MAX_PATIENTS_PER_DAY:
+            raise serializers.ValidationError(f"Expected arrivals per session must be above 0 and at most {self.MAX_PATIENTS_PER_DAY}")
+        return value
+    
+    def validate_rosters(self, value):
+        return sorted(set(value))
+
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    """Waitlist entry; the window defaults to the whole OPD day"""
+    doctor_name = serializers.SerializerMethodField()
+    window_start = serializers.TimeField(required=False)
+    window_end = serializers.TimeField(required=False)
+    
+    class Meta:
+        model = WaitlistEntry
+        fields = ['id', 'doctor', 'doctor_name', 'date', 'window_start', 'window_end', 'status', 'appointment', 'created_at']
+        read_only_fields = ['status', 'appointment', 'created_at']
+    
+    def get_doctor_name(self, obj):
+        return f"Dr. {obj.doctor.user.first_name} {obj.doctor.user.last_name}".strip()
+    
+    def validate(self, data):
+        from .availability import OPD_START, OPD_END
         
+        if data['date'] < timezone.localdate():
+            raise serializers.ValidationError({"date": "Cannot join a waitlist for a past date"})
+        data.setdefault('window_start', OPD_START)
+        data.setdefault('window_end', OPD_END)
+        if data['window_start'] >= data['window_end']:
+            raise serializers.ValidationError({"window_end": "Window must end after it starts"})
         return data
 
 
+class AvailabilityTemplateSerializer(serializers.ModelSerializer):
+    """One weekly working window (local time)"""
+    
+    class Meta:
+        model = AvailabilityTemplate
+        fields = ['weekday', 'start_time', 'end_time']
+    
+    def validate(self, data):
+        if data['start_time'] >= data['end_time']:
+            raise serializers.ValidationError({"end_time": "Window must end after it starts"})
+        return data
+
+
+class WeeklyAvailabilitySerializer(serializers.Serializer):
+    """A doctor's whole weekly template, replacing the previous one"""
+    windows = AvailabilityTemplateSerializer(many=True, allow_empty=False)
+    
+    def validate_windows(self, value):
+        value = sorted(value, key=lambda w: (w['weekday'], w['start_time']))
+        for previous, window in zip(value, value[1:]):
+            if window['weekday'] == previous['weekday'] and window['start_time'] < previous['end_time']:
+                raise serializers.ValidationError("Windows on the same day must not overlap")
+        return value
+
+
+class DelayNotificationSerializer(serializers.ModelSerializer):
+    doctor_name = serializers.SerializerMethodField()
+    scheduled_time = serializers.DateTimeField(source='appointment.scheduled_time', read_only=True)
+    
+    class Meta:
+        model = DelayNotification
+        fields = ['id', 'appointment', 'doctor_name', 'scheduled_time', 'delay_minutes', 'predicted_start_time', 'created_at']
+    
+    def get_doctor_name(self, obj):
+        doctor = obj.appointment.doctor
+        return f"Dr. {doctor.user.first_name} {doctor.user.last_name}".strip()
+
+
 class QueueStatusSerializer(serializers.Serializer):
     """Response serializer for queue status/wait time prediction"""
     queue_position = serializers.IntegerField()
     people_ahead = serializers.IntegerField()
     avg_consultation_minutes = serializers.FloatField()
+    consultation_p50_minutes = serializers.FloatField()
+    consultation_p90_minutes = serializers.FloatField()
     estimated_wait_minutes = serializers.FloatField()
     predicted_start_time = serializers.DateTimeField()
+    predicted_start_time_p10 = serializers.DateTimeField()
+    predicted_start_time_p90 = serializers.DateTimeField()
     delay_minutes = serializers.FloatField()
+    delay_minutes_p90 = serializers.FloatField()
     current_status = serializers.CharField()
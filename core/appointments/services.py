@@ -0,0 +1,271 @@
+"""
+Booking helpers shared by the appointment views.
+"""
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import queue_state
+from .models import Appointment, DoctorSlot, WaitlistEntry, WalkInCounter, slot_start_for
+
+
+def get_or_create_journey(patient, doctor, journey_id=None, title=None):
+    """
+    Existing journey for a follow-up (must belong to the patient),
+    otherwise a new journey owned by the doctor's organization.
+    """
+    from journeys import access
+    from journeys.models import Journey
+
+    if journey_id:
+        try:
+            return Journey.objects.get(id=journey_id, patient=patient)
+        except Journey.DoesNotExist:
+            raise ValidationError({"journey_id": "Journey not found or does not belong to you"})
+
+    journey = Journey.objects.create(
+        patient=patient,
+        title=title,
+        created_by_org=doctor.organization
+    )
+    access.journey_created(journey)
+    return journey
+
+
+def auto_grant_consent(patient, doctor, journey):
+    """Grant the doctor's organization access to the patient's data"""
+    from journeys import access
+    from journeys.models import HealthDataConsent
+
+    if not doctor.organization:
+        return None
+
+    consent, created = HealthDataConsent.objects.get_or_create(
+        patient=patient,
+        requesting_org=doctor.organization,
+        defaults={
+            'requesting_doctor': doctor,
+            'status': 'GRANTED',
+            'purpose': f"Auto-granted for journey: {journey.title}",
+            'responded_at': timezone.now()
+        }
+    )
+    # If consent already exists but was denied/revoked, update it
+    if not created and consent.status in ['DENIED', 'REVOKED']:
+        consent.status = 'GRANTED'
+        consent.purpose = f"Auto-granted for journey: {journey.title}"
+        consent.responded_at = timezone.now()
+        consent.save()
+        access.consent_changed(consent)
+    elif created:
+        access.consent_changed(consent)
+    return consent
+
+
+def book_appointments(patient, doctor, journey, scheduled_times, **appointment_fields):
+    """
+    Create one consultation step and appointment per time, in bulk, and
+    claim all their slots. Raises ValidationError (rolling back the
+    caller's transaction) if any slot is taken. Call inside
+    transaction.atomic().
+    """
+    from journeys.models import JourneyStep
+
+    scheduled_times = sorted(scheduled_times)
+    first_order = journey.steps.count() + 1
+    notes = f"Appointment with Dr. {doctor.user.first_name} {doctor.user.last_name}"
+
+    steps = JourneyStep.objects.bulk_create([
+        JourneyStep(
+            journey=journey,
+            type="CONSULTATION",
+            order=first_order + i,
+            notes=notes,
+            created_by_org=doctor.organization,
+            created_by_doctor=doctor
+        )
+        for i in range(len(scheduled_times))
+    ])
+
+    appointments = Appointment.objects.bulk_create([
+        Appointment(
+            patient=patient,
+            doctor=doctor,
+            scheduled_time=scheduled_time,
+            journey_step=step,
+            **appointment_fields
+        )
+        for scheduled_time, step in zip(scheduled_times, steps)
+    ])
+
+    if not DoctorSlot.claim_many(appointments):
+        raise ValidationError({"scheduled_time": "This slot is no longer available. Please choose another time."})
+
+    for appointment in appointments:
+        queue_state.appointment_booked(appointment)
+    return appointments
+
+
+def reschedule(appointment, scheduled_time):
+    """
+    Move a SCHEDULED appointment to another time, keeping its journey step
+    and payment: release the old slot and claim the new one. Raises
+    ValidationError (rolling back the caller's transaction) if the new
+    slot is taken or outside the doctor's hours, or the appointment is
+    no longer SCHEDULED. Call inside transaction.atomic().
+    """
+    previous_scheduled_time = appointment.scheduled_time
+    if not Appointment.objects.filter(pk=appointment.pk, status='SCHEDULED').update(scheduled_time=scheduled_time):
+        raise ValidationError({"status": "Only scheduled appointments can be rescheduled"})
+    DoctorSlot.release(appointment)
+    appointment.scheduled_time = scheduled_time
+    if not DoctorSlot.claim(appointment):
+        raise ValidationError({
+            "scheduled_time": "This time slot is booked or outside the doctor's working hours. Please choose a different time."
+        })
+    queue_state.appointment_rescheduled(appointment, previous_scheduled_time)
+    return appointment
+
+
+def fill_from_waitlist(doctor, scheduled_time):
+    """
+    Book the best-matching waitlisted patient into the slot containing
+    scheduled_time, which has just been freed. Runs in a savepoint inside
+    the cancellation transaction, so failing to fill never undoes the
+    cancellation. Returns the new appointment or None.
+    """
+    slot_start = slot_start_for(scheduled_time)
+    if slot_start <= timezone.now():
+        return None
+    try:
+        with transaction.atomic():
+            entry = WaitlistEntry.best_match(doctor.id, slot_start)
+            if entry is None:
+                return None
+            journey = get_or_create_journey(
+                entry.patient, doctor,
+                title=f"Consultation - {timezone.localtime(slot_start).strftime('%b %d, %Y')}"
+            )
+            appointment = book_appointments(entry.patient, doctor, journey, [slot_start])[0]
+            entry.status = 'BOOKED'
+            entry.appointment = appointment
+            entry.save(update_fields=['status', 'appointment'])
+    except ValidationError:
+        # Slot taken again in the meantime
+        return None
+    return appointment
+
+
+def issue_walk_in(patient, doctor, **appointment_fields):
+    """
+    Give the patient the doctor's next token for today and put them in
+    today's queue. No slot is claimed and no journey is created here;
+    the journey step is attached when the consultation starts (see
+    attach_journey_step). Call inside transaction.atomic().
+    """
+    now = timezone.now()
+    token_number = WalkInCounter.next_token(doctor.id, timezone.localdate(now))
+    appointment = Appointment.objects.create(
+        patient=patient,
+        doctor=doctor,
+        scheduled_time=now,
+        token_number=token_number,
+        **appointment_fields
+    )
+    queue_state.appointment_booked(appointment)
+    return appointment
+
+
+def attach_journey_step(appointment):
+    """
+    Create the journey and consultation step for an appointment that has
+    none yet (a walk-in or pooled patient). Call inside transaction.atomic().
+    """
+    from journeys.models import JourneyStep
+
+    if appointment.journey_step_id:
+        return appointment.journey_step
+
+    doctor = appointment.doctor
+    journey = get_or_create_journey(
+        appointment.patient, doctor,
+        title=f"Walk-in consultation - {timezone.localtime(appointment.scheduled_time).strftime('%b %d, %Y')}"
+    )
+    step = JourneyStep.objects.create(
+        journey=journey,
+        type="CONSULTATION",
+        order=1,
+        notes=f"Walk-in consultation with Dr. {doctor.user.first_name} {doctor.user.last_name}"
+              + (f" (token {appointment.token_number})" if appointment.token_number else ""),
+        created_by_org=doctor.organization,
+        created_by_doctor=doctor
+    )
+    appointment.journey_step = step
+    return step
+
+
+def cancel_day(doctor, day, actor=None):
+    """
+    Cancel all of the doctor's SCHEDULED appointments on `day` (doctor
+    leave). Paid appointments are refunded as in CancelAppointmentView
+    (95% back to the patient, debited from the doctor while their balance
+    covers it), but all refunds are written with one bulk INSERT and one
+    aggregated wallet UPDATE. Call inside transaction.atomic().
+    Returns (appointments, refunds) where refunds maps appointment id to
+    (refund, cancellation_fee).
+    """
+    from payments.models import Transaction, Wallet, cancellation_split
+    from .models import AppointmentEvent
+
+    appointments = list(
+        Appointment.objects.select_for_update()
+        .filter(doctor=doctor, scheduled_time__range=queue_state.day_bounds(day), status='SCHEDULED')
+        .select_related('patient__user')
+    )
+    if not appointments:
+        return [], {}
+    ids = [a.id for a in appointments]
+
+    Appointment.objects.filter(id__in=ids, status='SCHEDULED').update(status='CANCELLED', is_paid=False)
+    AppointmentEvent.objects.bulk_create([
+        AppointmentEvent(appointment_id=a.id, doctor_id=doctor.id, from_status='SCHEDULED', to_status='CANCELLED', actor=actor)
+        for a in appointments
+    ])
+    DoctorSlot.objects.filter(appointment_id__in=ids).update(appointment=None)
+
+    paid = [a for a in appointments if a.is_paid]
+    refunds = {}
+    if paid:
+        refund, cancellation_fee = cancellation_split(doctor.consultation_fee)
+        wallets = Wallet.for_users([a.patient.user_id for a in paid] + [doctor.user_id])
+        doctor_wallet = Wallet.objects.select_for_update().get(pk=wallets[doctor.user_id].pk)
+        doctor_balance = doctor_wallet.balance
+        entries = []
+        for appointment in paid:
+            refunds[appointment.id] = (refund, cancellation_fee)
+            entries.append(Transaction(
+                wallet=wallets[appointment.patient.user_id],
+                amount=refund,
+                type="CREDIT",
+                reason="REFUND",
+                appointment=appointment,
+                description="Refund for cancelled appointment (doctor unavailable, 5% cancellation fee deducted)"
+            ))
+            # Same rule as a single cancellation: only debit what the doctor can cover
+            if doctor_balance >= refund:
+                doctor_balance -= refund
+                entries.append(Transaction(
+                    wallet=doctor_wallet,
+                    amount=refund,
+                    type="DEBIT",
+                    reason="REFUND",
+                    appointment=appointment,
+                    description=f"Refund to {appointment.patient.user.first_name} (kept ₹{cancellation_fee} cancellation fee)"
+                ))
+        Wallet.post_batch(entries)
+
+    for appointment in appointments:
+        appointment.status = 'CANCELLED'
+        appointment.is_paid = False
+        queue_state.appointment_cancelled(appointment)
+    return appointments, refunds
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from users.models import DoctorProfile
+
+
+@receiver(post_save, sender=DoctorProfile)
+def open_slots_for_new_doctor(sender, instance, created, **kwargs):
+    """Open the default OPD slots of a new doctor without waiting for the nightly materialize_slots"""
+    if created:
+        from .availability import materialize
+        materialize([instance.id])
@@ -0,0 +1,273 @@
+"""
+Server-Sent Events for the doctor queue and patient wait time.
+
+Served directly from core/asgi.py in front of the Django ASGI handler, so an
+open stream costs one coroutine and one asyncio.Queue instead of a worker
+thread. Deltas come from queue_state via the in-process broadcaster.
+
+    GET /api/appointments/stream/queue/?token=<access>       doctor's own queue
+    GET /api/appointments/stream/<pk>/?token=<access>        patient wait time
+
+The wait-time stream only listens to its own appointment's topic: status
+changes, plus the `delay` and `position` events that queue_state sends when
+the patient's predicted delay has moved enough to be worth telling them or
+their place in the queue has changed. Each one pushes a fresh prediction.
+
+EventSource cannot set an Authorization header, so the JWT access token is
+passed as the `token` query parameter.
+"""
+import asyncio
+import json
+import re
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .events import appointment_topic, broadcaster
+
+STREAM_PREFIX = "/api/appointments/stream/"
+QUEUE_PATH = re.compile(r"^/api/appointments/stream/queue/$")
+APPOINTMENT_PATH = re.compile(r"^/api/appointments/stream/(?P<pk>\d+)/$")
+
+# Comment line sent on idle streams so proxies don't cut the connection
+KEEPALIVE_SECONDS = 15
+# Client reconnect delay hint (ms)
+RETRY_MS = 3000
+
+
+def _format_event(event, data):
+    payload = json.dumps(data, cls=DjangoJSONEncoder)
+    return f"event: {event}\ndata: {payload}\n\n".encode()
+
+
+def _authenticate(token):
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+
+    if not token:
+        return None
+    auth = JWTAuthentication()
+    try:
+        return auth.get_user(auth.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def _doctor_for(user):
+    if not user.is_doctor:
+        return None
+    return user.doctor_profile.id
+
+
+def _appointment_for(user, pk):
+    from .models import Appointment
+
+    appointment = Appointment.objects.filter(pk=pk).select_related('patient').first()
+    if appointment is None:
+        return None, 404
+    if user.is_patient and appointment.patient.user_id != user.id:
+        return None, 403
+    if user.is_doctor and appointment.doctor_id != user.doctor_profile.id:
+        return None, 403
+    return appointment, 200
+
+
+def _wait_time(appointment_id, doctor_id, scheduled_time, status):
+    from . import queue_state
+
+    if status == 'IN_PROGRESS':
+        return {
+            "queue_position": 0,
+            "people_ahead": 0,
+            "current_status": "in_progress",
+            "message": "Your consultation is in progress"
+        }
+    if status in ['COMPLETED', 'CANCELLED']:
+        return {"current_status": status.lower()}
+    queue = queue_state.get_queue(doctor_id, queue_state.queue_day(scheduled_time))
+    return queue.wait_time(appointment_id, scheduled_time)
+
+
+class QueueStreamApp:
+    """ASGI app that serves the SSE routes and hands everything else to Django"""
+
+    def __init__(self, django_app):
+        self.django_app = django_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(STREAM_PREFIX):
+            return await self.handle(scope, receive, send)
+        return await self.django_app(scope, receive, send)
+
+    async def handle(self, scope, receive, send):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        token = query.get("token", [None])[0]
+        headers = self._cors_headers(scope)
+
+        if scope["method"] == "OPTIONS":
+            return await self._respond(send, 204, None, headers)
+        if scope["method"] != "GET":
+            return await self._respond(send, 405, {"error": "Method not allowed"}, headers)
+
+        user = await sync_to_async(_authenticate)(token)
+        if user is None:
+            return await self._respond(send, 401, {"error": "Invalid or missing token"}, headers)
+
+        path = scope["path"]
+        if QUEUE_PATH.match(path):
+            doctor_id = await sync_to_async(_doctor_for)(user)
+            if doctor_id is None:
+                return await self._respond(send, 403, {"error": "Only doctors can stream their queue"}, headers)
+            return await self._stream_queue(receive, send, headers, doctor_id)
+
+        match = APPOINTMENT_PATH.match(path)
+        if match:
+            appointment, code = await sync_to_async(_appointment_for)(user, int(match["pk"]))
+            if appointment is None:
+                error = "Appointment not found" if code == 404 else "Not your appointment"
+                return await self._respond(send, code, {"error": error}, headers)
+            return await self._stream_wait_time(receive, send, headers, appointment)
+
+        return await self._respond(send, 404, {"error": "Not found"}, headers)
+
+    # ---- streams ----
+
+    async def _stream_queue(self, receive, send, headers, doctor_id):
+        async def on_event(event):
+            await send_event(event["type"], event)
+            return True
+
+        async with self._sse(receive, send, headers, doctor_id, {"doctor_id": doctor_id}) as (send_event, run):
+            await send_event("ready", {"doctor_id": doctor_id})
+            await run(on_event)
+
+    async def _stream_wait_time(self, receive, send, headers, appointment):
+        appointment_id = appointment.id
+        doctor_id = appointment.doctor_id
+        state = {"status": appointment.status, "scheduled_time": appointment.scheduled_time}
+
+        async def push():
+            data = await sync_to_async(_wait_time)(appointment_id, doctor_id, state["scheduled_time"], state["status"])
+            await send_event("wait_time", data)
+
+        async def on_event(event):
+            if event["type"] == "rescheduled":
+                state["scheduled_time"] = datetime.fromisoformat(event["scheduled_time"])
+            state["status"] = {
+                "started": "IN_PROGRESS",
+                "completed": "COMPLETED",
+                "cancelled": "CANCELLED",
+            }.get(event["type"], state["status"])
+            await push()
+            # Nothing more to report once the consultation is over
+            return state["status"] not in ["COMPLETED", "CANCELLED"]
+
+        topic = appointment_topic(appointment_id)
+        async with self._sse(receive, send, headers, topic, {"appointment_id": appointment_id}) as (send_event, run):
+            await push()
+            if state["status"] in ["COMPLETED", "CANCELLED"]:
+                return
+            await run(on_event)
+
+    def _sse(self, receive, send, headers, topic, resync_data):
+        return _SSEStream(receive, send, headers, topic, resync_data)
+
+    # ---- plain responses ----
+
+    def _cors_headers(self, scope):
+        origin = dict(scope.get("headers", [])).get(b"origin", b"").decode()
+        if origin and origin in getattr(settings, "CORS_ALLOWED_ORIGINS", []):
+            return [
+                (b"access-control-allow-origin", origin.encode()),
+                (b"access-control-allow-credentials", b"true"),
+                (b"vary", b"Origin"),
+            ]
+        return []
+
+    async def _respond(self, send, status, data, headers):
+        body = json.dumps(data).encode() if data is not None else b""
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers + [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class _SSEStream:
+    """
+    Async context manager owning one subscription: sends the response
+    headers, forwards broadcaster events to `on_event`, emits keepalives and
+    stops when the client disconnects.
+    """
+
+    def __init__(self, receive, send, headers, topic, resync_data):
+        self.receive = receive
+        self.send = send
+        self.headers = headers
+        self.topic = topic
+        self.resync_data = resync_data
+
+    async def __aenter__(self):
+        self.subscription = broadcaster.subscribe(self.topic)
+        await self.send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": self.headers + [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        await self._write(f"retry: {RETRY_MS}\n\n".encode())
+        return self.send_event, self.run
+
+    async def __aexit__(self, exc_type, exc, tb):
+        broadcaster.unsubscribe(self.subscription)
+        try:
+            await self.send({"type": "http.response.body", "body": b"", "more_body": False})
+        except Exception:
+            # Client is already gone
+            pass
+        return False
+
+    async def _write(self, chunk):
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    async def send_event(self, event, data):
+        await self._write(_format_event(event, data))
+
+    async def _wait_disconnect(self):
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def run(self, on_event):
+        disconnect = asyncio.ensure_future(self._wait_disconnect())
+        next_event = asyncio.ensure_future(self.subscription.queue.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {disconnect, next_event},
+                    timeout=KEEPALIVE_SECONDS,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnect in done:
+                    return
+                if not done:
+                    await self._write(b": keepalive\n\n")
+                    continue
+                if self.subscription.lagging:
+                    # Dropped events; tell the client to refetch
+                    self.subscription.lagging = False
+                    await self.send_event("resync", self.resync_data)
+                if not await on_event(next_event.result()):
+                    return
+                next_event = asyncio.ensure_future(self.subscription.queue.get())
+        finally:
+            disconnect.cancel()
+            next_event.cancel()
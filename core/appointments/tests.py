@@ -1,3 +1,453 @@
-from django.test import TestCase
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from journeys.models import Journey
+from payments.models import Transaction, Wallet
+from users.models import User, DoctorProfile, PatientProfile, ProviderProfile
+from . import queue_state, recommend, services
+from .models import (
+    Appointment, AppointmentEvent, DoctorDurationStats, DoctorSlot, DoctorWeekStats, PoolTicket, DURATION_BUCKETS
+)
+
+
+class DurationQuantileTests(SimpleTestCase):
+    """Quantiles interpolate within the histogram bucket they fall in"""
+
+    def stats(self, weights):
+        sketch = [0.0] * (len(DURATION_BUCKETS) + 1)
+        for index, weight in weights.items():
+            sketch[index] = weight
+        return DoctorDurationStats(count=sum(weights.values()), sketch=sketch)
+
+    def test_regular_bucket(self):
+        # All weight in the 10-15 minute bucket
+        stats = self.stats({2: 4.0})
+        self.assertAlmostEqual(stats.quantile(0.5), 12.5 * 60)
+        self.assertAlmostEqual(stats.quantile(1.0), 15 * 60)
+
+    def test_overflow_bucket_extends_by_last_bucket_width(self):
+        # Half the weight past the last edge (180 min); that bucket spans 180-240
+        stats = self.stats({2: 2.0, len(DURATION_BUCKETS): 2.0})
+        self.assertAlmostEqual(stats.quantile(0.75), 210 * 60)
+        self.assertAlmostEqual(stats.quantile(1.0), 240 * 60)
+
+
+class CapacityPlanTests(TestCase):
+    """Roster simulation copes with sessions where nobody turns up"""
+
+    def test_no_arrivals_gives_empty_bands(self):
+        from .capacity import simulate
+
+        for option in simulate([0.0], [1, 2], [900.0], runs=100, seed=0):
+            self.assertIsNone(option["wait_minutes"]["mean"])
+            self.assertIsNone(option["wait_minutes"]["p90"])
+            self.assertEqual(option["waited_longer_than"]["15m"], 0.0)
+
+    def test_sparse_arrivals_endpoint(self):
+        provider = ProviderProfile.objects.create(
+            user=User.objects.create_user("hospital@example.com", "pw", type="PROVIDER"),
+            type="HOSPITAL", name="Hospital", address="Street", hfr_id="hfr-1"
+        )
+        client = APIClient()
+        client.force_authenticate(provider.user)
+        response = client.post("/api/appointments/capacity-plan/", {
+            "specialization": "Cardiology", "arrivals_per_hour": [0.001], "rosters": [1, 2], "runs": 100
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([option["doctors"] for option in response.json()["options"]], [1, 2])
+
+
+class OrganizationQueueBoardTests(TestCase):
+    """The board takes a fixed number of queries and honors priority dispatch"""
+
+    def setUp(self):
+        cache.clear()
+        queue_state.clear_queues()
+        self.provider = ProviderProfile.objects.create(
+            user=User.objects.create_user("hospital@example.com", "pw", type="PROVIDER"),
+            type="HOSPITAL", name="Hospital", address="Street", hfr_id="hfr-1"
+        )
+        self.patient = PatientProfile.objects.create(
+            user=User.objects.create_user("patient@example.com", "pw", type="PATIENT"), abha_id="91-0001"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.provider.user)
+
+    def add_doctor(self, index):
+        doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user(f"doctor{index}@example.com", "pw", type="DOCTOR", first_name=f"D{index:02d}"),
+            specialization="Cardiology", hpr_id=f"hpr-{index}", organization=self.provider
+        )
+        now = timezone.now()
+        Appointment.objects.create(patient=self.patient, doctor=doctor, scheduled_time=now - timedelta(minutes=20))
+        emergency = Appointment.objects.create(
+            patient=self.patient, doctor=doctor, scheduled_time=now - timedelta(minutes=5), priority="EMERGENCY"
+        )
+        return emergency
+
+    def board(self):
+        cache.clear()
+        return self.client.get("/api/appointments/queue/organization/")
+
+    def test_constant_queries_and_priority_next(self):
+        self.add_doctor(0)
+        with CaptureQueriesContext(connection) as one_doctor:
+            self.board()
+        emergencies = [self.add_doctor(index) for index in range(1, 6)]
+        with self.assertNumQueries(len(one_doctor)):
+            response = self.board()
+        self.assertEqual(response.status_code, 200)
+        board = response.json()["doctors"]
+        self.assertEqual(len(board), 6)
+        self.assertEqual(board[5]["next"]["appointment_id"], emergencies[-1].id)
+        self.assertEqual(board[5]["waiting_count"], 2)
+        self.assertEqual(queue_state._queues, {})
+
+
+class RecommendationRegistryTests(TestCase):
+    """Only specializations with doctors get a cached load table"""
+
+    def setUp(self):
+        recommend.clear_tables()
+        self.addCleanup(recommend.clear_tables)
+        for index, specialization in enumerate(["Cardiology", "Dermatology"]):
+            DoctorProfile.objects.create(
+                user=User.objects.create_user(f"doctor{index}@example.com", "pw", type="DOCTOR"),
+                specialization=specialization, hpr_id=f"hpr-{index}"
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("patient@example.com", "pw", type="PATIENT"))
+
+    def test_unknown_specializations_are_not_registered(self):
+        for index in range(20):
+            response = self.client.get(f"/api/appointments/recommend/?specialization=junk-{index}")
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(recommend._tables, {})
+        self.assertEqual(self.client.get("/api/appointments/recommend/?specialization=cardiology").status_code, 200)
+        self.assertEqual(list(recommend._tables), ["cardiology"])
+
+    def test_expired_tables_are_evicted(self):
+        recommend.get_table("Cardiology")
+        recommend._tables["cardiology"].day -= timedelta(days=1)
+        recommend.get_table("Dermatology")
+        self.assertEqual(list(recommend._tables), ["dermatology"])
+
+
+class PooledDispatchTests(TestCase):
+    """Pool routing counts each doctor's own due patients and drives take_next"""
+
+    def setUp(self):
+        queue_state.clear_queues()
+        self.addCleanup(queue_state.clear_queues)
+        self.provider = ProviderProfile.objects.create(
+            user=User.objects.create_user("hospital@example.com", "pw", type="PROVIDER"),
+            type="HOSPITAL", name="Hospital", address="Street", hfr_id="hfr-1"
+        )
+        self.busy, self.idle = [
+            DoctorProfile.objects.create(
+                user=User.objects.create_user(f"doctor{index}@example.com", "pw", type="DOCTOR"),
+                specialization="Cardiology", hpr_id=f"hpr-{index}", organization=self.provider
+            )
+            for index in range(2)
+        ]
+        self.patient = PatientProfile.objects.create(
+            user=User.objects.create_user("patient@example.com", "pw", type="PATIENT"), abha_id="91-0001"
+        )
+        # Two walk-ins already due for the first doctor
+        for minutes in (2, 1):
+            Appointment.objects.create(
+                patient=self.patient, doctor=self.busy, scheduled_time=timezone.now() - timedelta(minutes=minutes)
+            )
+        self.ticket = PoolTicket.objects.create(organization=self.provider, specialization="Cardiology", patient=self.patient)
+
+    def client_for(self, doctor):
+        client = APIClient()
+        client.force_authenticate(doctor.user)
+        return client
+
+    def test_backlog_counts_towards_free_at(self):
+        from .pooling import doctor_free_at, predict
+
+        now = timezone.now()
+        self.assertAlmostEqual(doctor_free_at(self.busy.id, now), 2 * queue_state.DEFAULT_DURATION.total_seconds(), delta=5)
+        [alone] = predict([self.busy.id], [self.ticket], now)
+        self.assertGreaterEqual(alone["estimated_wait_minutes"], 29)
+        [pooled] = predict([self.busy.id, self.idle.id], [self.ticket], now)
+        self.assertEqual(pooled["expected_doctor_id"], self.idle.id)
+        self.assertEqual(pooled["estimated_wait_minutes"], 0)
+
+    def test_take_next_follows_routing(self):
+        response = self.client_for(self.busy).post("/api/appointments/queue/pool/next/")
+        self.assertEqual(response.status_code, 404)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.status, "WAITING")
+
+        response = self.client_for(self.idle).post("/api/appointments/queue/pool/next/")
+        self.assertEqual(response.status_code, 201)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.status, "ASSIGNED")
+        self.assertEqual(self.ticket.appointment.doctor_id, self.idle.id)
+
+    def test_refuses_second_consultation(self):
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.idle, scheduled_time=timezone.now(),
+            status="IN_PROGRESS", actual_start_time=timezone.now()
+        )
+        response = self.client_for(self.idle).post("/api/appointments/queue/pool/next/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Appointment.objects.filter(doctor=self.idle, status="IN_PROGRESS").count(), 1)
+
+
+class CancelDayTests(TestCase):
+    """A doctor's day off cancels, refunds and debits in bulk"""
+
+    def setUp(self):
+        queue_state.clear_queues()
+        self.addCleanup(queue_state.clear_queues)
+        self.doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user("doctor@example.com", "pw", type="DOCTOR", first_name="Asha"),
+            specialization="Cardiology", hpr_id="hpr-1", consultation_fee=Decimal("500.00")
+        )
+        # Covers two refunds of 475.00, not three
+        Wallet.objects.filter(user=self.doctor.user).update(balance=Decimal("1000.00"))
+        self.ravi, self.mina = [
+            PatientProfile.objects.create(
+                user=User.objects.create_user(f"{name}@example.com", "pw", type="PATIENT", first_name=name),
+                abha_id=f"91-{name}"
+            )
+            for name in ("ravi", "mina")
+        ]
+        self.day = timezone.localdate() + timedelta(days=1)
+        opening = timezone.make_aware(datetime.combine(self.day, time(10)))
+        self.appointments = [
+            Appointment.objects.create(
+                patient=patient, doctor=self.doctor, scheduled_time=opening + timedelta(minutes=30 * i), is_paid=paid
+            )
+            for i, (patient, paid) in enumerate([(self.ravi, True), (self.ravi, True), (self.mina, True), (self.mina, False)])
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+
+    def cancel(self, day):
+        return self.client.post("/api/appointments/doctor/cancel-day/", {"date": day}, format="json")
+
+    def test_refunds_and_doctor_cover(self):
+        response = self.cancel(self.day.isoformat())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["cancelled_count"], 4)
+        self.assertEqual(response.json()["refunded_count"], 3)
+        self.assertEqual(response.json()["total_refunded"], "1425.00")
+
+        balance = lambda user: Wallet.objects.get(user=user).balance
+        self.assertEqual(balance(self.ravi.user), Decimal("950.00"))
+        self.assertEqual(balance(self.mina.user), Decimal("475.00"))
+        self.assertEqual(balance(self.doctor.user), Decimal("50.00"))
+
+        refunds = Transaction.objects.filter(reason="REFUND")
+        self.assertEqual(refunds.filter(type="CREDIT").count(), 3)
+        # The third refund is more than the doctor has left, so it is not debited
+        self.assertEqual(refunds.filter(type="DEBIT", wallet__user=self.doctor.user).count(), 2)
+        self.assertEqual(set(Appointment.objects.values_list("status", flat=True)), {"CANCELLED"})
+        self.assertFalse(Appointment.objects.filter(is_paid=True).exists())
+        self.assertEqual(AppointmentEvent.objects.filter(to_status="CANCELLED").count(), 4)
+
+    def test_invalid_date(self):
+        for day in ("2026-13-01", "tomorrow", ""):
+            self.assertEqual(self.cancel(day).status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+
+
+class SlotClaimTests(TestCase):
+    """A slot holds one appointment; cancelling or rescheduling frees it"""
+
+    def setUp(self):
+        queue_state.clear_queues()
+        self.addCleanup(queue_state.clear_queues)
+        self.doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user("doctor@example.com", "pw", type="DOCTOR"),
+            specialization="Cardiology", hpr_id="hpr-1"
+        )
+        self.ravi, self.mina = [
+            PatientProfile.objects.create(
+                user=User.objects.create_user(f"{name}@example.com", "pw", type="PATIENT"), abha_id=f"91-{name}"
+            )
+            for name in ("ravi", "mina")
+        ]
+        day = timezone.localdate() + timedelta(days=1)
+        self.ten, self.eleven = [timezone.make_aware(datetime.combine(day, time(hour))) for hour in (10, 11)]
+
+    def client_for(self, patient):
+        client = APIClient()
+        client.force_authenticate(patient.user)
+        return client
+
+    def book(self, patient, scheduled_time):
+        return self.client_for(patient).post("/api/appointments/", {
+            "doctor": self.doctor.id, "scheduled_time": scheduled_time.isoformat(), "reason": "Checkup"
+        }, format="json")
+
+    def holder(self, scheduled_time):
+        return DoctorSlot.objects.get(doctor=self.doctor, slot_start=scheduled_time).appointment_id
+
+    def test_second_booking_rejected(self):
+        first = self.book(self.ravi, self.ten)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(self.book(self.mina, self.ten).status_code, 400)
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(self.holder(self.ten), Appointment.objects.get().id)
+
+    def test_claim_rejects_booking_past_the_early_check(self):
+        self.assertEqual(self.book(self.ravi, self.ten).status_code, 201)
+        journey = Journey.objects.create(patient=self.mina, title="Checkup")
+        with self.assertRaises(ValidationError):
+            with transaction.atomic():
+                services.book_appointments(self.mina, self.doctor, journey, [self.ten])
+        self.assertEqual(Appointment.objects.filter(patient=self.mina).count(), 0)
+
+    def test_cancel_frees_slot(self):
+        self.book(self.ravi, self.ten)
+        appointment = Appointment.objects.get()
+        response = self.client_for(self.ravi).post(f"/api/appointments/{appointment.id}/cancel/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.holder(self.ten))
+        self.assertEqual(self.book(self.mina, self.ten).status_code, 201)
+
+    def test_reschedule_frees_old_slot(self):
+        self.book(self.ravi, self.ten)
+        appointment = Appointment.objects.get()
+        response = self.client_for(self.ravi).post(
+            f"/api/appointments/{appointment.id}/reschedule/", {"scheduled_time": self.eleven.isoformat()}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.holder(self.eleven), appointment.id)
+        self.assertIsNone(self.holder(self.ten))
+        self.assertEqual(self.book(self.mina, self.ten).status_code, 201)
+
+    def test_reschedule_rejected_by_claim(self):
+        self.book(self.ravi, self.ten)
+        self.book(self.mina, self.eleven)
+        appointment = Appointment.objects.get(patient=self.ravi)
+        client = self.client_for(self.ravi)
+        evening = self.ten.replace(hour=20)
+        for scheduled_time in (self.eleven, evening):
+            response = client.post(
+                f"/api/appointments/{appointment.id}/reschedule/",
+                {"scheduled_time": scheduled_time.isoformat()}, format="json"
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("scheduled_time", response.json())
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.scheduled_time, self.ten)
+        self.assertEqual(self.holder(self.ten), appointment.id)
+        # Moving within the same slot keeps the claim
+        response = client.post(
+            f"/api/appointments/{appointment.id}/reschedule/",
+            {"scheduled_time": (self.ten + timedelta(minutes=15)).isoformat()}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.holder(self.ten), appointment.id)
+
+
+class TransitionTests(TestCase):
+    """Status changes are conditional on the loaded status and logged as events"""
+
+    def setUp(self):
+        queue_state.clear_queues()
+        self.addCleanup(queue_state.clear_queues)
+        self.doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user("doctor@example.com", "pw", type="DOCTOR"),
+            specialization="Cardiology", hpr_id="hpr-1"
+        )
+        patient = PatientProfile.objects.create(
+            user=User.objects.create_user("patient@example.com", "pw", type="PATIENT"), abha_id="91-0001"
+        )
+        self.appointment = Appointment.objects.create(patient=patient, doctor=self.doctor, scheduled_time=timezone.now())
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+
+    def test_events_written(self):
+        self.assertEqual(self.client.post(f"/api/appointments/{self.appointment.id}/start/").status_code, 200)
+        self.assertEqual(self.client.post(f"/api/appointments/{self.appointment.id}/complete/").status_code, 200)
+        events = AppointmentEvent.objects.filter(appointment=self.appointment).order_by("id")
+        self.assertEqual(
+            [(event.from_status, event.to_status, event.actor_id) for event in events],
+            [("SCHEDULED", "IN_PROGRESS", self.doctor.user.id), ("IN_PROGRESS", "COMPLETED", self.doctor.user.id)]
+        )
+
+    def test_stale_instance_changes_nothing(self):
+        stale = Appointment.objects.get(pk=self.appointment.pk)
+        self.assertTrue(self.appointment.transition("CANCELLED", ["SCHEDULED"]))
+        self.assertFalse(stale.transition("IN_PROGRESS", ["SCHEDULED"], actual_start_time=timezone.now()))
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, "CANCELLED")
+        self.assertIsNone(stale.actual_start_time)
+        self.assertEqual(AppointmentEvent.objects.filter(appointment=self.appointment).count(), 1)
+
+    def test_lost_race_is_conflict(self):
+        # Another request cancels between the view loading the appointment and starting it
+        transition = Appointment.transition
+
+        def cancelled_first(appointment, *args, **kwargs):
+            Appointment.objects.filter(pk=appointment.pk).update(status="CANCELLED")
+            return transition(appointment, *args, **kwargs)
+
+        with mock.patch.object(Appointment, "transition", cancelled_first):
+            response = self.client.post(f"/api/appointments/{self.appointment.id}/start/")
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("CANCELLED", response.json()["error"])
+        self.assertFalse(AppointmentEvent.objects.exists())
+
+
+class UtilizationSnapshotTests(TestCase):
+    """Analytics reads never store weeks; snapshot_analytics does, and reads use them"""
+
+    def setUp(self):
+        cache.clear()
+        provider = ProviderProfile.objects.create(
+            user=User.objects.create_user("hospital@example.com", "pw", type="PROVIDER"),
+            type="HOSPITAL", name="Hospital", address="Street", hfr_id="hfr-1"
+        )
+        doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user("doctor@example.com", "pw", type="DOCTOR"),
+            specialization="Cardiology", hpr_id="hpr-1", organization=provider
+        )
+        patient = PatientProfile.objects.create(
+            user=User.objects.create_user("patient@example.com", "pw", type="PATIENT"), abha_id="91-0001"
+        )
+        self.last_week = timezone.localdate() - timedelta(weeks=1)
+        start = timezone.make_aware(datetime.combine(self.last_week, time(10)))
+        Appointment.objects.create(
+            patient=patient, doctor=doctor, scheduled_time=start, status="COMPLETED",
+            actual_start_time=start, actual_end_time=start + timedelta(minutes=20)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(provider.user)
+
+    def completed_last_week(self):
+        cache.clear()
+        day = self.last_week.isoformat()
+        response = self.client.get(f"/api/appointments/analytics/utilization/?from={day}&to={day}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["overall"]["completed"]
+
+    def test_reads_do_not_store(self):
+        self.assertEqual(self.completed_last_week(), 1)
+        self.assertFalse(DoctorWeekStats.objects.exists())
+
+    def test_snapshot_is_read_back(self):
+        call_command("snapshot_analytics", stdout=StringIO())
+        self.assertEqual(DoctorWeekStats.objects.count(), 2)
+        # Served from the stored week, not recomputed from appointments
+        Appointment.objects.all().delete()
+        self.assertEqual(self.completed_last_week(), 1)
@@ -1,21 +1,49 @@
 from django.urls import path
 from .views import (
-    AppointmentListCreateView, AppointmentDetailView,
-    StartAppointmentView, CompleteAppointmentView, CancelAppointmentView,
-    DoctorQueueView, WaitTimeView
+    AppointmentListCreateView, BulkAppointmentCreateView, WalkInTokenView, AppointmentDetailView,
+    StartAppointmentView, CompleteAppointmentView, CancelAppointmentView, RescheduleAppointmentView, CancelDayView, AppointmentPriorityView,
+    DoctorQueueView, WaitTimeView, DoctorWaitTimesView, DelayNotificationListView, PooledQueueView, OrganizationQueueView,
+    AvailabilityView, AvailabilityTemplateView, DoctorRecommendationView, CalendarFeedView, CalendarFeedICSView, WaitlistListCreateView, WaitlistLeaveView, UtilizationAnalyticsView, CapacityPlanView
 )
 
 urlpatterns = [
     # Appointment CRUD
     path('', AppointmentListCreateView.as_view(), name='appointment_list_create'),
+    path('bulk/', BulkAppointmentCreateView.as_view(), name='appointment_bulk_create'),
+    path('walk-in/', WalkInTokenView.as_view(), name='appointment_walk_in'),
     path('<int:pk>/', AppointmentDetailView.as_view(), name='appointment_detail'),
     
     # Actions
     path('<int:pk>/start/', StartAppointmentView.as_view(), name='appointment_start'),
     path('<int:pk>/complete/', CompleteAppointmentView.as_view(), name='appointment_complete'),
     path('<int:pk>/cancel/', CancelAppointmentView.as_view(), name='appointment_cancel'),
+    path('<int:pk>/reschedule/', RescheduleAppointmentView.as_view(), name='appointment_reschedule'),
+    path('<int:pk>/priority/', AppointmentPriorityView.as_view(), name='appointment_priority'),
+    path('doctor/cancel-day/', CancelDayView.as_view(), name='doctor_cancel_day'),
+    
+    # Free-slot search
+    path('availability/', AvailabilityView.as_view(), name='availability'),
+    path('availability/template/', AvailabilityTemplateView.as_view(), name='availability_template'),
+    path('recommend/', DoctorRecommendationView.as_view(), name='doctor_recommendation'),
+    
+    # Calendar feed
+    path('calendar/', CalendarFeedView.as_view(), name='calendar_feed'),
+    path('calendar/<str:token>.ics', CalendarFeedICSView.as_view(), name='calendar_feed_ics'),
+    
+    # Waitlist
+    path('waitlist/', WaitlistListCreateView.as_view(), name='waitlist'),
+    path('waitlist/<int:pk>/leave/', WaitlistLeaveView.as_view(), name='waitlist_leave'),
     
     # Queue and Wait Time
+    path('queue/pool/', PooledQueueView.as_view(), name='pooled_queue'),
+    path('queue/pool/next/', StartAppointmentView.as_view(), name='pooled_queue_next'),
+    path('queue/organization/', OrganizationQueueView.as_view(), name='organization_queue'),
     path('queue/doctor/<int:doctor_id>/', DoctorQueueView.as_view(), name='doctor_queue'),
+    path('queue/doctor/<int:doctor_id>/wait-times/', DoctorWaitTimesView.as_view(), name='doctor_wait_times'),
     path('<int:pk>/wait-time/', WaitTimeView.as_view(), name='appointment_wait_time'),
+    path('notifications/', DelayNotificationListView.as_view(), name='delay_notifications'),
+    
+    # Analytics
+    path('analytics/utilization/', UtilizationAnalyticsView.as_view(), name='utilization_analytics'),
+    path('capacity-plan/', CapacityPlanView.as_view(), name='capacity_plan'),
 ]
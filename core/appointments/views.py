@@ -4,12 +4,18 @@ from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.db.models import Avg, F
+from collections import defaultdict
 from datetime import timedelta
+from decimal import Decimal
 
-from .models import Appointment
+from .models import Appointment, AvailabilityTemplate, CalendarFeedToken, DelayNotification, DoctorSlot, DoctorDurationStats, PoolTicket, WaitlistEntry
 from .serializers import (
-    AppointmentSerializer, AppointmentCreateSerializer, QueueStatusSerializer
+    AppointmentSerializer, AppointmentCreateSerializer, BulkAppointmentCreateSerializer,
+    RescheduleSerializer, WalkInTokenSerializer, PoolTicketCreateSerializer, DelayNotificationSerializer,
+    WaitlistEntrySerializer, CapacityPlanSerializer, QueueStatusSerializer,
+    AvailabilityTemplateSerializer, WeeklyAvailabilitySerializer
 )
+from . import queue_state, services
 
 
 class AppointmentListCreateView(generics.ListCreateAPIView):
@@ -42,90 +48,132 @@ class AppointmentListCreateView(generics.ListCreateAPIView):
         - If no journey_id: Create new journey + first step
         - If grant_consent: Auto-grant consent to doctor's org
         
-        Uses atomic transaction to prevent race conditions in concurrent booking.
+        The slot is claimed in the same transaction; the unique
+        (doctor, slot_start) constraint on DoctorSlot rejects a concurrent
+        booking of the same slot and rolls everything back.
         """
-        from rest_framework.exceptions import PermissionDenied, ValidationError
-        from journeys.models import Journey, JourneyStep, HealthDataConsent
-        from django.utils import timezone as tz
+        from rest_framework.exceptions import PermissionDenied
         from django.db import transaction
         
         if not self.request.user.is_patient:
             raise PermissionDenied("Only patients can create appointments")
         
-        # Wrap in transaction to prevent race conditions
         with transaction.atomic():
             patient = self.request.user.patient_profile
-            doctor = serializer.validated_data['doctor']
+            doctor = serializer.validated_data.pop('doctor')
+            scheduled_time = serializer.validated_data.pop('scheduled_time')
             journey_id = serializer.validated_data.pop('journey_id', None)
             reason = serializer.validated_data.pop('reason', None)
             grant_consent = serializer.validated_data.pop('grant_consent', False)
             
-            # Double-check slot availability inside transaction (re-validate)
-            from datetime import timedelta
-            scheduled_time = serializer.validated_data['scheduled_time']
-            slot_window = timedelta(minutes=30)
-            
-            conflicting = Appointment.objects.select_for_update().filter(
-                doctor=doctor,
-                scheduled_time__gte=scheduled_time - slot_window,
-                scheduled_time__lt=scheduled_time + slot_window,
-                status__in=['SCHEDULED', 'IN_PROGRESS', 'COMPLETED']
-            ).exists()
-            
-            if conflicting:
-                raise ValidationError({"scheduled_time": "This slot was just booked. Please choose another time."})
-            
-            # Get or create journey
-            if journey_id:
-                # Follow-up: Add to existing journey
-                try:
-                    journey = Journey.objects.get(id=journey_id, patient=patient)
-                except Journey.DoesNotExist:
-                    raise ValidationError({"journey_id": "Journey not found or does not belong to you"})
-            else:
-                # New: Create journey
-                journey = Journey.objects.create(
-                    patient=patient,
-                    title=reason or f"Consultation - {serializer.validated_data['scheduled_time'].strftime('%b %d, %Y')}",
-                    created_by_org=doctor.organization
-                )
+            # Follow-up: add to existing journey, otherwise create one
+            journey = services.get_or_create_journey(
+                patient, doctor, journey_id,
+                title=reason or f"Consultation - {scheduled_time.strftime('%b %d, %Y')}"
+            )
             
             # Handle auto-consent if requested
-            if grant_consent and doctor.organization:
-                consent, created = HealthDataConsent.objects.get_or_create(
-                    patient=patient,
-                    requesting_org=doctor.organization,
-                    defaults={
-                        'requesting_doctor': doctor,
-                        'status': 'GRANTED',
-                        'purpose': f"Auto-granted for journey: {journey.title}",
-                        'responded_at': tz.now()
-                    }
-                )
-                # If consent already exists but was denied/revoked, update it
-                if not created and consent.status in ['DENIED', 'REVOKED']:
-                    consent.status = 'GRANTED'
-                    consent.purpose = f"Auto-granted for journey: {journey.title}"
-                    consent.responded_at = tz.now()
-                    consent.save()
+            if grant_consent:
+                services.auto_grant_consent(patient, doctor, journey)
             
-            # Create consultation step
-            step_order = journey.steps.count() + 1
-            step = JourneyStep.objects.create(
-                journey=journey,
-                type="CONSULTATION",
-                order=step_order,
-                notes=f"Appointment with Dr. {doctor.user.first_name} {doctor.user.last_name}",
-                created_by_org=doctor.organization,
-                created_by_doctor=doctor
+            # Create consultation step and appointment, and claim the slot
+            appointments = services.book_appointments(
+                patient, doctor, journey, [scheduled_time], **serializer.validated_data
             )
-            
-            # Save appointment with step linked
-            serializer.save(patient=patient, journey_step=step)
+            serializer.instance = appointments[0]
+
+
+class BulkAppointmentCreateView(views.APIView):
+    """
+    Book a series of appointments with one doctor in a single journey.
+    Body: doctor, and either times (list) or recurrence
+    {start, interval_days, count}; optional journey_id, reason,
+    grant_consent, estimated_duration.
+    All slots are validated in one query and the steps, appointments and
+    slot claims are bulk-inserted in one transaction: either every
+    appointment is booked or none is.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        from django.db import transaction
+        
+        if not request.user.is_patient:
+            return Response({"error": "Only patients can create appointments"}, status=status.HTTP_403_FORBIDDEN)
+        
+        serializer = BulkAppointmentCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        patient = request.user.patient_profile
+        doctor = data.pop('doctor')
+        scheduled_times = data.pop('scheduled_times')
+        journey_id = data.pop('journey_id', None)
+        reason = data.pop('reason', None)
+        grant_consent = data.pop('grant_consent', False)
+        
+        with transaction.atomic():
+            journey = services.get_or_create_journey(
+                patient, doctor, journey_id,
+                title=reason or f"Consultations from {scheduled_times[0].strftime('%b %d, %Y')}"
+            )
+            if grant_consent:
+                services.auto_grant_consent(patient, doctor, journey)
+            appointments = services.book_appointments(patient, doctor, journey, scheduled_times, **data)
+        
+        return Response({
+            "journey_id": journey.id,
+            "count": len(appointments),
+            "appointments": AppointmentSerializer(appointments, many=True).data
+        }, status=status.HTTP_201_CREATED)
+
+
+class WalkInTokenView(views.APIView):
+    """
+    Issue the next walk-in token for a doctor today.
+    Body: doctor, patient_abha_id, optional priority and estimated_duration.
+    Callable by the doctor or by a provider the doctor is affiliated with.
+    The token comes from a per-doctor, per-day counter row and the patient
+    joins today's queue immediately; the journey and consultation step are
+    created when the consultation starts.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        from django.db import transaction
+        
+        serializer = WalkInTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        doctor = data.pop('doctor')
+        patient = data.pop('patient_abha_id')
+        
+        user = request.user
+        if user.is_doctor:
+            allowed = doctor.user_id == user.id
+        elif user.is_provider:
+            allowed = doctor.organization_id is not None and doctor.organization.user_id == user.id
+        else:
+            allowed = False
+        if not allowed:
+            return Response({"error": "Only the doctor or their organization can issue walk-in tokens"}, status=status.HTTP_403_FORBIDDEN)
+        
+        with transaction.atomic():
+            appointment = services.issue_walk_in(patient, doctor, **data)
+        
+        return Response({
+            "token_number": appointment.token_number,
+            "date": timezone.localdate(appointment.scheduled_time),
+            "appointment": AppointmentSerializer(appointment).data
+        }, status=status.HTTP_201_CREATED)
 
 
 class AppointmentDetailView(generics.RetrieveUpdateAPIView):
-    """Get or update an appointment"""
+    """
+    Get or update an appointment. Only estimated_duration is writable:
+    times move through RescheduleAppointmentView and status through the
+    action views, so the slot inventory and queues stay in step.
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = AppointmentSerializer
     
@@ -136,29 +184,88 @@ class AppointmentDetailView(generics.RetrieveUpdateAPIView):
         elif user.is_doctor:
             return Appointment.objects.filter(doctor=user.doctor_profile)
         return Appointment.objects.none()
+    
+    def perform_update(self, serializer):
+        from . import ics
+        
+        appointment = serializer.save()
+        ics.invalidate(appointment.doctor_id)
+
+
+def conflict_response(appointment):
+    """409 for a status transition that lost a race with another request"""
+    appointment.refresh_from_db(fields=['status'])
+    return Response(
+        {"error": f"Appointment was changed by another request (now '{appointment.status}')"},
+        status=status.HTTP_409_CONFLICT
+    )
 
 
 class StartAppointmentView(views.APIView):
-    """Doctor starts a consultation - sets actual_start_time"""
+    """
+    Doctor starts a consultation - sets actual_start_time.
+    Without a pk, the doctor takes the next patient from their pooled
+    queue (organization + specialization) instead.
+    Walk-ins and pooled patients get their journey and consultation step here.
+    """
     permission_classes = [IsAuthenticated]
     
-    def post(self, request, pk):
+    def post(self, request, pk=None):
+        from django.db import transaction
+        
         if not request.user.is_doctor:
             return Response({"error": "Only doctors can start appointments"}, status=status.HTTP_403_FORBIDDEN)
         
-        appointment = get_object_or_404(Appointment, pk=pk, doctor=request.user.doctor_profile)
+        doctor = request.user.doctor_profile
+        if pk is None:
+            return self.start_next_pooled(doctor)
+        
+        appointment = get_object_or_404(Appointment, pk=pk, doctor=doctor)
         
         if appointment.status != 'SCHEDULED':
             return Response({"error": f"Cannot start appointment with status '{appointment.status}'"}, status=status.HTTP_400_BAD_REQUEST)
         
-        appointment.status = 'IN_PROGRESS'
-        appointment.actual_start_time = timezone.now()
-        appointment.save()
+        with transaction.atomic():
+            if not appointment.transition('IN_PROGRESS', ['SCHEDULED'], actor=request.user, actual_start_time=timezone.now()):
+                return conflict_response(appointment)
+            if appointment.journey_step_id is None:
+                step = services.attach_journey_step(appointment)
+                Appointment.objects.filter(pk=appointment.pk).update(journey_step=step)
+            queue_state.appointment_started(appointment)
         
         return Response({
             "message": "Appointment started",
             "appointment": AppointmentSerializer(appointment).data
         })
+    
+    def start_next_pooled(self, doctor):
+        from django.db import transaction
+        
+        if Appointment.objects.filter(doctor=doctor, status='IN_PROGRESS').exists():
+            return Response({"error": "Complete the consultation in progress first"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        with transaction.atomic():
+            appointment = PoolTicket.take_next(doctor)
+            if appointment is None:
+                return Response(
+                    {"error": "Nobody in your pooled queue is due for you (another doctor is free sooner)"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            step = services.attach_journey_step(appointment)
+            if not appointment.transition(
+                'IN_PROGRESS', ['SCHEDULED'], actor=doctor.user,
+                actual_start_time=appointment.scheduled_time, journey_step=step
+            ):
+                response = conflict_response(appointment)
+                # Give the ticket back to the pool along with the appointment
+                transaction.set_rollback(True)
+                return response
+            queue_state.appointment_started(appointment)
+        
+        return Response({
+            "message": "Appointment started",
+            "appointment": AppointmentSerializer(appointment).data
+        }, status=status.HTTP_201_CREATED)
 
 
 class CompleteAppointmentView(views.APIView):
@@ -174,9 +281,10 @@ class CompleteAppointmentView(views.APIView):
         if appointment.status != 'IN_PROGRESS':
             return Response({"error": f"Cannot complete appointment with status '{appointment.status}'"}, status=status.HTTP_400_BAD_REQUEST)
         
-        appointment.status = 'COMPLETED'
-        appointment.actual_end_time = timezone.now()
-        appointment.save()
+        if not appointment.transition('COMPLETED', ['IN_PROGRESS'], actor=request.user, actual_end_time=timezone.now()):
+            return conflict_response(appointment)
+        stats = DoctorDurationStats.record_consultation(appointment)
+        queue_state.appointment_completed(appointment, stats)
         
         return Response({
             "message": "Appointment completed",
@@ -185,10 +293,16 @@ class CompleteAppointmentView(views.APIView):
 
 
 class CancelAppointmentView(views.APIView):
-    """Cancel an appointment and refund if paid"""
+    """
+    Cancel an appointment and refund if paid.
+    A freed future slot is offered to the doctor's waitlist in the same
+    transaction.
+    """
     permission_classes = [IsAuthenticated]
     
     def post(self, request, pk):
+        from django.db import transaction
+        
         user = request.user
         
         # Get appointment based on user type
@@ -204,48 +318,27 @@ class CancelAppointmentView(views.APIView):
         
         refund_amount = None
         cancellation_fee = None
+        was_paid = appointment.is_paid
         
-        # Process refund if appointment was paid (with 5% cancellation fee)
-        if appointment.is_paid:
-            from payments.models import Wallet
-            from decimal import Decimal, ROUND_HALF_UP
-            
-            full_amount = appointment.doctor.consultation_fee
+        with transaction.atomic():
+            if not appointment.transition('CANCELLED', ['SCHEDULED', 'IN_PROGRESS'], actor=user, is_paid=False):
+                return conflict_response(appointment)
             
-            # Calculate 5% cancellation fee and 95% refund
-            fee_rate = Decimal('0.05')
-            cancellation_fee = (full_amount * fee_rate).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            refund = full_amount - cancellation_fee
+            # Process refund if appointment was paid (with 5% cancellation fee)
+            if was_paid:
+                refund_amount, cancellation_fee = self.refund(appointment)
             
-            # Refund to patient (95%)
-            patient_wallet, _ = Wallet.objects.get_or_create(user=appointment.patient.user)
-            patient_wallet.credit(
-                amount=refund,
-                reason="REFUND",
-                appointment=appointment,
-                description=f"Refund for cancelled appointment (5% cancellation fee deducted)"
-            )
+            DoctorSlot.release(appointment)
+            queue_state.appointment_cancelled(appointment)
             
-            # Debit from doctor (only the refund portion, doctor keeps the 5% fee)
-            doctor_wallet, _ = Wallet.objects.get_or_create(user=appointment.doctor.user)
-            if doctor_wallet.balance >= refund:
-                doctor_wallet.debit(
-                    amount=refund,
-                    reason="REFUND",
-                    appointment=appointment,
-                    description=f"Refund to {appointment.patient.user.first_name} (kept ₹{cancellation_fee} cancellation fee)"
-                )
-            
-            refund_amount = str(refund)
-            cancellation_fee = str(cancellation_fee)
-            appointment.is_paid = False
-        
-        appointment.status = 'CANCELLED'
-        appointment.save()
+            refill = None
+            if not appointment.is_walk_in:
+                refill = services.fill_from_waitlist(appointment.doctor, appointment.scheduled_time)
         
         response_data = {
             "message": "Appointment cancelled",
-            "appointment": AppointmentSerializer(appointment).data
+            "appointment": AppointmentSerializer(appointment).data,
+            "slot_refilled": refill is not None
         }
         
         if refund_amount:
@@ -254,39 +347,203 @@ class CancelAppointmentView(views.APIView):
             response_data["message"] = f"Appointment cancelled. ₹{refund_amount} refunded (5% cancellation fee: ₹{cancellation_fee})"
         
         return Response(response_data)
+    
+    def refund(self, appointment):
+        """Refund 95% of the fee to the patient; returns (refund, fee) as strings"""
+        from payments.models import Wallet, cancellation_split
+        
+        # 5% cancellation fee and 95% refund
+        refund, cancellation_fee = cancellation_split(appointment.doctor.consultation_fee)
+        
+        # Refund to patient (95%)
+        patient_wallet, _ = Wallet.objects.get_or_create(user=appointment.patient.user)
+        patient_wallet.credit(
+            amount=refund,
+            reason="REFUND",
+            appointment=appointment,
+            description=f"Refund for cancelled appointment (5% cancellation fee deducted)"
+        )
+        
+        # Debit from doctor (only the refund portion, doctor keeps the 5% fee)
+        doctor_wallet, _ = Wallet.objects.get_or_create(user=appointment.doctor.user)
+        if doctor_wallet.balance >= refund:
+            doctor_wallet.debit(
+                amount=refund,
+                reason="REFUND",
+                appointment=appointment,
+                description=f"Refund to {appointment.patient.user.first_name} (kept ₹{cancellation_fee} cancellation fee)"
+            )
+        
+        return str(refund), str(cancellation_fee)
+
+
+class RescheduleAppointmentView(views.APIView):
+    """
+    Move a scheduled appointment to a new time in one transaction.
+    Body: scheduled_time.
+    The journey step and payment stay with the appointment; only the slot
+    changes, so there is no refund and re-payment as with cancel + rebook.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, pk):
+        from django.db import transaction
+        
+        user = request.user
+        if user.is_patient:
+            appointment = get_object_or_404(Appointment, pk=pk, patient=user.patient_profile)
+        elif user.is_doctor:
+            appointment = get_object_or_404(Appointment, pk=pk, doctor=user.doctor_profile)
+        else:
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        
+        if appointment.status != 'SCHEDULED':
+            return Response({"error": f"Cannot reschedule appointment with status '{appointment.status}'"}, status=status.HTTP_400_BAD_REQUEST)
+        if appointment.is_walk_in:
+            return Response({"error": "Walk-in tokens cannot be rescheduled"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = RescheduleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        with transaction.atomic():
+            services.reschedule(appointment, serializer.validated_data['scheduled_time'])
+        
+        return Response({
+            "message": "Appointment rescheduled",
+            "appointment": AppointmentSerializer(appointment).data
+        })
+
+
+class CancelDayView(views.APIView):
+    """
+    Doctor cancels every SCHEDULED appointment on a date (sick leave).
+    Body: date (YYYY-MM-DD).
+    Everything happens in one transaction with bulk writes: one UPDATE for
+    the appointments, bulk-inserted status events and refund transactions,
+    and one aggregated UPDATE for wallet balances.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        from django.db import transaction
+        from django.utils.dateparse import parse_date
+        
+        if not request.user.is_doctor:
+            return Response({"error": "Only doctors can cancel their day"}, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            day = parse_date(str(request.data.get('date', '')))
+        except ValueError:
+            day = None
+        if day is None:
+            return Response({"error": "date must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        doctor = request.user.doctor_profile
+        with transaction.atomic():
+            appointments, refunds = services.cancel_day(doctor, day, actor=request.user)
+        
+        total_refunded = sum((refund for refund, _ in refunds.values()), Decimal('0.00'))
+        return Response({
+            "message": f"Cancelled {len(appointments)} appointments",
+            "date": day,
+            "cancelled_count": len(appointments),
+            "refunded_count": len(refunds),
+            "total_refunded": str(total_refunded),
+            "appointment_ids": [a.id for a in appointments]
+        })
+
+
+class AppointmentPriorityView(views.APIView):
+    """
+    Change a waiting appointment's queue priority (e.g. an emergency).
+    Body: priority (EMERGENCY, ELDERLY or SCHEDULED).
+    Callable by the doctor or by a provider the doctor is affiliated with.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, pk):
+        from django.db import transaction
+        from .models import PRIORITY_RANK
+        
+        appointment = get_object_or_404(Appointment.objects.select_related('doctor__organization'), pk=pk)
+        
+        user = request.user
+        if user.is_doctor:
+            allowed = appointment.doctor.user_id == user.id
+        elif user.is_provider:
+            organization = appointment.doctor.organization
+            allowed = organization is not None and organization.user_id == user.id
+        else:
+            allowed = False
+        if not allowed:
+            return Response({"error": "Only the doctor or their organization can change priority"}, status=status.HTTP_403_FORBIDDEN)
+        
+        priority = request.data.get('priority')
+        if priority not in PRIORITY_RANK:
+            return Response({"error": f"priority must be one of {', '.join(PRIORITY_RANK)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if appointment.status != 'SCHEDULED':
+            return Response({"error": f"Cannot change priority of appointment with status '{appointment.status}'"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        with transaction.atomic():
+            appointment.priority = priority
+            appointment.save(update_fields=['priority'])
+            queue_state.appointment_reprioritized(appointment)
+        
+        return Response({
+            "message": "Priority updated",
+            "appointment": AppointmentSerializer(appointment).data
+        })
 
 
 class DoctorQueueView(views.APIView):
-    """Get today's queue for a doctor"""
+    """
+    Get today's queue for a doctor: consultations in progress, then the
+    waiting list in the order the doctor will see them (priority patients
+    ahead of scheduled ones once they have arrived).
+    """
     permission_classes = [IsAuthenticated]
     
     def get(self, request, doctor_id):
-        today = timezone.now().date()
+        today = timezone.localdate()
         
-        appointments = Appointment.objects.filter(
+        appointments = list(Appointment.objects.filter(
             doctor_id=doctor_id,
-            scheduled_time__date=today,
+            scheduled_time__range=queue_state.day_bounds(today),
             status__in=['SCHEDULED', 'IN_PROGRESS']
-        ).order_by('scheduled_time')
+        ).order_by('scheduled_time'))
+        
+        queue = queue_state.get_queue(doctor_id, today)
+        for appointment in appointments:
+            if appointment.status == 'SCHEDULED' and (
+                not queue.is_waiting(appointment.id) or queue.priority(appointment.id) != appointment.priority
+            ):
+                # Booked or reprioritized through another worker
+                queue.add(appointment.id, appointment.scheduled_time, appointment.priority)
+        rank = {appointment_id: index for index, appointment_id in enumerate(queue.order())}
+        appointments.sort(key=lambda a: -1 if a.status == 'IN_PROGRESS' else rank.get(a.id, len(rank)))
         
         return Response({
             "doctor_id": doctor_id,
             "date": today,
-            "queue_count": appointments.count(),
+            "queue_count": len(appointments),
             "appointments": AppointmentSerializer(appointments, many=True).data
         })
 
 
 class WaitTimeView(views.APIView):
-    """Get predicted wait time for an appointment"""
+    """
+    Get predicted wait time for an appointment.
+    Answered from the doctor's in-memory queue for the appointment's day
+    (see queue_state) instead of re-counting the Appointment table.
+    """
     permission_classes = [IsAuthenticated]
     
     def get(self, request, pk):
-        appointment = get_object_or_404(Appointment, pk=pk)
+        appointment = get_object_or_404(Appointment.objects.select_related('patient'), pk=pk)
         
         # Verify access
         user = request.user
-        if user.is_patient and appointment.patient.user != user:
+        if user.is_patient and appointment.patient.user_id != user.id:
             return Response({"error": "Not your appointment"}, status=status.HTTP_403_FORBIDDEN)
         
         if appointment.status in ['COMPLETED', 'CANCELLED']:
@@ -300,104 +557,632 @@ class WaitTimeView(views.APIView):
                 "message": "Your consultation is in progress"
             })
         
-        # Calculate wait time
-        doctor = appointment.doctor
-        today = timezone.now().date()
-        now = timezone.now()
+        # Use the appointment's scheduled date, not today's date
+        queue = queue_state.get_queue(
+            appointment.doctor_id, queue_state.queue_day(appointment.scheduled_time)
+        )
+        return Response(queue.wait_time(appointment.id, appointment.scheduled_time, priority=appointment.priority))
+
+
+class DoctorWaitTimesView(views.APIView):
+    """
+    Predicted start times for everyone waiting in a doctor's queue.
+    One pass over the day's queue instead of one WaitTimeView per patient.
+    Optional ?date=YYYY-MM-DD (defaults to today), no later than the
+    booking horizon, so requests can't fill the in-memory queue registry
+    with empty days.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, doctor_id):
+        from django.utils.dateparse import parse_date
+        from users.models import DoctorProfile
+        from .availability import MATERIALIZE_WEEKS
+        
+        day = timezone.localdate()
+        if request.query_params.get('date'):
+            try:
+                day = parse_date(request.query_params['date'])
+            except ValueError:
+                day = None
+            if day is None:
+                return Response({"error": "date must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        horizon = timezone.localdate() + timedelta(weeks=MATERIALIZE_WEEKS)
+        if day > horizon:
+            return Response({"error": f"date must be on or before {horizon.isoformat()}"}, status=status.HTTP_400_BAD_REQUEST)
+        if not DoctorProfile.objects.filter(id=doctor_id).exists():
+            return Response({"error": "Doctor not found"}, status=status.HTTP_404_NOT_FOUND)
         
-        # Get average consultation duration from recent completed appointments
-        recent_completed = Appointment.objects.filter(
-            doctor=doctor,
-            status='COMPLETED',
-            actual_start_time__isnull=False,
-            actual_end_time__isnull=False
-        ).order_by('-actual_end_time')[:10]
-        
-        if recent_completed.exists():
-            durations = [
-                (a.actual_end_time - a.actual_start_time).total_seconds() 
-                for a in recent_completed
+        queue = queue_state.get_queue(doctor_id, day)
+        wait_times = queue.wait_times()
+        
+        return Response({
+            "doctor_id": doctor_id,
+            "date": day,
+            "queue_count": len(wait_times),
+            "wait_times": wait_times
+        })
+
+
+class AvailabilityTemplateView(views.APIView):
+    """
+    The doctor's weekly working hours. GET returns the windows (OPD hours
+    every day if none are set); PUT replaces them and re-materializes the
+    doctor's free slots right away. Existing bookings outside the new
+    hours are kept.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        if not request.user.is_doctor:
+            return Response({"error": "Only doctors have working hours"}, status=status.HTTP_403_FORBIDDEN)
+        from .availability import DEFAULT_TEMPLATE
+        
+        templates = AvailabilityTemplate.objects.filter(doctor=request.user.doctor_profile)
+        if templates:
+            windows = AvailabilityTemplateSerializer(templates, many=True).data
+        else:
+            windows = [
+                {"weekday": weekday, "start_time": start_time, "end_time": end_time}
+                for weekday, start_time, end_time in DEFAULT_TEMPLATE
             ]
-            avg_seconds = sum(durations) / len(durations)
-            # Ensure minimum of 15 minutes
-            avg_duration = timedelta(seconds=max(avg_seconds, 900))
+        return Response({"is_default": not templates, "windows": windows})
+    
+    def put(self, request):
+        from django.db import transaction
+        from .availability import MATERIALIZE_WEEKS, materialize
+        
+        if not request.user.is_doctor:
+            return Response({"error": "Only doctors have working hours"}, status=status.HTTP_403_FORBIDDEN)
+        doctor = request.user.doctor_profile
+        serializer = WeeklyAvailabilitySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        with transaction.atomic():
+            AvailabilityTemplate.objects.filter(doctor=doctor).delete()
+            AvailabilityTemplate.objects.bulk_create([
+                AvailabilityTemplate(doctor=doctor, **window) for window in serializer.validated_data['windows']
+            ])
+            created, removed = materialize([doctor.id])
+        
+        return Response({
+            "is_default": False,
+            "windows": AvailabilityTemplateSerializer(serializer.validated_data['windows'], many=True).data,
+            "bookable_weeks": MATERIALIZE_WEEKS,
+            "slots_created": created,
+            "slots_removed": removed,
+        })
+
+
+class WaitlistListCreateView(generics.ListCreateAPIView):
+    """
+    Patients join a doctor's waitlist for a date and preferred window, or
+    list their entries. A matching slot freed by a cancellation is booked
+    for them automatically.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = WaitlistEntrySerializer
+    
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_patient:
+            return WaitlistEntry.objects.filter(patient=user.patient_profile).select_related('doctor__user')
+        elif user.is_doctor:
+            return WaitlistEntry.objects.filter(doctor=user.doctor_profile, status='WAITING').select_related('doctor__user')
+        return WaitlistEntry.objects.none()
+    
+    def perform_create(self, serializer):
+        from rest_framework.exceptions import PermissionDenied
+        
+        if not self.request.user.is_patient:
+            raise PermissionDenied("Only patients can join a waitlist")
+        serializer.save(patient=self.request.user.patient_profile)
+
+
+class WaitlistLeaveView(views.APIView):
+    """Patient leaves a waitlist"""
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, pk):
+        if not request.user.is_patient:
+            return Response({"error": "Only patients can leave a waitlist"}, status=status.HTTP_403_FORBIDDEN)
+        
+        left = WaitlistEntry.objects.filter(
+            pk=pk, patient=request.user.patient_profile, status='WAITING'
+        ).update(status='CANCELLED')
+        if not left:
+            return Response({"error": "No waiting entry found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"message": "Left the waitlist"})
+
+
+class DelayNotificationListView(generics.ListAPIView):
+    """
+    The patient's "running late" notifications for today's and upcoming
+    appointments, newest first.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = DelayNotificationSerializer
+    
+    def get_queryset(self):
+        user = self.request.user
+        if not user.is_patient:
+            return DelayNotification.objects.none()
+        return DelayNotification.objects.filter(
+            appointment__patient=user.patient_profile,
+            appointment__scheduled_time__gte=queue_state.day_bounds(timezone.localdate())[0]
+        ).select_related('appointment__doctor__user')
+
+
+class PooledQueueView(views.APIView):
+    """
+    Pooled queue for a specialization at an organization: patients wait
+    for whichever of its doctors is free first.
+    GET ?organization=&specialization= lists today's waiting tickets with
+    the expected doctor and start time.
+    POST joins the pool (patients for themselves, providers for a patient
+    by patient_abha_id).
+    A pooled doctor takes the next patient with POST queue/pool/next/.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        from users.models import DoctorProfile
+        from .pooling import predict
+        
+        organization_id = request.query_params.get('organization')
+        specialization = request.query_params.get('specialization')
+        if not organization_id or not specialization:
+            return Response({"error": "organization and specialization are required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            organization_id = int(organization_id)
+        except ValueError:
+            return Response({"error": "organization must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        doctor_ids = list(DoctorProfile.objects.filter(
+            organization_id=organization_id, specialization__iexact=specialization
+        ).values_list('id', flat=True))
+        if not doctor_ids:
+            return Response({"error": "No doctors with this specialization at the organization"}, status=status.HTTP_404_NOT_FOUND)
+        specialization = DoctorProfile.objects.get(id=doctor_ids[0]).specialization
+        
+        tickets = list(PoolTicket.waiting(organization_id, specialization, timezone.localdate()))
+        if request.user.is_patient:
+            # Patients only see their own tickets, but positions are pool-wide
+            predictions = [p for p in predict(doctor_ids, tickets) if p['patient_id'] == request.user.patient_profile.id]
         else:
-            # Default to 15 minutes per consultation when no historical data is available
-            avg_duration = timedelta(minutes=15)
+            predictions = predict(doctor_ids, tickets)
         
-        # Count appointments ahead (scheduled before this one, not completed)
-        # Use the appointment's scheduled date, not today's date
-        from datetime import datetime, time
-        appt_date = appointment.scheduled_time.date()
-        start_of_day = timezone.make_aware(datetime.combine(appt_date, time.min))
-        end_of_day = timezone.make_aware(datetime.combine(appt_date, time.max))
-        
-        ahead = Appointment.objects.filter(
-            doctor=doctor,
-            scheduled_time__gte=start_of_day,
-            scheduled_time__lte=end_of_day,
-            scheduled_time__lt=appointment.scheduled_time,
-            status__in=['SCHEDULED', 'IN_PROGRESS', 'CHECKED_IN']
-        ).exclude(id=appointment.id).count()
-        
-        # Calculate predicted start time based on queue
-        # Check if there's an appointment in progress
-        in_progress = Appointment.objects.filter(
-            doctor=doctor,
-            status='IN_PROGRESS'
-        ).first()
-        
-        if in_progress and in_progress.actual_start_time:
-            # There's an active consultation
-            elapsed = now - in_progress.actual_start_time
-            remaining = max(avg_duration - elapsed, timedelta(0))
-            # Predicted start = remaining time + time for people ahead
-            predicted_start = now + remaining + (ahead * avg_duration)
+        return Response({
+            "organization_id": organization_id,
+            "specialization": specialization,
+            "doctor_ids": doctor_ids,
+            "waiting_count": len(tickets),
+            "tickets": predictions
+        })
+    
+    def post(self, request):
+        serializer = PoolTicketCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        user = request.user
+        if user.is_patient:
+            patient = user.patient_profile
+        elif user.is_provider and data['organization'].user_id == user.id:
+            patient = data.get('patient')
+            if patient is None:
+                return Response({"error": "patient_abha_id is required"}, status=status.HTTP_400_BAD_REQUEST)
         else:
-            # No active consultation
-            # Get the earliest scheduled appointment for this doctor on this day
-            earliest_appt = Appointment.objects.filter(
-                doctor=doctor,
-                scheduled_time__gte=start_of_day,
-                scheduled_time__lte=end_of_day,
-                status='SCHEDULED'
-            ).order_by('scheduled_time').first()
-            
-            if earliest_appt:
-                # Start from the earliest scheduled time
-                base_start = max(now, earliest_appt.scheduled_time)
-                # Calculate based on queue position from earliest
-                all_ahead = Appointment.objects.filter(
-                    doctor=doctor,
-                    scheduled_time__gte=start_of_day,
-                    scheduled_time__lte=end_of_day,
-                    scheduled_time__lt=appointment.scheduled_time,
-                    status='SCHEDULED'
-                ).exclude(id=appointment.id).count()
-                predicted_start = base_start + (all_ahead * avg_duration)
+            return Response({"error": "Only patients or the organization can join a pooled queue"}, status=status.HTTP_403_FORBIDDEN)
+        
+        # Joining twice keeps the original place in the pool
+        ticket = PoolTicket.waiting(
+            data['organization'].id, data['specialization'], timezone.localdate()
+        ).filter(patient=patient).first()
+        if ticket is None:
+            ticket = PoolTicket.objects.create(
+                organization=data['organization'], specialization=data['specialization'], patient=patient
+            )
+        
+        return Response({
+            "ticket_id": ticket.id,
+            "organization_id": ticket.organization_id,
+            "specialization": ticket.specialization,
+            "joined_at": ticket.created_at,
+            "status": ticket.status
+        }, status=status.HTTP_201_CREATED)
+
+
+class OrganizationQueueView(views.APIView):
+    """
+    Live queue board for every doctor affiliated with the provider:
+    consultation in progress, next patient and waiting count.
+    Built with two queries (doctors, today's open appointments), with the
+    next patient picked from those rows by the queues' dispatch order so
+    priority patients come first, and cached per provider for
+    BOARD_CACHE_SECONDS, so a wall display can poll it every few seconds.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    BOARD_CACHE_SECONDS = 5
+    
+    def get(self, request):
+        from django.core.cache import cache
+        from django.utils.cache import patch_cache_control
+        from users.models import ProviderProfile
+        
+        if not request.user.is_provider:
+            return Response({"error": "Only providers can access this"}, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            provider = request.user.provider_profile
+        except ProviderProfile.DoesNotExist:
+            return Response({"error": "Provider profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        day = timezone.localdate()
+        cache_key = f"queue_board:{provider.id}:{day.isoformat()}"
+        board = cache.get(cache_key)
+        if board is None:
+            board = self.build_board(provider, day)
+            cache.set(cache_key, board, self.BOARD_CACHE_SECONDS)
+        
+        response = Response(board)
+        patch_cache_control(response, private=True, max_age=self.BOARD_CACHE_SECONDS)
+        return response
+    
+    def build_board(self, provider, day):
+        from .models import PRIORITY_RANK
+        from .simulation import dispatch_order
+        
+        doctors = {}
+        for doc in provider.doctors.select_related('user').order_by('user__first_name', 'user__last_name'):
+            doctors[doc.id] = {
+                'doctor_id': doc.id,
+                'doctor_name': f"Dr. {doc.user.first_name} {doc.user.last_name}".strip(),
+                'specialization': doc.specialization,
+                'current': None,
+                'next': None,
+                'waiting_count': 0,
+            }
+        
+        appointments = Appointment.objects.filter(
+            doctor_id__in=list(doctors),
+            scheduled_time__range=queue_state.day_bounds(day),
+            status__in=['SCHEDULED', 'IN_PROGRESS']
+        ).order_by('scheduled_time', 'id').values(
+            'id', 'doctor_id', 'status', 'priority', 'scheduled_time', 'actual_start_time',
+            'patient__user__first_name', 'patient__user__last_name'
+        )
+        
+        waiting = defaultdict(list)
+        for row in appointments:
+            entry = doctors[row['doctor_id']]
+            patient = {
+                'appointment_id': row['id'],
+                'patient_name': f"{row['patient__user__first_name']} {row['patient__user__last_name']}".strip(),
+                'scheduled_time': row['scheduled_time'],
+            }
+            if row['status'] == 'IN_PROGRESS':
+                entry['current'] = dict(patient, started_at=row['actual_start_time'])
             else:
-                # No other appointments, use scheduled time
-                predicted_start = appointment.scheduled_time
-        
-        # Calculate wait time as delay beyond scheduled time
-        if predicted_start <= appointment.scheduled_time:
-            # Running on time or early - no wait
-            estimated_wait_minutes = 0.0
-            predicted_start = appointment.scheduled_time
-            delay_minutes = 0.0
+                waiting[row['doctor_id']].append((patient, PRIORITY_RANK[row['priority']]))
+                entry['waiting_count'] += 1
+        
+        # Whoever the doctor takes first once free, assuming the consultation
+        # in progress runs the default length
+        now = timezone.now()
+        default_seconds = queue_state.DEFAULT_DURATION.total_seconds()
+        for doctor_id, patients in waiting.items():
+            current = doctors[doctor_id]['current']
+            free_at = 0.0
+            if current and current['started_at']:
+                free_at = max((current['started_at'] - now).total_seconds() + default_seconds, 0.0)
+            order = dispatch_order(
+                [(patient['scheduled_time'] - now).total_seconds() for patient, _ in patients],
+                [rank for _, rank in patients],
+                [default_seconds] * len(patients),
+                free_at
+            )
+            doctors[doctor_id]['next'] = patients[order[0]][0]
+        
+        return {
+            "organization_id": provider.id,
+            "date": day,
+            "generated_at": timezone.now(),
+            "doctors": list(doctors.values())
+        }
+
+
+class AvailabilityView(views.APIView):
+    """
+    Next open slots across all doctors of a specialization.
+    Query params: specialization (required), from, to (ISO datetimes),
+    limit (default 10, max 100).
+    """
+    permission_classes = [IsAuthenticated]
+    
+    DEFAULT_RANGE = timedelta(days=14)
+    MAX_RANGE = timedelta(days=90)
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 100
+    
+    def get(self, request):
+        from django.utils.dateparse import parse_datetime
+        from users.models import DoctorProfile
+        from .availability import find_free_slots
+        
+        specialization = request.query_params.get('specialization')
+        if not specialization:
+            return Response({"error": "specialization is required"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            limit = int(request.query_params.get('limit', self.DEFAULT_LIMIT))
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response({"error": "limit must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(limit, self.MAX_LIMIT)
+        
+        start = timezone.now()
+        try:
+            if request.query_params.get('from'):
+                start = parse_datetime(request.query_params['from'])
+            end = start + self.DEFAULT_RANGE if start else None
+            if request.query_params.get('to'):
+                end = parse_datetime(request.query_params['to'])
+        except ValueError:
+            start = end = None
+        if start is None or end is None:
+            return Response({"error": "from/to must be ISO 8601 datetimes"}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end)
+        end = min(end, start + self.MAX_RANGE)
+        
+        doctors = DoctorProfile.objects.filter(specialization__iexact=specialization)
+        free = find_free_slots(doctors, start, end, limit)
+        
+        profiles = DoctorProfile.objects.select_related('user').in_bulk({doctor_id for _, doctor_id in free})
+        slots = []
+        for slot_start, doctor_id in free:
+            doc = profiles[doctor_id]
+            slots.append({
+                'doctor_id': doctor_id,
+                'doctor_name': f"Dr. {doc.user.first_name} {doc.user.last_name}".strip(),
+                'specialization': doc.specialization,
+                'consultation_fee': str(doc.consultation_fee),
+                'slot_start': slot_start,
+            })
+        
+        return Response({
+            "specialization": specialization,
+            "from": start,
+            "to": end,
+            "slots": slots
+        })
+
+
+class CalendarFeedView(views.APIView):
+    """
+    The doctor's ICS feed URL. GET returns it (creating the token on first
+    use); POST issues a new token, which stops the old URL working.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        if not request.user.is_doctor:
+            return Response({"error": "Only doctors have a calendar feed"}, status=status.HTTP_403_FORBIDDEN)
+        feed, _ = CalendarFeedToken.objects.get_or_create(doctor=request.user.doctor_profile)
+        return Response(self.describe(request, feed))
+    
+    def post(self, request):
+        if not request.user.is_doctor:
+            return Response({"error": "Only doctors have a calendar feed"}, status=status.HTTP_403_FORBIDDEN)
+        feed, created = CalendarFeedToken.objects.get_or_create(doctor=request.user.doctor_profile)
+        if not created:
+            feed.rotate()
+        return Response(self.describe(request, feed), status=status.HTTP_201_CREATED)
+    
+    @staticmethod
+    def describe(request, feed):
+        from django.urls import reverse
+        return {
+            "feed_url": request.build_absolute_uri(reverse('calendar_feed_ics', args=[feed.token])),
+            "created_at": feed.created_at,
+        }
+
+
+class CalendarFeedICSView(views.APIView):
+    """
+    The ICS feed itself, authorized by the token in the URL. Served from
+    the doctor's cached schedule snapshot; If-None-Match with the current
+    ETag gets a 304.
+    """
+    authentication_classes = []
+    permission_classes = []
+    
+    def get(self, request, token):
+        from django.http import HttpResponse, HttpResponseNotModified
+        from django.utils.cache import patch_cache_control
+        from django.utils.http import parse_etags
+        from . import ics
+        
+        doctor_id = CalendarFeedToken.objects.filter(token=token).values_list('doctor_id', flat=True).first()
+        if doctor_id is None:
+            return Response({"error": "Unknown calendar feed"}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag, body = ics.snapshot(doctor_id)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
         else:
-            # Running late - show delay
-            delay = predicted_start - appointment.scheduled_time
-            delay_minutes = delay.total_seconds() / 60
-            estimated_wait_minutes = delay_minutes
+            response = HttpResponse(body, content_type='text/calendar; charset=utf-8')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class DoctorRecommendationView(views.APIView):
+    """
+    Doctors of a specialization ranked by the wait a new patient can expect
+    in a time window, each with the free slot to book.
+    Query params: specialization (required), from, to (ISO datetimes;
+    default the next day), organization (optional).
+    """
+    permission_classes = [IsAuthenticated]
+    
+    DEFAULT_RANGE = timedelta(days=1)
+    
+    def get(self, request):
+        from django.utils.dateparse import parse_datetime
+        from . import recommend
+        
+        specialization = request.query_params.get('specialization')
+        if not specialization:
+            return Response({"error": "specialization is required"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        start = timezone.now()
+        try:
+            if request.query_params.get('from'):
+                start = parse_datetime(request.query_params['from'])
+            end = start + self.DEFAULT_RANGE if start else None
+            if request.query_params.get('to'):
+                end = parse_datetime(request.query_params['to'])
+        except ValueError:
+            start = end = None
+        if start is None or end is None:
+            return Response({"error": "from/to must be ISO 8601 datetimes"}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end)
+        
+        table = recommend.get_table(specialization)
+        if table is None:
+            return Response({"error": "No doctors with this specialization"}, status=status.HTTP_404_NOT_FOUND)
+        
+        doctors = table.rank(start, end)
+        if request.query_params.get('organization'):
+            doctors = [d for d in doctors if str(d['organization_id']) == request.query_params['organization']]
         
         return Response({
-            "queue_position": ahead + 1,
-            "people_ahead": ahead,
-            "avg_consultation_minutes": round(avg_duration.total_seconds() / 60, 1),
-            "estimated_wait_minutes": round(estimated_wait_minutes, 1),
-            "predicted_start_time": predicted_start,
-            "delay_minutes": round(delay_minutes, 1),
-            "current_status": "waiting"
+            "specialization": table.doctors[0]['specialization'],
+            "from": start,
+            "to": end,
+            "doctors": doctors
         })
 
+
+class UtilizationAnalyticsView(views.APIView):
+    """
+    Utilization heatmaps (weekday x hour), no-show rate, overrun and start
+    delay percentiles for a provider's doctors, per doctor and combined.
+    Query params: from, to (YYYY-MM-DD, rounded out to whole weeks;
+    default the last DEFAULT_WEEKS weeks), doctor (optional doctor id).
+    Doctors get their own analytics.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    DEFAULT_WEEKS = 12
+    MAX_WEEKS = 53
+    
+    def get(self, request):
+        from django.utils.dateparse import parse_date
+        from users.models import DoctorProfile, ProviderProfile
+        from . import analytics
+        
+        user = request.user
+        if user.is_provider:
+            try:
+                doctors = user.provider_profile.doctors.all()
+            except ProviderProfile.DoesNotExist:
+                return Response({"error": "Provider profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        elif user.is_doctor:
+            doctors = DoctorProfile.objects.filter(user=user)
+        else:
+            return Response({"error": "Only providers and doctors can access this"}, status=status.HTTP_403_FORBIDDEN)
+        
+        if request.query_params.get('doctor'):
+            try:
+                doctors = doctors.filter(id=int(request.query_params['doctor']))
+            except ValueError:
+                return Response({"error": "doctor must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        today = timezone.localdate()
+        last = today
+        try:
+            if request.query_params.get('to'):
+                last = parse_date(request.query_params['to'])
+            first = last - timedelta(weeks=self.DEFAULT_WEEKS - 1) if last else None
+            if request.query_params.get('from'):
+                first = parse_date(request.query_params['from'])
+        except ValueError:
+            first = last = None
+        if first is None or last is None:
+            return Response({"error": "from/to must be YYYY-MM-DD dates"}, status=status.HTTP_400_BAD_REQUEST)
+        weeks = analytics.weeks_between(first, last)
+        if not weeks:
+            return Response({"error": "from must be before to"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(weeks) > self.MAX_WEEKS:
+            return Response({"error": f"At most {self.MAX_WEEKS} weeks at a time"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        doctors = list(doctors.select_related('user').order_by('user__first_name', 'user__last_name'))
+        vectors = analytics.doctor_week_vectors([doc.id for doc in doctors], weeks, today)
+        
+        results = []
+        for doc in doctors:
+            results.append({
+                'doctor_id': doc.id,
+                'doctor_name': f"Dr. {doc.user.first_name} {doc.user.last_name}".strip(),
+                'specialization': doc.specialization,
+                **analytics.summarize(vectors[doc.id]),
+            })
+        
+        combined = analytics.summarize(list(vectors.values())) if vectors else None
+        return Response({
+            "from": weeks[0],
+            "to": weeks[-1] + timedelta(days=6),
+            "weeks": len(weeks),
+            "overall": combined,
+            "doctors": results
+        })
+
+
+class CapacityPlanView(views.APIView):
+    """
+    Compare roster sizes for a specialization by simulation.
+    Body: specialization, arrivals_per_hour (one rate per hour of the
+    session), rosters (doctor counts to compare), runs (default 2000).
+    Consultation lengths are resampled from the provider's recent
+    consultations in that specialization.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        from users.models import ProviderProfile
+        from .capacity import plan
+        
+        if not request.user.is_provider:
+            return Response({"error": "Only providers can plan capacity"}, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            provider = request.user.provider_profile
+        except ProviderProfile.DoesNotExist:
+            return Response({"error": "Provider profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        serializer = CapacityPlanSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        source, samples, options = plan(
+            data['specialization'], provider, data['arrivals_per_hour'], data['rosters'], data['runs']
+        )
+        return Response({
+            "specialization": data['specialization'],
+            "session_hours": len(data['arrivals_per_hour']),
+            "expected_patients": round(sum(data['arrivals_per_hour']), 1),
+            "runs": data['runs'],
+            "duration_source": source,
+            "duration_samples": samples,
+            "options": options
+        })
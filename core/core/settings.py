@@ -96,6 +96,30 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            # Take the write lock at BEGIN so concurrent bookings queue up
+            # instead of failing with "database is locked" mid-transaction
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+# Per-process cache. With several workers, use a shared backend (Redis,
+# memcached) so consent revocations reach every worker at once; with this
+# one, consent decisions are only cached for a few seconds (journeys.access).
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {
+            # Utilization analytics caches one entry per doctor per week
+            # (about 10k for a 200-doctor hospital over a year)
+            "MAX_ENTRIES": 20000,
+        },
     }
 }
 
@@ -0,0 +1,115 @@
+"""
+Consent decisions for cross-organization data access, and the
+OrgPatientAccess table behind doctors' journey lists.
+
+Every journey, report and doctor action checks whether the patient has
+granted consent to the doctor's organization. Decisions are cached per
+(org, patient) so a repeated check skips the database entirely.
+
+Anything that changes a HealthDataConsent row must call
+consent_changed(), which calls invalidate(), inside its transaction.
+That replaces the cached decision with a short-lived tombstone, both
+immediately and again on commit. A reader that loaded the old decision
+from the database just before the change caches it with cache.add(),
+which never overwrites the tombstone, so a revoked consent is never
+served from the cache.
+
+Only a shared cache backend (Redis, memcached, database) lets one
+worker's invalidation reach the others. With a per-process backend
+(LocMemCache, the default in settings), another worker could keep
+serving a revoked consent, so decisions are then kept for
+LOCAL_DECISION_SECONDS only.
+
+OrgPatientAccess holds a row for every journey an organization can see.
+journey_created() adds the rows for a new journey and consent_changed()
+adds or removes a patient's rows when a consent is granted or withdrawn.
+Both must run in the transaction that makes the change.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import HealthDataConsent, Journey, OrgPatientAccess
+
+SHARED_DECISION_SECONDS = 60 * 60
+LOCAL_DECISION_SECONDS = 5
+PER_PROCESS_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+# Longer than a consent check can take between its query and caching the result
+TOMBSTONE_SECONDS = 30
+_TOMBSTONE = "invalidated"
+
+
+def decision_seconds():
+    """How long a decision may be cached, given where invalidations can reach"""
+    if settings.CACHES["default"]["BACKEND"] in PER_PROCESS_BACKENDS:
+        return LOCAL_DECISION_SECONDS
+    return SHARED_DECISION_SECONDS
+
+
+def _cache_key(org_id, patient_id):
+    return f"consent:{org_id}:{patient_id}"
+
+
+def has_consent(org_id, patient_id):
+    """Whether the patient has granted consent to the organization"""
+    if org_id is None:
+        return False
+    key = _cache_key(org_id, patient_id)
+    decision = cache.get(key)
+    if isinstance(decision, bool):
+        return decision
+    granted = HealthDataConsent.objects.filter(
+        patient_id=patient_id,
+        requesting_org_id=org_id,
+        status='GRANTED'
+    ).exists()
+    if decision is None:
+        cache.add(key, granted, decision_seconds())
+    return granted
+
+
+def can_access_journey(org_id, journey):
+    """The journey was created by the organization, or its patient consented"""
+    return journey.created_by_org_id == org_id or has_consent(org_id, journey.patient_id)
+
+
+def invalidate(org_id, patient_id):
+    """Drop the cached decision. Call inside the transaction that changes the consent."""
+    key = _cache_key(org_id, patient_id)
+    cache.set(key, _TOMBSTONE, TOMBSTONE_SECONDS)
+    transaction.on_commit(lambda: cache.set(key, _TOMBSTONE, TOMBSTONE_SECONDS))
+
+
+def journey_created(journey):
+    """Give the creating organization and every consented one access to a new journey"""
+    org_ids = set(HealthDataConsent.objects.filter(
+        patient_id=journey.patient_id, status='GRANTED'
+    ).values_list('requesting_org_id', flat=True))
+    if journey.created_by_org_id:
+        org_ids.add(journey.created_by_org_id)
+    OrgPatientAccess.objects.bulk_create([
+        OrgPatientAccess(organization_id=org_id, patient_id=journey.patient_id, journey=journey)
+        for org_id in org_ids
+    ], ignore_conflicts=True)
+
+
+def consent_changed(consent):
+    """
+    Bring the cached decision and the organization's access rows in line
+    with the consent's status: all the patient's journeys while GRANTED,
+    otherwise only the ones the organization created.
+    """
+    org_id, patient_id = consent.requesting_org_id, consent.patient_id
+    invalidate(org_id, patient_id)
+    if consent.status == 'GRANTED':
+        OrgPatientAccess.objects.bulk_create([
+            OrgPatientAccess(organization_id=org_id, patient_id=patient_id, journey_id=journey_id)
+            for journey_id in Journey.objects.filter(patient_id=patient_id).values_list('id', flat=True)
+        ], batch_size=500, ignore_conflicts=True)
+    else:
+        OrgPatientAccess.objects.filter(
+            organization_id=org_id, patient_id=patient_id
+        ).exclude(journey__created_by_org_id=org_id).delete()
@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-17 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """Rows for journeys each organization created, then for every journey of its consented patients"""
+    Journey = apps.get_model('journeys', 'Journey')
+    HealthDataConsent = apps.get_model('journeys', 'HealthDataConsent')
+    OrgPatientAccess = apps.get_model('journeys', 'OrgPatientAccess')
+
+    journeys_by_patient = {}
+    rows = []
+    for journey_id, patient_id, org_id in Journey.objects.values_list('id', 'patient_id', 'created_by_org_id').iterator():
+        journeys_by_patient.setdefault(patient_id, []).append(journey_id)
+        if org_id is not None:
+            rows.append(OrgPatientAccess(organization_id=org_id, patient_id=patient_id, journey_id=journey_id))
+    for org_id, patient_id in HealthDataConsent.objects.filter(status='GRANTED').values_list('requesting_org_id', 'patient_id'):
+        rows += [
+            OrgPatientAccess(organization_id=org_id, patient_id=patient_id, journey_id=journey_id)
+            for journey_id in journeys_by_patient.get(patient_id, [])
+        ]
+    OrgPatientAccess.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('journeys', '0003_journeystep_assigned_lab'),
+        ('users', '0005_patientprofile_address_patientprofile_allergies_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrgPatientAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='org_access', to='journeys.journey')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='journey_access', to='users.providerprofile')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='org_access', to='users.patientprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['organization', 'patient'], name='org_access_patient_idx')],
+                'constraints': [models.UniqueConstraint(fields=('organization', 'journey'), name='unique_org_journey_access')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -140,3 +140,28 @@ class HealthDataConsent(models.Model):
     
     def __str__(self):
         return f"Consent: {self.requesting_org} -> {self.patient} ({self.status})"
+
+
+class OrgPatientAccess(models.Model):
+    """
+    Materialized access from organizations to patients' journeys: one row
+    per journey an organization can see, because it created the journey
+    or because the patient granted it consent. Kept in step by
+    journeys.access on journey creation and consent changes, so a doctor's
+    journey list is a single join on the (organization, journey) index.
+    """
+    organization = models.ForeignKey(ProviderProfile, on_delete=models.CASCADE, related_name="journey_access")
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name="org_access")
+    journey = models.ForeignKey(Journey, on_delete=models.CASCADE, related_name="org_access")
+
+    class Meta:
+        constraints = [
+            # Also the covering index for listing an organization's journeys
+            models.UniqueConstraint(fields=['organization', 'journey'], name='unique_org_journey_access'),
+        ]
+        indexes = [
+            models.Index(fields=['organization', 'patient'], name='org_access_patient_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.organization} -> journey {self.journey_id} of {self.patient}"
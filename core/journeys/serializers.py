@@ -1,5 +1,7 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import Journey, JourneyStep, Prescription, MedicalReport, HealthDataConsent
+from . import access
 from users.models import PatientProfile, DoctorProfile, ProviderProfile
 
 
@@ -67,6 +69,24 @@ class JourneySerializer(serializers.ModelSerializer):
     
     def get_created_by_org_name(self, obj):
         return obj.created_by_org.name if obj.created_by_org else None
+    
+    @staticmethod
+    def prefetch(queryset):
+        """
+        Load everything this serializer reads: one query for the journeys
+        (with patient, user and org joined) and one for all their steps
+        (with prescription, report, org and doctor joined), whatever the
+        number of journeys.
+        """
+        steps = JourneyStep.objects.select_related(
+            'prescription__doctor__user',
+            'report',
+            'created_by_org',
+            'created_by_doctor__user',
+        )
+        return queryset.select_related('patient__user', 'created_by_org').prefetch_related(
+            Prefetch('steps', queryset=steps)
+        )
 
 
 class JourneyCreateSerializer(serializers.ModelSerializer):
@@ -84,6 +104,7 @@ class JourneyCreateSerializer(serializers.ModelSerializer):
             **validated_data,
             created_by_org=doctor_profile.organization if doctor_profile else None
         )
+        access.journey_created(journey)
         return journey
 
 
@@ -1,3 +1,216 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from users.models import User, DoctorProfile, PatientProfile, ProviderProfile
+from . import access
+from .models import Journey, JourneyStep, Prescription, MedicalReport, HealthDataConsent, OrgPatientAccess
+
+
+class JourneySerializerQueryCountTests(TestCase):
+    """Journey views serialize whole journey trees in a fixed number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hospital = ProviderProfile.objects.create(
+            user=User.objects.create_user("hospital@example.com", "pw", type="PROVIDER"),
+            type="HOSPITAL", name="Hospital", address="Street", hfr_id="hfr-1"
+        )
+        cls.lab = ProviderProfile.objects.create(
+            user=User.objects.create_user("lab@example.com", "pw", type="PROVIDER"),
+            type="LAB", name="Lab", address="Street", hfr_id="hfr-2"
+        )
+        cls.doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user("doctor@example.com", "pw", type="DOCTOR", first_name="Asha"),
+            specialization="Cardiology", hpr_id="hpr-1", organization=cls.hospital
+        )
+        cls.patient = PatientProfile.objects.create(
+            user=User.objects.create_user("patient@example.com", "pw", type="PATIENT", first_name="Ravi"),
+            abha_id="91-0000"
+        )
+        HealthDataConsent.objects.create(patient=cls.patient, requesting_org=cls.hospital, status="GRANTED")
+
+    def setUp(self):
+        cache.clear()
+
+    def add_journeys(self, count, steps=6):
+        for _ in range(count):
+            journey = Journey.objects.create(patient=self.patient, title="Checkup", created_by_org=self.hospital)
+            access.journey_created(journey)
+            for order in range(steps):
+                step = JourneyStep.objects.create(
+                    journey=journey, order=order, type=("CONSULTATION", "TEST", "PHARMACY")[order % 3],
+                    created_by_org=self.hospital, created_by_doctor=self.doctor
+                )
+                if step.type == "PHARMACY":
+                    Prescription.objects.create(step=step, doctor=self.doctor, medications=[{"name": "Aspirin"}])
+                elif step.type == "TEST":
+                    MedicalReport.objects.create(step=step, provider=self.lab, data={"hb": 13})
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def assert_constant_queries(self, client, url, expected):
+        """Same query count for a short and a long history (consent decision already cached)"""
+        client.get(url)
+        for count in (2, 10):
+            self.add_journeys(count)
+            with self.assertNumQueries(expected):
+                response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_patient_list(self):
+        response = self.assert_constant_queries(self.client_for(self.patient.user), "/api/journeys/", 2)
+        self.assertEqual(len(response.json()), 12)
+
+    def test_doctor_list(self):
+        response = self.assert_constant_queries(self.client_for(self.doctor.user), "/api/journeys/", 2)
+        self.assertEqual(len(response.json()), 12)
+
+    def test_fetch_by_abha(self):
+        client = self.client_for(self.doctor.user)
+        response = self.assert_constant_queries(client, f"/api/journeys/by-abha/{self.patient.abha_id}/", 4)
+        journey = response.json()["journeys"][0]
+        self.assertEqual(journey["steps"][1]["report"]["data"], {"hb": 13})
+        self.assertEqual(journey["steps"][2]["prescription"]["doctor_name"], "Dr. Asha ")
+
+    def test_detail(self):
+        self.add_journeys(1, steps=30)
+        journey = Journey.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client_for(self.patient.user).get(f"/api/journeys/{journey.id}/")
+        self.assertEqual(len(response.json()["steps"]), 30)
+
+
+class ConsentCacheTests(TestCase):
+    """Cached consent decisions are reused, and never outlive a withdrawal"""
+
+    def setUp(self):
+        cache.clear()
+        self.hospital = ProviderProfile.objects.create(
+            user=User.objects.create_user("hospital@example.com", "pw", type="PROVIDER"),
+            type="HOSPITAL", name="Hospital", address="Street", hfr_id="hfr-1"
+        )
+        self.patient = PatientProfile.objects.create(
+            user=User.objects.create_user("patient@example.com", "pw", type="PATIENT"), abha_id="91-0000"
+        )
+        self.consent = HealthDataConsent.objects.create(patient=self.patient, requesting_org=self.hospital, status="GRANTED")
+
+    def has_consent(self):
+        return access.has_consent(self.hospital.id, self.patient.id)
+
+    def revoke(self):
+        with transaction.atomic():
+            self.consent.status = "REVOKED"
+            self.consent.save()
+            access.consent_changed(self.consent)
+
+    def test_decision_is_cached(self):
+        self.assertTrue(self.has_consent())
+        with self.assertNumQueries(0):
+            self.assertTrue(self.has_consent())
+
+    def test_deny_invalidates(self):
+        self.assertTrue(self.has_consent())
+        client = APIClient()
+        client.force_authenticate(self.patient.user)
+        response = client.post(f"/api/journeys/consent/{self.consent.id}/respond/", {"status": "DENIED"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.has_consent())
+
+    def test_revoke_invalidates(self):
+        self.assertTrue(self.has_consent())
+        self.revoke()
+        self.assertFalse(self.has_consent())
+        # The fresh decision is cached again once the tombstone is read past
+        cache.delete(access._cache_key(self.hospital.id, self.patient.id))
+        self.assertFalse(self.has_consent())
+        with self.assertNumQueries(0):
+            self.assertFalse(self.has_consent())
+
+    def test_stale_fill_does_not_override_revocation(self):
+        # The revocation lands after a reader queried the consent but before
+        # it cached what it read
+        add = cache.add
+
+        def revoke_then_add(*args, **kwargs):
+            self.revoke()
+            return add(*args, **kwargs)
+
+        with mock.patch.object(access.cache, "add", side_effect=revoke_then_add):
+            self.assertTrue(self.has_consent())
+        self.assertFalse(self.has_consent())
+
+
+class OrgPatientAccessTests(TestCase):
+    """The access table follows consent changes and pages by journey id"""
+
+    def setUp(self):
+        cache.clear()
+        self.hospital, self.clinic = [
+            ProviderProfile.objects.create(
+                user=User.objects.create_user(f"{name}@example.com", "pw", type="PROVIDER"),
+                type="HOSPITAL", name=name, address="Street", hfr_id=f"hfr-{name}"
+            )
+            for name in ("hospital", "clinic")
+        ]
+        self.doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user("doctor@example.com", "pw", type="DOCTOR"),
+            specialization="Cardiology", hpr_id="hpr-1", organization=self.hospital
+        )
+        self.patient = PatientProfile.objects.create(
+            user=User.objects.create_user("patient@example.com", "pw", type="PATIENT"), abha_id="91-0000"
+        )
+        self.own = [self.add_journey(self.hospital) for _ in range(2)]
+        self.elsewhere = [self.add_journey(self.clinic) for _ in range(3)]
+        self.consent = HealthDataConsent.objects.create(patient=self.patient, requesting_org=self.hospital)
+
+    def add_journey(self, org):
+        journey = Journey.objects.create(patient=self.patient, title="Checkup", created_by_org=org)
+        access.journey_created(journey)
+        return journey
+
+    def visible(self):
+        return set(OrgPatientAccess.objects.filter(organization=self.hospital).values_list("journey_id", flat=True))
+
+    def respond(self, decision):
+        client = APIClient()
+        client.force_authenticate(self.patient.user)
+        response = client.post(f"/api/journeys/consent/{self.consent.id}/respond/", {"status": decision}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_grant_and_deny(self):
+        own = {journey.id for journey in self.own}
+        self.assertEqual(self.visible(), own)
+        self.respond("GRANTED")
+        self.assertEqual(self.visible(), own | {journey.id for journey in self.elsewhere})
+        # Journeys created while consent stands are added too
+        later = self.add_journey(self.clinic)
+        self.assertIn(later.id, self.visible())
+        self.respond("DENIED")
+        self.assertEqual(self.visible(), own)
+        self.assertEqual(
+            set(OrgPatientAccess.objects.filter(organization=self.clinic).values_list("journey_id", flat=True)),
+            {journey.id for journey in self.elsewhere} | {later.id}
+        )
 
-# Create your tests here.
+    def test_keyset_pages(self):
+        self.respond("GRANTED")
+        client = APIClient()
+        client.force_authenticate(self.doctor.user)
+        pages, before = [], ""
+        while True:
+            page = [journey["id"] for journey in client.get(f"/api/journeys/?limit=2&before={before}").json()]
+            if not page:
+                break
+            pages.append(page)
+            before = page[-1]
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        seen = [journey_id for page in pages for journey_id in page]
+        self.assertEqual(seen, sorted(self.visible(), reverse=True))
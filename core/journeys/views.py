@@ -3,7 +3,7 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from django.db.models import Q
+from django.db import transaction
 
 from .models import Journey, JourneyStep, HealthDataConsent
 from .serializers import (
@@ -12,16 +12,22 @@ from .serializers import (
     HealthDataConsentSerializer, ConsentRequestSerializer, ConsentResponseSerializer
 )
 from users.models import PatientProfile, DoctorProfile
+from . import access
 
 
 class JourneyListCreateView(generics.ListCreateAPIView):
     """
     List journeys for the authenticated user or create a new journey.
     - Patients see their own journeys
-    - Doctors see journeys where they have access (own org or consented)
+    - Doctors see journeys where they have access (own org or consented),
+      newest first, `limit` at a time (default 50, max 200); pass the
+      last id received as `before` for the next page
     """
     permission_classes = [IsAuthenticated]
     
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 200
+    
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return JourneyCreateSerializer
@@ -32,22 +38,28 @@ class JourneyListCreateView(generics.ListCreateAPIView):
         
         if user.is_patient:
             # Patients see all their journeys
-            return Journey.objects.filter(patient=user.patient_profile)
+            return JourneySerializer.prefetch(Journey.objects.filter(patient=user.patient_profile))
         
         elif user.is_doctor:
-            doctor = user.doctor_profile
-            org = doctor.organization
+            from rest_framework.exceptions import ValidationError
             
-            # Get patients who have granted consent to this org
-            consented_patients = HealthDataConsent.objects.filter(
-                requesting_org=org,
-                status='GRANTED'
-            ).values_list('patient_id', flat=True)
+            try:
+                limit = min(int(self.request.query_params.get('limit', self.DEFAULT_LIMIT)), self.MAX_LIMIT)
+                before = self.request.query_params.get('before')
+                before = int(before) if before else None
+            except ValueError:
+                raise ValidationError({"error": "limit and before must be integers"})
+            org_id = user.doctor_profile.organization_id
+            if org_id is None or limit < 1:
+                return Journey.objects.none()
             
-            # Journeys from own org OR from consented patients
-            return Journey.objects.filter(
-                Q(created_by_org=org) | Q(patient_id__in=consented_patients)
-            ).distinct()
+            # Journeys from own org or from consented patients, read from the
+            # (organization, journey) index of the access table
+            access_filter = {'org_access__organization_id': org_id}
+            if before is not None:
+                access_filter['org_access__journey_id__lt'] = before
+            journeys = Journey.objects.filter(**access_filter).order_by('-org_access__journey_id')
+            return JourneySerializer.prefetch(journeys)[:limit]
         
         return Journey.objects.none()
 
@@ -58,7 +70,7 @@ class JourneyDetailView(generics.RetrieveAPIView):
     serializer_class = JourneySerializer
     
     def get_queryset(self):
-        return Journey.objects.all()
+        return JourneySerializer.prefetch(Journey.objects.all())
     
     def retrieve(self, request, *args, **kwargs):
         journey = self.get_object()
@@ -70,19 +82,8 @@ class JourneyDetailView(generics.RetrieveAPIView):
                 return Response({"error": "Not your journey"}, status=status.HTTP_403_FORBIDDEN)
         
         elif user.is_doctor:
-            doctor = user.doctor_profile
-            org = doctor.organization
-            
             # Check if doctor's org created this journey OR has consent
-            has_consent = HealthDataConsent.objects.filter(
-                patient=journey.patient,
-                requesting_org=org,
-                status='GRANTED'
-            ).exists()
-            
-            journey_from_own_org = journey.created_by_org == org
-            
-            if not (journey_from_own_org or has_consent):
+            if not access.can_access_journey(user.doctor_profile.organization_id, journey):
                 return Response(
                     {"error": "Consent required to view this journey"},
                     status=status.HTTP_403_FORBIDDEN
@@ -149,6 +150,7 @@ class RequestAccessByAbhaView(views.APIView):
                 existing.purpose = purpose
                 existing.requesting_doctor = doctor
                 existing.save()
+                access.consent_changed(existing)
                 return Response({"message": "New access request submitted", "consent": HealthDataConsentSerializer(existing).data})
         
         # Create new consent request
@@ -159,6 +161,7 @@ class RequestAccessByAbhaView(views.APIView):
             purpose=purpose,
             status='PENDING'
         )
+        access.consent_changed(consent)
         
         return Response({
             "message": "Access request sent to patient",
@@ -209,9 +212,13 @@ class ConsentRespondView(views.APIView):
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        consent.status = serializer.validated_data['status']
-        consent.responded_at = timezone.now()
-        consent.save()
+        # The cached decision is replaced before the change commits, so a
+        # revocation is never served from the cache
+        with transaction.atomic():
+            consent.status = serializer.validated_data['status']
+            consent.responded_at = timezone.now()
+            consent.save()
+            access.consent_changed(consent)
         
         return Response({
             "message": f"Consent {consent.status.lower()}",
@@ -243,17 +250,8 @@ class FetchJourneysByAbhaView(views.APIView):
             journeys = Journey.objects.filter(patient=patient)
         
         elif user.is_doctor:
-            doctor = user.doctor_profile
-            org = doctor.organization
-            
             # Check consent
-            has_consent = HealthDataConsent.objects.filter(
-                patient=patient,
-                requesting_org=org,
-                status='GRANTED'
-            ).exists()
-            
-            if not has_consent:
+            if not access.has_consent(user.doctor_profile.organization_id, patient.id):
                 return Response({
                     "error": "Consent required",
                     "message": "You must request and receive consent from the patient to view their data."
@@ -270,7 +268,7 @@ class FetchJourneysByAbhaView(views.APIView):
         else:
             return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
         
-        serializer = JourneySerializer(journeys, many=True)
+        serializer = JourneySerializer(JourneySerializer.prefetch(journeys), many=True)
         return Response({
             "patient_abha_id": abha_id,
             "patient_name": f"{patient.user.first_name} {patient.user.last_name}",
@@ -357,19 +355,8 @@ class ReportDownloadView(views.APIView):
                 return Response({"error": "Not your report"}, status=status.HTTP_403_FORBIDDEN)
         
         elif user.is_doctor:
-            doctor = user.doctor_profile
-            org = doctor.organization
-            
             # Check consent
-            has_consent = HealthDataConsent.objects.filter(
-                patient=step.journey.patient,
-                requesting_org=org,
-                status='GRANTED'
-            ).exists()
-            
-            journey_from_own_org = step.journey.created_by_org == org
-            
-            if not (journey_from_own_org or has_consent):
+            if not access.can_access_journey(user.doctor_profile.organization_id, step.journey):
                 return Response({"error": "Consent required"}, status=status.HTTP_403_FORBIDDEN)
         
         elif user.is_provider:
@@ -424,15 +411,7 @@ class OrderTestView(views.APIView):
             return Response({"error": "Journey not found"}, status=status.HTTP_404_NOT_FOUND)
         
         # Check consent
-        has_consent = HealthDataConsent.objects.filter(
-            patient=journey.patient,
-            requesting_org=org,
-            status='GRANTED'
-        ).exists()
-        
-        journey_from_own_org = journey.created_by_org == org
-        
-        if not (journey_from_own_org or has_consent):
+        if not access.can_access_journey(doctor.organization_id, journey):
             return Response({"error": "Consent required to modify this journey"}, status=status.HTTP_403_FORBIDDEN)
         
         # Get assigned lab if specified
@@ -494,15 +473,7 @@ class WritePrescriptionView(views.APIView):
             return Response({"error": "Journey not found"}, status=status.HTTP_404_NOT_FOUND)
         
         # Check consent
-        has_consent = HealthDataConsent.objects.filter(
-            patient=journey.patient,
-            requesting_org=org,
-            status='GRANTED'
-        ).exists()
-        
-        journey_from_own_org = journey.created_by_org == org
-        
-        if not (journey_from_own_org or has_consent):
+        if not access.can_access_journey(doctor.organization_id, journey):
             return Response({"error": "Consent required to modify this journey"}, status=status.HTTP_403_FORBIDDEN)
         
         # Create PHARMACY step
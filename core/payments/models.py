@@ -1,6 +1,7 @@
 from django.db import models
+from django.db.models import Case, F, Value, When
 from django.conf import settings
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 
 
 TRANSACTION_TYPES = (
@@ -19,6 +20,15 @@ TRANSACTION_REASONS = (
 # Platform commission rate (5%)
 COMMISSION_RATE = Decimal("0.05")
 
+# Kept by the doctor when a paid appointment is cancelled (5%)
+CANCELLATION_FEE_RATE = Decimal("0.05")
+
+
+def cancellation_split(amount):
+    """(refund, cancellation_fee) for cancelling a paid consultation of `amount`"""
+    fee = (amount * CANCELLATION_FEE_RATE).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    return amount - fee, fee
+
 
 class Wallet(models.Model):
     """Virtual wallet for all users (patients, doctors, providers)"""
@@ -64,6 +74,39 @@ class Wallet(models.Model):
             description=description
         )
 
+    @classmethod
+    def post_batch(cls, transactions):
+        """
+        Record many unsaved Transactions at once: one bulk INSERT, and one
+        UPDATE that applies each wallet's net change. Balances are not
+        checked here; debits must already be known to be covered.
+        Call inside transaction.atomic().
+        """
+        if not transactions:
+            return []
+        deltas = {}
+        for entry in transactions:
+            sign = 1 if entry.type == "CREDIT" else -1
+            deltas[entry.wallet_id] = deltas.get(entry.wallet_id, Decimal("0.00")) + sign * entry.amount
+        output = models.DecimalField(max_digits=10, decimal_places=2)
+        cls.objects.filter(pk__in=list(deltas)).update(
+            balance=F("balance") + Case(
+                *[When(pk=wallet_id, then=Value(delta, output_field=output)) for wallet_id, delta in deltas.items()],
+                output_field=output
+            )
+        )
+        return Transaction.objects.bulk_create(transactions)
+
+    @classmethod
+    def for_users(cls, user_ids):
+        """{user_id: wallet}, creating the missing wallets in one INSERT"""
+        wallets = {wallet.user_id: wallet for wallet in cls.objects.filter(user_id__in=user_ids)}
+        missing = [cls(user_id=user_id) for user_id in set(user_ids) - set(wallets)]
+        if missing:
+            cls.objects.bulk_create(missing, ignore_conflicts=True)
+            wallets.update({wallet.user_id: wallet for wallet in cls.objects.filter(user_id__in=[w.user_id for w in missing])})
+        return wallets
+
 
 class Transaction(models.Model):
     """Record of all wallet transactions"""
@@ -1,3 +1,36 @@
+from decimal import Decimal
+
+from django.db import transaction
 from django.test import TestCase
 
-# Create your tests here.
+from users.models import User
+from .models import Transaction, Wallet
+
+
+class PostBatchTests(TestCase):
+    """Wallet.post_batch applies each wallet's net change once and records every entry"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user("alice@example.com", "pw", type="PATIENT").wallet
+        self.bob = User.objects.create_user("bob@example.com", "pw", type="DOCTOR").wallet
+        Wallet.objects.filter(pk=self.bob.pk).update(balance=Decimal("100.00"))
+
+    def test_net_balances_and_rows(self):
+        entries = [
+            Transaction(wallet=self.alice, amount=Decimal("47.50"), type="CREDIT", reason="REFUND"),
+            Transaction(wallet=self.alice, amount=Decimal("47.50"), type="CREDIT", reason="REFUND"),
+            Transaction(wallet=self.bob, amount=Decimal("47.50"), type="DEBIT", reason="REFUND"),
+        ]
+        with transaction.atomic():
+            Wallet.post_batch(entries)
+
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal("95.00"))
+        self.assertEqual(self.bob.balance, Decimal("52.50"))
+        self.assertEqual(Transaction.objects.filter(wallet=self.alice, type="CREDIT").count(), 2)
+        self.assertEqual(Transaction.objects.filter(wallet=self.bob, type="DEBIT").count(), 1)
+
+    def test_empty_batch(self):
+        self.assertEqual(Wallet.post_batch([]), [])
+        self.assertFalse(Transaction.objects.exists())
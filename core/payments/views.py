@@ -116,7 +116,7 @@ class AppointmentPaymentView(views.APIView):
         
         # Mark appointment as paid
         appointment.is_paid = True
-        appointment.save()
+        appointment.save(update_fields=['is_paid'])
         
         return Response({
             "message": "Payment successful",